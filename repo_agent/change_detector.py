@@ -6,6 +6,7 @@ import git
 from colorama import Fore, Style
 
 from repo_agent.file_handler import FileHandler
+from repo_agent.hierarchy_store import SHARD_DIR_NAME
 from repo_agent.settings import SettingsManager
 
 
@@ -156,6 +157,7 @@ class ChangeDetector:
         This method retrieves all unstaged files in the repository that meet one of the following conditions:
         1. The file, when its extension is changed to .md, corresponds to a file that is already staged.
         2. The file's path is the same as the 'project_hierarchy' field in the CONFIG.
+        3. The file is a record file or the manifest of the sharded project hierarchy layout.
 
         It returns a list of the paths of these files.
 
@@ -175,6 +177,7 @@ class ChangeDetector:
         setting = SettingsManager.get_setting()
 
         project_hierarchy = setting.project.hierarchy_name
+        sharded_hierarchy_path = os.path.join(project_hierarchy, SHARD_DIR_NAME, "")
         # diffs是所有未暂存更改文件的列表。这些更改文件是相对于工作区（working directory）的，也就是说，它们是自上次提交（commit）以来在工作区发生的更改，但还没有被添加到暂存区（staging area）
         # 比如原本存在的md文件现在由于代码的变更发生了更新，就会标记为未暂存diff
         diffs = self.repo.index.diff(None)
@@ -188,6 +191,9 @@ class ChangeDetector:
             # 连接repo_path和untracked_file以获取完整的绝对路径
             if untracked_file.startswith(setting.project.markdown_docs_name):
                 to_be_staged_files.append(untracked_file)
+            elif untracked_file.startswith(sharded_hierarchy_path):
+                # sharded格式下新源文件对应的shard是新建的，也要add
+                to_be_staged_files.append(untracked_file)
             continue
             print(f"rel_untracked_file:{rel_untracked_file}")
             # import pdb; pdb.set_trace()
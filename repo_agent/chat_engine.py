@@ -1,9 +1,110 @@
+import asyncio
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import openai
+
 from llama_index.llms.openai_like import OpenAILike
 
 from repo_agent.doc_meta_info import DocItem
+from repo_agent.llm_pool import LlmEndpointPool
 from repo_agent.log import logger
-from repo_agent.prompt import chat_template
+from repo_agent.multi_task_dispatch import AdaptiveConcurrencyLimiter, get_backoff_delay
+from repo_agent.prompt import batch_chat_template, batch_object_template, chat_template
+from repo_agent.prompt_budget import (
+    PromptBudgetStats,
+    ReferenceCandidate,
+    TokenCounter,
+    fit_references,
+    get_tree_distance,
+    summarize_omitted,
+)
+from repo_agent.response_cache import LLM_CACHE_NAME, ResponseCache, make_cache_key
 from repo_agent.settings import SettingsManager
+from repo_agent.stream_metrics import StreamMetrics, StreamStats
+
+
+REFERENCE_HEADER = """As you can see, the code calls the following objects, their code and docs are as following:"""
+REFERENCER_HEADER = """Also, the code has been called by the following objects, their code and docs are as following:"""
+
+
+def join_section(header: str, texts: list) -> str:
+    if len(texts) == 0:
+        return ""
+    return "\n".join([header] + texts)
+
+
+BATCH_DOC_MARKER = re.compile(r"^\s*\[\[DOC (\d+)\]\]\s*$")
+
+
+def parse_batch_response(content: str, object_count: int) -> Dict[int, str]:
+    """
+    Split the response of a batched prompt into the documents of its objects.
+
+    Args:
+        content (str): The response, each document starts with a line `[[DOC N]]`, N counting from 1.
+        object_count (int): The number of objects in the batched prompt.
+
+    Returns:
+        Dict[int, str]: The 0-based object index -> document, only for objects with exactly one non-empty document.
+    """
+    sections: Dict[int, List[List[str]]] = {}
+    current = None
+    for line in (content or "").splitlines():
+        marker = BATCH_DOC_MARKER.match(line)
+        if marker is not None:
+            current = []
+            sections.setdefault(int(marker.group(1)) - 1, []).append(current)
+        elif current is not None:
+            current.append(line)
+    docs = {}
+    for index, documents in sections.items():
+        if 0 <= index < object_count and len(documents) == 1:
+            document = "\n".join(documents[0]).strip()
+            if document:
+                docs[index] = document
+    return docs
+
+
+DEFAULT_COMPLETION_TOKENS = 1024  # 没有设置max_completion_tokens时，token预算按这么多预估生成长度
+
+
+def classify_llm_error(error: Exception) -> Tuple[bool, bool]:
+    """返回(是否被限流, 是否值得重试)，超时、连接错误和服务端错误说明后端过载，可以重试"""
+    if isinstance(error, openai.RateLimitError):
+        return True, True
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+        return False, True
+    if isinstance(error, openai.APIStatusError) and error.status_code in (408, 409, 429):
+        return error.status_code == 429, True
+    return False, False
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """后端本身的故障(连接失败、超时、服务端错误)，而不是限流或者请求有问题"""
+    return isinstance(error, (openai.APIConnectionError, openai.InternalServerError))
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """服务端在Retry-After响应头中要求的等待秒数"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_total_tokens(response) -> Optional[int]:
+    usage = getattr(response.raw, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+def is_cut_off(response) -> bool:
+    """响应(流式时为最后一个chunk)是否因为达到max_tokens被截断"""
+    choices = getattr(response.raw, "choices", None) or []
+    return len(choices) > 0 and getattr(choices[0], "finish_reason", None) == "length"
 
 
 class ChatEngine:
@@ -14,15 +115,71 @@ class ChatEngine:
     def __init__(self, project_manager):
         setting = SettingsManager.get_setting()
 
-        self.llm = OpenAILike(
-            api_key=setting.chat_completion.openai_api_key.get_secret_value(),
-            api_base=setting.chat_completion.openai_base_url,
-            timeout=setting.chat_completion.request_timeout,
-            model=setting.chat_completion.model,
-            temperature=setting.chat_completion.temperature,
-            max_retries=1,
-            is_chat_model=True,
+        def make_llm(api_base: str, api_key=None, model=None) -> OpenAILike:
+            return OpenAILike(
+                api_key=api_key or setting.chat_completion.openai_api_key.get_secret_value(),
+                api_base=api_base,
+                timeout=setting.chat_completion.request_timeout,
+                model=model or setting.chat_completion.model,
+                temperature=setting.chat_completion.temperature,
+                max_retries=1,
+                is_chat_model=True,
+                max_tokens=setting.project.max_completion_tokens or None,
+            )
+
+        self.llm = make_llm(setting.chat_completion.openai_base_url)
+        self.llm_pool = None
+        if setting.project.llm_servers:
+            self.llm_pool = LlmEndpointPool.from_models_config(
+                setting.project.models_config_path,
+                setting.project.llm_servers,
+                make_llm,
+                routing=setting.project.llm_routing,
+                health_check_interval=setting.project.health_check_interval,
+            ).start()
+        # 缓存按模型区分，多个后端的模型不同时按所有模型的组合区分
+        self.models = (
+            sorted({endpoint.llm.model for endpoint in self.llm_pool.endpoints})
+            if self.llm_pool is not None
+            else [self.llm.model]
         )
+        if len(self.models) > 1:
+            logger.warning(
+                f"The LLM servers run different models ({', '.join(self.models)}), the same object may get a different document on every run."
+            )
+        self.stream = setting.project.stream
+        self.max_completion_tokens = setting.project.max_completion_tokens
+        self.stream_stats = StreamStats()
+        self.max_retries = setting.project.llm_max_retries
+        self.limiter = None
+        if (
+            setting.project.adaptive_concurrency
+            or setting.project.requests_per_minute > 0
+            or setting.project.tokens_per_minute > 0
+        ):
+            # 所有worker共用同一个ChatEngine，也就共用同一个限流器
+            self.limiter = AdaptiveConcurrencyLimiter(
+                max_limit=(
+                    setting.project.max_concurrent_requests
+                    if setting.project.async_mode
+                    else setting.project.max_thread_count
+                ),
+                adaptive=setting.project.adaptive_concurrency,
+                requests_per_minute=setting.project.requests_per_minute,
+                tokens_per_minute=setting.project.tokens_per_minute,
+            )
+        self.response_cache = None
+        if setting.project.llm_cache_size > 0:
+            self.response_cache = ResponseCache(
+                setting.project.target_repo / setting.project.hierarchy_name / LLM_CACHE_NAME,
+                max_entries=setting.project.llm_cache_size,
+                bypass=setting.project.bypass_llm_cache,
+            )
+        self.max_prompt_tokens = setting.project.max_prompt_tokens
+        self.token_counter = None
+        if self.max_prompt_tokens > 0 or setting.project.tokens_per_minute > 0:
+            self.token_counter = TokenCounter(self.models[0])  # 多个模型时只是近似
+        self.prompt_stats = PromptBudgetStats()
 
     def build_prompt(self, doc_item: DocItem):
         """Builds and returns the system and user prompts based on the DocItem."""
@@ -37,34 +194,6 @@ class ChatEngine:
         have_return = code_info["have_return"]
         file_path = doc_item.get_full_name()
 
-        def get_referenced_prompt(doc_item: DocItem) -> str:
-            if len(doc_item.reference_who) == 0:
-                return ""
-            prompt = [
-                """As you can see, the code calls the following objects, their code and docs are as following:"""
-            ]
-            for reference_item in doc_item.reference_who:
-                instance_prompt = (
-                    f"""obj: {reference_item.get_full_name()}\nDocument: \n{reference_item.md_content[-1] if len(reference_item.md_content) > 0 else 'None'}\nRaw code:```\n{reference_item.content['code_content'] if 'code_content' in reference_item.content.keys() else ''}\n```"""
-                    + "=" * 10
-                )
-                prompt.append(instance_prompt)
-            return "\n".join(prompt)
-
-        def get_referencer_prompt(doc_item: DocItem) -> str:
-            if len(doc_item.who_reference_me) == 0:
-                return ""
-            prompt = [
-                """Also, the code has been called by the following objects, their code and docs are as following:"""
-            ]
-            for referencer_item in doc_item.who_reference_me:
-                instance_prompt = (
-                    f"""obj: {referencer_item.get_full_name()}\nDocument: \n{referencer_item.md_content[-1] if len(referencer_item.md_content) > 0 else 'None'}\nRaw code:```\n{referencer_item.content['code_content'] if 'code_content' in referencer_item.content.keys() else 'None'}\n```"""
-                    + "=" * 10
-                )
-                prompt.append(instance_prompt)
-            return "\n".join(prompt)
-
         def get_relationship_description(referencer_content, reference_letter):
             if referencer_content and reference_letter:
                 return "And please include the reference relationship with its callers and callees in the project from a functional perspective"
@@ -90,43 +219,454 @@ class ChatEngine:
             else ""
         )
 
-        referencer_content = get_referencer_prompt(doc_item)
-        reference_letter = get_referenced_prompt(doc_item)
+        reference_texts = [
+            self.render_reference(reference_item, missing_code="")
+            for reference_item in doc_item.reference_who
+        ]
+        referencer_texts = [
+            self.render_reference(referencer_item, missing_code="None")
+            for referencer_item in doc_item.who_reference_me
+        ]
+        reference_letter = join_section(REFERENCE_HEADER, reference_texts)
+        referencer_content = join_section(REFERENCER_HEADER, referencer_texts)
         has_relationship = get_relationship_description(
             referencer_content, reference_letter
         )
 
         project_structure_prefix = ", and the related hierarchical structure of this project is as follows (The current object is marked with an *):"
 
-        return chat_template.format_messages(
-            combine_ref_situation=combine_ref_situation,
-            file_path=file_path,
-            project_structure_prefix=project_structure_prefix,
-            code_type_tell=code_type_tell,
-            code_name=code_name,
-            code_content=code_content,
-            have_return_tell=have_return_tell,
-            has_relationship=has_relationship,
-            reference_letter=reference_letter,
-            referencer_content=referencer_content,
-            parameters_or_attribute=parameters_or_attribute,
+        def render(reference_letter: str, referencer_content: str):
+            return chat_template.format_messages(
+                combine_ref_situation=combine_ref_situation,
+                file_path=file_path,
+                project_structure_prefix=project_structure_prefix,
+                code_type_tell=code_type_tell,
+                code_name=code_name,
+                code_content=code_content,
+                have_return_tell=have_return_tell,
+                has_relationship=has_relationship,
+                reference_letter=reference_letter,
+                referencer_content=referencer_content,
+                parameters_or_attribute=parameters_or_attribute,
+                language=setting.project.language,
+            )
+
+        if self.max_prompt_tokens == 0:
+            return render(reference_letter, referencer_content)
+
+        # 先算不含引用关系的部分，全部引用都放得下时prompt和不限预算时完全一样
+        base_tokens = self.count_message_tokens(render("", ""))
+        full_tokens = (
+            base_tokens
+            + self.token_counter.count(reference_letter)
+            + self.token_counter.count(referencer_content)
+        )
+        if full_tokens <= self.max_prompt_tokens:
+            self.prompt_stats.record(full_tokens, full_tokens, self.max_prompt_tokens)
+            return render(reference_letter, referencer_content)
+
+        candidates = [
+            ReferenceCandidate(
+                doc_item=item,
+                is_referencer=is_referencer,
+                full_text=text,
+                brief_text=self.render_reference_brief(item),
+                distance=get_tree_distance(doc_item, item),
+            )
+            for items, texts, is_referencer in (
+                (doc_item.reference_who, reference_texts, False),
+                (doc_item.who_reference_me, referencer_texts, True),
+            )
+            for item, text in zip(items, texts)
+        ]
+        header_tokens = self.token_counter.count(
+            (REFERENCE_HEADER if reference_texts else "")
+            + (REFERENCER_HEADER if referencer_texts else "")
+        )
+        kept, omitted = fit_references(
+            candidates,
+            self.max_prompt_tokens - base_tokens - header_tokens,
+            self.token_counter,
+        )
+        sections = []
+        for is_referencer, header in ((False, REFERENCE_HEADER), (True, REFERENCER_HEADER)):
+            texts = [text for c, text in kept if c.is_referencer == is_referencer]
+            summary = summarize_omitted(
+                [c for c in omitted if c.is_referencer == is_referencer],
+                self.token_counter,
+            )
+            sections.append(join_section(header, texts + ([summary] if summary else [])))
+        messages = render(*sections)
+        self.prompt_stats.record(
+            full_tokens, self.count_message_tokens(messages), self.max_prompt_tokens
+        )
+        logger.debug(
+            f"Trimmed the references of {doc_item.get_full_name()}: {len(kept)} kept, {len(omitted)} omitted"
+        )
+        return messages
+
+    @staticmethod
+    def render_reference(reference_item: DocItem, missing_code: str) -> str:
+        """引用关系中一个对象的文档和源码"""
+        return (
+            f"""obj: {reference_item.get_full_name()}\nDocument: \n{reference_item.md_content[-1] if len(reference_item.md_content) > 0 else 'None'}\nRaw code:```\n{reference_item.content['code_content'] if 'code_content' in reference_item.content.keys() else missing_code}\n```"""
+            + "=" * 10
+        )
+
+    @staticmethod
+    def render_reference_brief(reference_item: DocItem) -> str:
+        """预算不够时的简短写法：有文档时只保留文档，否则只保留源码的第一行"""
+        if len(reference_item.md_content) > 0:
+            return (
+                f"""obj: {reference_item.get_full_name()}\nDocument: \n{reference_item.md_content[-1]}\n"""
+                + "=" * 10
+            )
+        code_lines = reference_item.content.get("code_content", "").strip().splitlines()
+        return (
+            f"""obj: {reference_item.get_full_name()}\nSignature: {code_lines[0] if code_lines else 'None'}\n"""
+            + "=" * 10
+        )
+
+    def count_message_tokens(self, messages) -> int:
+        return sum(self.token_counter.count(message.content or "") for message in messages)
+
+    def log_prompt_stats(self):
+        self.prompt_stats.log_stats()
+
+    def build_batch_prompt(self, doc_items: List[DocItem]):
+        """Builds the prompt that documents several small objects of the same file in one request.
+
+        Callers and callees are only listed by name, the code of small objects rarely needs more context.
+        """
+        setting = SettingsManager.get_setting()
+
+        objects = []
+        for index, doc_item in enumerate(doc_items, start=1):
+            relationships = ""
+            if doc_item.reference_who:
+                relationships += f"Calls: {', '.join(item.get_full_name() for item in doc_item.reference_who)}\n"
+            if doc_item.who_reference_me:
+                relationships += f"Called by: {', '.join(item.get_full_name() for item in doc_item.who_reference_me)}\n"
+            objects.append(
+                batch_object_template.format(
+                    index=index,
+                    code_type_tell="Class" if doc_item.content["type"] == "ClassDef" else "Function",
+                    code_name=doc_item.content["name"],
+                    object_path=doc_item.get_full_name(),
+                    have_return_tell=", has a return value" if doc_item.content["have_return"] else "",
+                    relationships=relationships,
+                    code_content=doc_item.content["code_content"],
+                )
+            )
+        return batch_chat_template.format_messages(
+            file_path=doc_items[0].get_file_name(),
+            objects="\n\n".join(objects),
+            object_count=len(doc_items),
             language=setting.project.language,
         )
 
-    def generate_doc(self, doc_item: DocItem):
-        """Generates documentation for a given DocItem."""
-        messages = self.build_prompt(doc_item)
+    def generate_docs(self, doc_items: List[DocItem]) -> Dict[int, str]:
+        """
+        Generates the documentation of several small objects with one batched request.
+
+        Args:
+            doc_items (List[DocItem]): Objects of the same file.
+
+        Returns:
+            Dict[int, str]: The index in doc_items -> document, objects whose document could not be parsed are missing.
+        """
+        messages = self.build_batch_prompt(doc_items)
+        cache_key = self.get_cache_key(messages)
+        cached = self.get_cached_response(cache_key)
+        if cached is not None:
+            return parse_batch_response(cached, len(doc_items))
+
+        try:
+            content, finished = self.complete(messages, doc_items[0].get_file_name())
+        except Exception as e:
+            logger.error(f"Error in llamaindex batched chat call: {e}")
+            raise
+        docs = parse_batch_response(content, len(doc_items))
+        if finished and len(docs) == len(doc_items):  # 只缓存完整解析的响应
+            self.cache_response(cache_key, content)
+        return docs
+
+    async def agenerate_docs(self, doc_items: List[DocItem]) -> Dict[int, str]:
+        """Asynchronous version of generate_docs."""
+        messages = self.build_batch_prompt(doc_items)
+        cache_key = self.get_cache_key(messages)
+        cached = await asyncio.to_thread(self.get_cached_response, cache_key)
+        if cached is not None:
+            return parse_batch_response(cached, len(doc_items))
+
+        try:
+            content, finished = await self.acomplete(messages, doc_items[0].get_file_name())
+        except Exception as e:
+            logger.error(f"Error in llamaindex async batched chat call: {e}")
+            raise
+        docs = parse_batch_response(content, len(doc_items))
+        if finished and len(docs) == len(doc_items):
+            await asyncio.to_thread(self.cache_response, cache_key, content)
+        return docs
+
+    def complete(self, messages, name: str = "") -> Tuple[str, bool]:
+        """
+        Sends the messages to the LLM, streaming the response in streaming mode.
+
+        The request waits for the shared concurrency limiter, and is retried with jittered exponential
+        backoff on rate limits, timeouts, connection errors and server errors.
+
+        Args:
+            messages: The chat messages.
+            name (str, optional): The object(s) the response documents, for the logs.
+
+        Returns:
+            Tuple[str, bool]: The response, and False if it was cut off at the max completion tokens.
+        """
+        reserved_tokens = self.estimate_request_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire(reserved_tokens)
+            try:
+                content, finished, latency, used_tokens = self.call_llm(messages, name)
+            except Exception as e:
+                delay = self.on_llm_error(e, attempt, reserved_tokens, name)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            if self.limiter is not None:
+                self.release_limiter(latency, reserved_tokens, used_tokens)
+            return content, finished
+        raise AssertionError("unreachable")
+
+    async def acomplete(self, messages, name: str = "") -> Tuple[str, bool]:
+        """Asynchronous version of complete."""
+        reserved_tokens = self.estimate_request_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                await self.limiter.aacquire(reserved_tokens)
+            try:
+                content, finished, latency, used_tokens = await self.acall_llm(messages, name)
+            except Exception as e:
+                delay = self.on_llm_error(e, attempt, reserved_tokens, name)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            if self.limiter is not None:
+                self.release_limiter(latency, reserved_tokens, used_tokens)
+            return content, finished
+        raise AssertionError("unreachable")
+
+    def release_limiter(self, latency: float, reserved_tokens: int, used_tokens: Optional[int]):
+        """把成功的请求报告给限流器。只有流式的首个token延迟用来判断拥塞，完整响应的耗时主要取决于输出的长度"""
+        self.limiter.release(
+            latency=latency if self.stream else None,
+            reserved_tokens=reserved_tokens,
+            used_tokens=used_tokens,
+        )
+
+    def estimate_request_tokens(self, messages) -> int:
+        """token预算用的估计值：prompt的token数加上最多生成的token数"""
+        if self.limiter is None or self.limiter.token_bucket is None:
+            return 0
+        return self.count_message_tokens(messages) + (
+            self.max_completion_tokens or DEFAULT_COMPLETION_TOKENS
+        )
+
+    def on_llm_error(self, error: Exception, attempt: int, reserved_tokens: int, name: str):
+        """把失败报告给限流器，返回重试前等待的秒数，不重试时返回None"""
+        rate_limited, retryable = classify_llm_error(error)
+        if self.limiter is not None:
+            # 请求失败时不知道实际用了多少token，按预估的算
+            self.limiter.release(
+                rate_limited=rate_limited,
+                failed=retryable,
+                error=not retryable,
+                reserved_tokens=reserved_tokens,
+            )
+        if not retryable or attempt >= self.max_retries:
+            return None
+        if not rate_limited and self.llm_pool is not None and self.llm_pool.has_healthy_endpoint():
+            delay = 0.0  # 出错的后端已经被移出轮换，立即换一个后端重试
+        else:
+            delay = get_backoff_delay(attempt, retry_after=get_retry_after(error))
+        logger.warning(
+            f"LLM request for {name} failed ({type(error).__name__}), retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})"
+        )
+        return delay
+
+    def call_llm(self, messages, name: str) -> Tuple[str, bool, float, Optional[int]]:
+        """发送一次请求，配置了多个后端时由llm_pool选择后端"""
+        if self.llm_pool is None:
+            return self.request_llm(self.llm, messages, name)
+        endpoint = self.llm_pool.acquire()
+        try:
+            result = self.request_llm(endpoint.llm, messages, name)
+        except Exception as e:
+            self.llm_pool.release(endpoint, failed=is_endpoint_failure(e))
+            raise
+        self.llm_pool.release(endpoint, latency=result[2])
+        return result
 
+    async def acall_llm(self, messages, name: str) -> Tuple[str, bool, float, Optional[int]]:
+        """Asynchronous version of call_llm."""
+        if self.llm_pool is None:
+            return await self.arequest_llm(self.llm, messages, name)
+        endpoint = self.llm_pool.acquire()
         try:
-            response = self.llm.chat(messages)
-            logger.debug(f"LLM Prompt Tokens: {response.raw.usage.prompt_tokens}")  # type: ignore
-            logger.debug(
-                f"LLM Completion Tokens: {response.raw.usage.completion_tokens}"  # type: ignore
+            result = await self.arequest_llm(endpoint.llm, messages, name)
+        except Exception as e:
+            self.llm_pool.release(endpoint, failed=is_endpoint_failure(e))
+            raise
+        self.llm_pool.release(endpoint, latency=result[2])
+        return result
+
+    def request_llm(self, llm: OpenAILike, messages, name: str) -> Tuple[str, bool, float, Optional[int]]:
+        """发送一次请求，返回响应、是否完整、延迟(流式时为首个token的延迟)和实际用掉的token数"""
+        start_time = time.perf_counter()
+        if not self.stream:
+            response = llm.chat(messages)
+            self.log_token_usage(response)
+            return (
+                response.message.content,
+                not is_cut_off(response),
+                time.perf_counter() - start_time,
+                get_total_tokens(response),
             )
-            logger.debug(
-                f"Total LLM Token Count: {response.raw.usage.total_tokens}"  # type: ignore
+
+        metrics = StreamMetrics()
+        content = ""
+        chunk = None
+        stream = llm.stream_chat(messages)
+        try:
+            for chunk in stream:
+                metrics.on_delta(chunk.delta)
+                content = chunk.message.content or ""
+                if self.max_completion_tokens and metrics.token_count >= self.max_completion_tokens:
+                    # 有些后端不遵守max_tokens，由客户端停止接收
+                    metrics.finish(truncated=True)
+                    break
+        finally:
+            stream.close()
+        return self.finish_stream(metrics, messages, content, name, chunk)
+
+    async def arequest_llm(self, llm: OpenAILike, messages, name: str) -> Tuple[str, bool, float, Optional[int]]:
+        """Asynchronous version of request_llm."""
+        start_time = time.perf_counter()
+        if not self.stream:
+            response = await llm.achat(messages)
+            self.log_token_usage(response)
+            return (
+                response.message.content,
+                not is_cut_off(response),
+                time.perf_counter() - start_time,
+                get_total_tokens(response),
             )
-            return response.message.content
+
+        metrics = StreamMetrics()
+        content = ""
+        chunk = None
+        stream = await llm.astream_chat(messages)
+        try:
+            async for chunk in stream:
+                metrics.on_delta(chunk.delta)
+                content = chunk.message.content or ""
+                if self.max_completion_tokens and metrics.token_count >= self.max_completion_tokens:
+                    metrics.finish(truncated=True)
+                    break
+        finally:
+            await stream.aclose()
+        return self.finish_stream(metrics, messages, content, name, chunk)
+
+    def finish_stream(self, metrics: StreamMetrics, messages, content: str, name: str, last_chunk=None):
+        if metrics.end_time is None:
+            # 后端按max_tokens停止时，最后一个chunk的finish_reason是length
+            metrics.finish(truncated=last_chunk is not None and is_cut_off(last_chunk))
+        self.stream_stats.record(metrics, name)
+        used_tokens = None
+        if self.limiter is not None and self.limiter.token_bucket is not None:
+            used_tokens = self.count_message_tokens(messages) + metrics.token_count
+        latency = metrics.time_to_first_token
+        if latency is None:
+            latency = metrics.end_time - metrics.start_time
+        return content, not metrics.truncated, latency, used_tokens
+
+    def log_stream_stats(self):
+        self.stream_stats.log_stats()
+
+    def log_llm_pool_stats(self):
+        if self.llm_pool is not None:
+            self.llm_pool.log_stats()
+
+    def log_concurrency_stats(self):
+        if self.limiter is not None:
+            self.limiter.log_stats()
+
+    def log_token_usage(self, response):
+        """Logs the token usage reported by the LLM backend for a chat response."""
+        if getattr(response.raw, "usage", None) is None:  # 有些后端不返回用量
+            return
+        logger.debug(f"LLM Prompt Tokens: {response.raw.usage.prompt_tokens}")  # type: ignore
+        logger.debug(
+            f"LLM Completion Tokens: {response.raw.usage.completion_tokens}"  # type: ignore
+        )
+        logger.debug(
+            f"Total LLM Token Count: {response.raw.usage.total_tokens}"  # type: ignore
+        )
+
+    def get_cache_key(self, messages) -> str:
+        return make_cache_key("+".join(self.models), self.llm.temperature, messages)
+
+    def get_cached_response(self, cache_key: str):
+        if self.response_cache is None:
+            return None
+        return self.response_cache.get(cache_key)
+
+    def cache_response(self, cache_key: str, content):
+        if self.response_cache is not None and content:
+            self.response_cache.put(cache_key, content)
+
+    def close_response_cache(self):
+        """输出命中率，并淘汰超出上限的缓存条目"""
+        if self.response_cache is not None:
+            self.response_cache.log_stats()
+            self.response_cache.close()
+
+    def generate_doc(self, doc_item: DocItem):
+        """Generates documentation for a given DocItem, reusing the cached response of an identical prompt."""
+        messages = self.build_prompt(doc_item)
+        cache_key = self.get_cache_key(messages)
+        cached = self.get_cached_response(cache_key)
+        if cached is not None:
+            logger.debug(f"LLM response cache hit: {doc_item.get_full_name()}")
+            return cached
+
+        try:
+            content, finished = self.complete(messages, doc_item.get_full_name())
         except Exception as e:
             logger.error(f"Error in llamaindex chat call: {e}")
             raise
+        if finished:  # 被截断的响应不缓存
+            self.cache_response(cache_key, content)
+        return content
+
+    async def agenerate_doc(self, doc_item: DocItem):
+        """Asynchronously generates documentation for a given DocItem, reusing the cached response of an identical prompt."""
+        messages = self.build_prompt(doc_item)
+        cache_key = self.get_cache_key(messages)
+        # SQLite是同步IO，放到线程里执行，避免阻塞事件循环
+        cached = await asyncio.to_thread(self.get_cached_response, cache_key)
+        if cached is not None:
+            logger.debug(f"LLM response cache hit: {doc_item.get_full_name()}")
+            return cached
+
+        try:
+            content, finished = await self.acomplete(messages, doc_item.get_full_name())
+        except Exception as e:
+            logger.error(f"Error in llamaindex async chat call: {e}")
+            raise
+        if finished:
+            await asyncio.to_thread(self.cache_response, cache_key, content)
+        return content
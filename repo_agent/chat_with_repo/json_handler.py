@@ -1,18 +1,49 @@
 import json
+import os
 import sys
 
+from repo_agent.hierarchy_store import (
+    SQLITE_DB_NAME,
+    ShardedHierarchyStore,
+    SqliteHierarchyStore,
+)
 from repo_agent.log import logger
 
 
+def get_sqlite_store(file_path):
+    """file_path是sqlite格式的数据库时返回对应的store，否则返回None"""
+    # file_path是SqliteHierarchyStore.path，也就是<hierarchy_name>/project_hierarchy.db
+    if os.path.basename(file_path) == SQLITE_DB_NAME and os.path.isfile(file_path):
+        return SqliteHierarchyStore(os.path.dirname(os.path.abspath(file_path)))
+    return None
+
+
+def load_json_or_shards(file_path):
+    """读取project_hierarchy：file_path是sharded格式的目录或者sqlite数据库时，把所有文件的记录合并成一个dict"""
+    sqlite_store = get_sqlite_store(file_path)
+    if sqlite_store is not None:
+        return dict(sqlite_store.load())
+    if os.path.isdir(file_path):
+        # file_path是ShardedHierarchyStore.path，也就是<hierarchy_name>/project_hierarchy
+        store = ShardedHierarchyStore(os.path.dirname(os.path.normpath(file_path)))
+        if not store.exists():
+            raise FileNotFoundError(f"No hierarchy manifest in {file_path}")
+        return dict(store.load())
+    with open(file_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
 class JsonFileProcessor:
     def __init__(self, file_path):
+        """
+        Args:
+            file_path: The project_hierarchy.json file, the directory of the sharded hierarchy layout, or the database of the sqlite layout.
+        """
         self.file_path = file_path
 
     def read_json_file(self):
         try:
-            with open(self.file_path, "r", encoding="utf-8") as file:
-                data = json.load(file)
-            return data
+            return load_json_or_shards(self.file_path)
         except FileNotFoundError:
             logger.exception(f"File not found: {self.file_path}")
             sys.exit(1)
@@ -90,16 +121,23 @@ class JsonFileProcessor:
     def search_code_contents_by_name(self, file_path, search_text):
         # Attempt to retrieve code from the JSON file
         try:
-            with open(file_path, "r", encoding="utf-8") as file:
-                data = json.load(file)
-                code_results = []
-                md_results = []  # List to store matching items' code_content and md_content
+            code_results = []
+            md_results = []  # List to store matching items' code_content and md_content
+            sqlite_store = get_sqlite_store(file_path)
+            if sqlite_store is not None:
+                # sqlite格式下直接走name索引，不需要加载整个hierarchy
+                for item in sqlite_store.find_items(name=search_text):
+                    if "code_content" in item:
+                        code_results.append(item["code_content"])
+                        md_results.append(item["md_content"])
+            else:
+                data = load_json_or_shards(file_path)
                 self.recursive_search(data, search_text, code_results, md_results)
-                # 确保无论结果如何都返回两个值
-                if code_results or md_results:
-                    return code_results, md_results
-                else:
-                    return ["No matching item found."], ["No matching item found."]
+            # 确保无论结果如何都返回两个值
+            if code_results or md_results:
+                return code_results, md_results
+            else:
+                return ["No matching item found."], ["No matching item found."]
         except FileNotFoundError:
             return "File not found."
         except json.JSONDecodeError:
@@ -110,9 +148,16 @@ class JsonFileProcessor:
     def search_in_json_nested(self, file_path, search_text):
         """Return the first matching dictionary with the requested name."""
 
+        sqlite_store = get_sqlite_store(file_path)
+        if sqlite_store is not None:
+            items = sqlite_store.find_items(name=search_text)
+            if not items:
+                raise ValueError(f"'{search_text}' not found in JSON")
+            items[0].pop("file_name")
+            return items[0]
+
         try:
-            with open(file_path, "r", encoding="utf-8") as file:
-                data = json.load(file)
+            data = load_json_or_shards(file_path)
         except FileNotFoundError:
             logger.exception("File not found during nested search: %s", file_path)
             raise
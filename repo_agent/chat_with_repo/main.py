@@ -2,6 +2,7 @@ import time
 
 from repo_agent.chat_with_repo.gradio_interface import GradioInterface
 from repo_agent.chat_with_repo.rag import RepoAssistant
+from repo_agent.hierarchy_store import get_hierarchy_store
 from repo_agent.log import logger
 from repo_agent.settings import SettingsManager
 
@@ -14,11 +15,10 @@ def main():
 
     api_key = setting.chat_completion.openai_api_key.get_secret_value()
     api_base = str(setting.chat_completion.openai_base_url)
-    db_path = (
-        setting.project.target_repo
-        / setting.project.hierarchy_name
-        / "project_hierarchy.json"
-    )
+    # project_hierarchy.json，或者sharded格式下存放shard的目录
+    db_path = get_hierarchy_store(
+        setting.project.target_repo / setting.project.hierarchy_name
+    ).path
 
     # Initialize RepoAssistant
     assistant = RepoAssistant(api_key, api_base, db_path)
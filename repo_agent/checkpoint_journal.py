@@ -0,0 +1,229 @@
+"""增量checkpoint：每生成一篇文档只往journal里追加一行，由后台线程定期把journal合并进project_hierarchy.json"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Set, Tuple
+
+from repo_agent.log import logger
+from repo_agent.utils.json_codec import get_json_codec
+
+if TYPE_CHECKING:
+    from repo_agent.doc_meta_info import DocItem, MetaInfo
+
+DOC_JOURNAL_NAME = "doc_journal.jsonl"
+
+_fdatasync = getattr(os, "fdatasync", os.fsync)  # macOS/Windows 没有 fdatasync
+
+
+def get_journal_path(target_dir_path: str | Path) -> Path:
+    return Path(target_dir_path) / DOC_JOURNAL_NAME
+
+
+def get_journal_segment_path(target_dir_path: str | Path, sequence: int) -> Path:
+    journal_name = Path(DOC_JOURNAL_NAME)
+    return Path(target_dir_path) / f"{journal_name.stem}.{sequence}{journal_name.suffix}"
+
+
+def get_journal_segments(target_dir_path: str | Path) -> List[Tuple[int, Path]]:
+    """合并时从journal轮转出来、还没有确认写进快照的分段，按序号从旧到新排列"""
+    journal_name = Path(DOC_JOURNAL_NAME)
+    segments = []
+    for segment_path in Path(target_dir_path).glob(
+        f"{journal_name.stem}.*{journal_name.suffix}"
+    ):
+        sequence = segment_path.name[len(journal_name.stem) + 1 : -len(journal_name.suffix)]
+        if sequence.isdigit():
+            segments.append((int(sequence), segment_path))
+    return sorted(segments)
+
+
+def make_journal_record(doc_item: DocItem) -> dict:
+    """一条journal记录：从repo根节点到对象的children key路径，以及对象最新的文档和状态"""
+    return {
+        "key_path": doc_item.get_key_path(),
+        "code_start_line": doc_item.code_start_line,
+        "md_content": doc_item.md_content,
+        "item_status": doc_item.item_status.name,
+    }
+
+
+def truncate_journal(target_dir_path: str | Path):
+    """journal中的内容都已经写进快照之后清空journal，并删除所有轮转出来的分段"""
+    journal_path = get_journal_path(target_dir_path)
+    if journal_path.exists():
+        os.truncate(journal_path, 0)
+    for _, segment_path in get_journal_segments(target_dir_path):
+        segment_path.unlink(missing_ok=True)
+
+
+def replay_journal(meta_info: MetaInfo, target_dir_path: str | Path) -> int:
+    """
+    Apply the journal left by an interrupted run on top of the loaded snapshot.
+
+    The rotated segments are applied from the oldest to the newest and the live journal last,
+    so the latest record of an object wins. A partially written last line (the process died in
+    the middle of an append) is ignored.
+
+    Args:
+        meta_info (MetaInfo): The MetaInfo loaded from project_hierarchy.json.
+        target_dir_path (str | Path): The directory that contains the snapshot and the journal.
+
+    Returns:
+        int: The number of records applied.
+    """
+    from repo_agent.doc_meta_info import DocItemStatus
+
+    journal_paths = [
+        segment_path for _, segment_path in get_journal_segments(target_dir_path)
+    ]
+    journal_paths.append(get_journal_path(target_dir_path))
+    codec = get_json_codec()
+    applied_count = 0
+    for journal_path in journal_paths:
+        if not journal_path.exists():
+            continue
+        with journal_path.open("rb") as reader:
+            for line in reader:
+                try:
+                    record = codec.loads(line)
+                except ValueError:
+                    logger.warning(f"Ignoring a truncated record in {journal_path}")
+                    continue
+                doc_item = meta_info.target_repo_hierarchical_tree.find(record["key_path"])
+                if doc_item is None or doc_item.code_start_line != record["code_start_line"]:
+                    continue
+                doc_item.md_content = record["md_content"]
+                doc_item.item_status = DocItemStatus[record["item_status"]]
+                applied_count += 1
+    if applied_count > 0:
+        logger.info(f"Replayed {applied_count} documents from {target_dir_path}")
+    return applied_count
+
+
+class CheckpointJournal:
+    """
+    Append-only journal of generated documents with a debounced background compactor.
+
+    `record` appends one JSON line per finished document and syncs it to disk, which costs
+    O(size of the document) instead of rewriting the whole hierarchy. A background thread folds
+    the journal into the snapshot with `MetaInfo.checkpoint` once `compact_every_items` records
+    are pending or `compact_interval` seconds have passed, whichever comes first.
+
+    Compaction only holds the journal lock while it renames the live journal to a numbered
+    segment. Records keep going to a fresh journal while the snapshot is written, and the
+    segment is deleted once the snapshot that contains it has been saved.
+    """
+
+    def __init__(
+        self,
+        meta_info: MetaInfo,
+        target_dir_path: str | Path,
+        compact_every_items: int = 50,
+        compact_interval: float = 30.0,
+    ):
+        """
+        Args:
+            meta_info (MetaInfo): The MetaInfo whose documents are journaled.
+            target_dir_path (str | Path): The directory of project_hierarchy.json.
+            compact_every_items (int, optional): Compact after this many pending records. Defaults to 50.
+            compact_interval (float, optional): Compact pending records at least this often, in seconds. Defaults to 30.0.
+        """
+        self.meta_info = meta_info
+        self.target_dir_path = Path(target_dir_path)
+        self.compact_every_items = compact_every_items
+        self.compact_interval = compact_interval
+        self.pending_count = 0
+        self.dirty_file_names: Set[str] = set()  # 有新文档、还没有合并进快照的文件
+        self.journal_lock = threading.Lock()  # 保护writer、pending_count和dirty_file_names
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.compactor_thread: Optional[threading.Thread] = None
+
+        self.target_dir_path.mkdir(parents=True, exist_ok=True)
+        self.codec = get_json_codec()
+        self.writer = get_journal_path(self.target_dir_path).open("ab")
+
+    def start(self):
+        self.compactor_thread = threading.Thread(
+            target=self.compactor_loop, name="checkpoint-compactor", daemon=True
+        )
+        self.compactor_thread.start()
+        return self
+
+    def record(self, doc_item: DocItem):
+        """追加一条记录并落盘，只在轮转journal时才会短暂等待合并"""
+        line = self.codec.dumps(make_journal_record(doc_item), compact=True)
+        with self.journal_lock:
+            self.writer.write(line + b"\n")
+            self.writer.flush()
+            _fdatasync(self.writer.fileno())
+            self.pending_count += 1
+            self.dirty_file_names.add(doc_item.get_file_name())
+            if self.pending_count >= self.compact_every_items:
+                self.wake_event.set()
+
+    def rotate(self) -> int:
+        """把当前的journal改名为一个新的分段，之后的记录写进新的journal，返回分段的序号"""
+        segments = get_journal_segments(self.target_dir_path)
+        sequence = segments[-1][0] + 1 if segments else 0
+        journal_path = get_journal_path(self.target_dir_path)
+        self.writer.close()  # Windows上不能改名打开着的文件
+        os.replace(journal_path, get_journal_segment_path(self.target_dir_path, sequence))
+        self.writer = journal_path.open("ab")
+        return sequence
+
+    def compact(self):
+        """把journal合并进快照
+
+        sharded格式下只重写有新文档的文件对应的shard
+        """
+        # 只在轮转时持有journal_lock，写快照期间record照常往新的journal里追加
+        with self.journal_lock:
+            if self.pending_count == 0:
+                return
+            sequence = self.rotate()
+            pending_count, self.pending_count = self.pending_count, 0
+            dirty_file_names, self.dirty_file_names = self.dirty_file_names, set()
+
+        # 轮转之后写进新journal的记录不一定在快照里，不能让checkpoint清空journal
+        saved = self.meta_info.checkpoint(
+            target_dir_path=self.target_dir_path,
+            dirty_file_names=dirty_file_names,
+            clear_journal=False,
+        )
+        if not saved:
+            # 分段留在磁盘上，下次合并时连同这些文件一起重写
+            with self.journal_lock:
+                self.pending_count += pending_count
+                self.dirty_file_names |= dirty_file_names
+            return
+        for segment_sequence, segment_path in get_journal_segments(self.target_dir_path):
+            if segment_sequence <= sequence:
+                segment_path.unlink(missing_ok=True)
+
+    def compactor_loop(self):
+        last_compact_time = time.monotonic()
+        while not self.stop_event.is_set():
+            timeout = max(0.0, last_compact_time + self.compact_interval - time.monotonic())
+            self.wake_event.wait(timeout)
+            self.wake_event.clear()
+            if self.stop_event.is_set():
+                break
+            try:
+                self.compact()
+            except Exception:
+                logger.exception("Failed to compact the checkpoint journal")
+            last_compact_time = time.monotonic()
+
+    def close(self):
+        """停止后台线程，并把剩下的记录合并进快照"""
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.compactor_thread is not None:
+            self.compactor_thread.join()
+        self.compact()
+        self.writer.close()
@@ -2,23 +2,33 @@
 
 from __future__ import annotations
 
+import bisect
+import hashlib
+import heapq
 import json
 import os
+import sys
 import threading
 from dataclasses import dataclass, field
 from enum import Enum, auto, unique
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Set
 
 import jedi
 from colorama import Fore, Style
 from prettytable import PrettyTable
 from tqdm import tqdm
 
+from repo_agent.checkpoint_journal import replay_journal, truncate_journal
 from repo_agent.file_handler import FileHandler
+from repo_agent.hierarchy_store import get_hierarchy_store
 from repo_agent.log import logger
 from repo_agent.multi_task_dispatch import Task, TaskManager
+from repo_agent.reference_index import ReferenceIndex
+from repo_agent.rename_detector import RenameMatcher, get_git_renames
 from repo_agent.settings import SettingsManager
+from repo_agent.structure_cache import StructureCache
+from repo_agent.utils.code_fingerprint import get_code_fingerprint
 from repo_agent.utils.meta_info_utils import latest_verison_substring
 
 
@@ -107,7 +117,26 @@ def need_to_generate(doc_item: DocItem, ignore_list: List[str] = []) -> bool:
     return False
 
 
-@dataclass
+# 记录中大量重复的短字符串，加载时intern，所有对象共用同一个字符串对象
+INTERNED_RECORD_FIELDS = ("name", "type", "item_status")
+INTERNED_RECORD_LIST_FIELDS = ("params", "who_reference_me", "reference_who")
+
+
+def intern_record_strings(record: dict) -> dict:
+    """把project_hierarchy中一个对象记录里重复出现的字符串intern，原地修改并返回记录"""
+    for key in INTERNED_RECORD_FIELDS:
+        if isinstance(record.get(key), str):
+            record[key] = sys.intern(record[key])
+    for key in INTERNED_RECORD_LIST_FIELDS:
+        if isinstance(record.get(key), list):
+            record[key] = [
+                sys.intern(value) if isinstance(value, str) else value
+                for value in record[key]
+            ]
+    return record
+
+
+@dataclass(slots=True)
 class DocItem:
     item_type: DocItemType = DocItemType._class_function
     item_status: DocItemStatus = DocItemStatus.doc_has_not_been_generated
@@ -122,7 +151,6 @@ class DocItem:
     father: Any[DocItem] = None
 
     depth: int = 0
-    tree_path: List[DocItem] = field(default_factory=list)  # 一整条链路，从root开始
     max_reference_ansce: Any[DocItem] = None
 
     reference_who: List[DocItem] = field(default_factory=list)  # 他引用了谁
@@ -140,6 +168,21 @@ class DocItem:
 
     multithread_task_id: int = -1  # 在多线程中的task_id
 
+    lineno_index: Any = field(
+        default=None, repr=False, compare=False
+    )  # 仅file节点使用，(每段的起始行列表, 每段对应的对象列表)，见build_lineno_index
+
+    code_hash_cache: Optional[str] = field(
+        default=None, repr=False, compare=False
+    )  # get_code_hash的缓存，从project_hierarchy加载时直接使用记录里的code_hash
+
+    # get_key_name/get_full_name的缓存，见clear_name_cache
+    key_name_cache: Optional[str] = field(default=None, repr=False, compare=False)
+    full_name_cache: Optional[str] = field(default=None, repr=False, compare=False)
+    strict_full_name_cache: Optional[str] = field(
+        default=None, repr=False, compare=False
+    )
+
     @staticmethod
     def has_ans_relation(now_a: DocItem, now_b: DocItem):
         """Check if there is an ancestor relationship between two nodes and return the earlier node if exists.
@@ -151,12 +194,32 @@ class DocItem:
         Returns:
             DocItem or None: The earlier node if an ancestor relationship exists, otherwise None.
         """
-        if now_b in now_a.tree_path:
+        # 沿着father指针向上找，O(depth)
+        if now_b.is_ancestor_of(now_a):
             return now_b
-        if now_a in now_b.tree_path:
+        if now_a.is_ancestor_of(now_b):
             return now_a
         return None
 
+    def is_ancestor_of(self, other: DocItem) -> bool:
+        """self是other本身或者other的祖先节点"""
+        now = other
+        while now is not None:
+            if now is self:
+                return True
+            now = now.father
+        return False
+
+    @property
+    def tree_path(self) -> List[DocItem]:
+        """一整条链路，从root开始到自己，每次访问时由father指针生成"""
+        path = []
+        now = self
+        while now is not None:
+            path.append(now)
+            now = now.father
+        return path[::-1]
+
     def get_travel_list(self):
         """按照先序遍历的顺序，根节点在第一个"""
         now_list = [self]
@@ -181,48 +244,107 @@ class DocItem:
         self.depth = max_child_depth + 1
         return self.depth
 
-    def parse_tree_path(self, now_path):
-        """
-        Recursively parses the tree path by appending the current node to the given path.
+    def build_lineno_index(self):
+        """为file节点建立"行号->最内层对象"的索引，并缓存在lineno_index上
 
-        Args:
-            now_path (list): The current path in the tree.
+        把文件的行号切分成连续的若干段，每一段对应包含它的最内层对象(不在任何对象内的行对应文件本身)，
+        之后可以用二分查找在O(log n)内回答某一行属于哪个对象。
 
         Returns:
-            None
+            tuple: (每段的起始行列表, 每段对应的DocItem列表)
         """
-        self.tree_path = now_path + [self]
-        for key, child in self.children.items():
-            child.parse_tree_path(self.tree_path)
+        segment_starts: List[int] = []
+        segment_items: List[DocItem] = []
+
+        def paint(now_item: DocItem, lo: int, hi: int):
+            cursor = lo
+            children = sorted(
+                now_item.children.values(), key=lambda child: child.code_start_line
+            )  # sorted是稳定的，起始行相同时保留children的顺序，先出现的优先
+            for child in children:
+                child_start = max(child.code_start_line, cursor)
+                child_end = min(child.code_end_line, hi)
+                if child_start > child_end:
+                    continue
+                if child_start > cursor:
+                    segment_starts.append(cursor)
+                    segment_items.append(now_item)
+                paint(child, child_start, child_end)
+                cursor = child_end + 1
+            if cursor <= hi:
+                segment_starts.append(cursor)
+                segment_items.append(now_item)
+
+        paint(self, -sys.maxsize, sys.maxsize)
+        self.lineno_index = (segment_starts, segment_items)
+        return self.lineno_index
 
     def get_file_name(self):
         full_name = self.get_full_name()
         return full_name.split(".py")[0] + ".py"
 
+    def get_code_hash(self) -> Optional[str]:
+        """code_content的hash，没有源码的对象(文件、文件夹)返回None"""
+        if self.code_hash_cache is None and "code_content" in self.content:
+            self.code_hash_cache = hashlib.sha1(
+                self.content["code_content"].encode("utf-8")
+            ).hexdigest()
+        return self.code_hash_cache
+
+    def add_child(self, child_name: str, child: DocItem):
+        """把child以child_name挂到自己下面，child子树中缓存的名字随之失效"""
+        child.father = self
+        self.children[child_name] = child
+        child.clear_name_cache()
+
+    def clear_name_cache(self):
+        """换了father或者在father.children中的名字之后，清空自己和子树中缓存的名字"""
+        stack = [self]
+        while stack:
+            now = stack.pop()
+            now.key_name_cache = None
+            now.full_name_cache = None
+            now.strict_full_name_cache = None
+            stack.extend(now.children.values())
+
+    def get_key_name(self) -> str:
+        """自己在father.children中的key，重名对象的key和obj_name不同"""
+        if self.key_name_cache is None:
+            self.key_name_cache = self.obj_name
+            if self.father is not None:
+                for name, item in self.father.children.items():
+                    if item is self:
+                        self.key_name_cache = name
+                        break
+        return self.key_name_cache
+
     def get_full_name(self, strict=False):
-        """获取从下到上所有的obj名字
+        """获取从下到上所有的obj名字，结果会被缓存，树结构变化时通过add_child/clear_name_cache失效
+
+        Args:
+            strict (bool): 如果自己是重名对象，使用children中的key并加上"(name_duplicate_version)"后缀
 
         Returns:
             str: 从下到上所有的obj名字，以斜杠分隔
         """
         if self.father == None:
             return self.obj_name
-        name_list = []
-        now = self
-        while now != None:
-            self_name = now.obj_name
-            if strict:
-                for name, item in self.father.children.items():
-                    if item == now:
-                        self_name = name
-                        break
-                if self_name != now.obj_name:
-                    self_name = self_name + "(name_duplicate_version)"
-            name_list = [self_name] + name_list
-            now = now.father
-
-        name_list = name_list[1:]
-        return "/".join(name_list)
+        if not strict and self.full_name_cache is not None:
+            return self.full_name_cache
+        if strict and self.strict_full_name_cache is not None:
+            return self.strict_full_name_cache
+
+        # 根节点的名字不计入；祖先节点的名字来自它们自己的缓存
+        prefix = (
+            "" if self.father.father is None else self.father.get_full_name() + "/"
+        )
+        self.full_name_cache = prefix + self.obj_name
+        # strict只影响自己这一层，祖先节点仍然使用obj_name
+        self_name = self.get_key_name()
+        if self_name != self.obj_name:
+            self_name = self_name + "(name_duplicate_version)"
+        self.strict_full_name_cache = prefix + self_name
+        return self.strict_full_name_cache if strict else self.full_name_cache
 
     def find(self, recursive_file_path: list) -> Optional[DocItem]:
         """
@@ -244,6 +366,15 @@ class DocItem:
             pos += 1
         return now
 
+    def get_key_path(self) -> List[str]:
+        """从repo根节点到自己的children key列表，是find的逆操作"""
+        key_path = []
+        now = self
+        while now.father is not None:
+            key_path.append(now.get_key_name())
+            now = now.father
+        return key_path[::-1]
+
     @staticmethod
     def check_has_task(now_item: DocItem, ignore_list: List[str] = []):
         if need_to_generate(now_item, ignore_list=ignore_list):
@@ -340,7 +471,11 @@ class MetaInfo:
 
     in_generation_process: bool = False
 
-    checkpoint_lock: threading.Lock = threading.Lock()
+    checkpoint_lock: threading.RLock = threading.RLock()
+
+    item_index: Optional[Dict[tuple, DocItem]] = field(
+        default=None, repr=False, compare=False
+    )  # children key路径 -> DocItem，见find_item_by_key_path
 
     @staticmethod
     def init_meta_info(file_path_reflections, jump_files) -> MetaInfo:
@@ -353,8 +488,17 @@ class MetaInfo:
             f"{Fore.LIGHTRED_EX}Initializing MetaInfo: {Style.RESET_ALL}from {project_abs_path}"
         )
         file_handler = FileHandler(project_abs_path, None)
+        structure_cache = None
+        if setting.project.structure_cache_size > 0:
+            structure_cache = StructureCache(
+                project_abs_path / setting.project.hierarchy_name / "structure_cache.json",
+                max_entries=setting.project.structure_cache_size,
+            )
         repo_structure = file_handler.generate_overall_structure(
-            file_path_reflections, jump_files
+            file_path_reflections,
+            jump_files,
+            process_count=setting.project.max_process_count,
+            structure_cache=structure_cache,
         )
         metainfo = MetaInfo.from_project_hierarchy_json(repo_structure)
         metainfo.repo_path = project_abs_path
@@ -367,10 +511,8 @@ class MetaInfo:
         """从已有的metainfo dir里面读取metainfo"""
         setting = SettingsManager.get_setting()
 
-        project_hierarchy_json_path = checkpoint_dir_path / "project_hierarchy.json"
-
-        with open(project_hierarchy_json_path, "r", encoding="utf-8") as reader:
-            project_hierarchy_json = json.load(reader)
+        # sharded格式下是惰性加载，逐个文件读取shard
+        project_hierarchy_json = get_hierarchy_store(checkpoint_dir_path).load()
         metainfo = MetaInfo.from_project_hierarchy_json(project_hierarchy_json)
 
         with open(
@@ -387,16 +529,30 @@ class MetaInfo:
                 "deleted_items_from_older_meta"
             ]
 
+        # 上次运行中断时，journal里可能还有没合并进快照的文档
+        replay_journal(metainfo, checkpoint_dir_path)
+
         print(f"{Fore.CYAN}Loading MetaInfo:{Style.RESET_ALL} {checkpoint_dir_path}")
         return metainfo
 
-    def checkpoint(self, target_dir_path: str | Path, flash_reference_relation=False):
+    def checkpoint(
+        self,
+        target_dir_path: str | Path,
+        flash_reference_relation=False,
+        dirty_file_names: Optional[Set[str]] = None,
+        clear_journal=True,
+    ) -> bool:
         """
         Save the MetaInfo object to the specified directory.
 
         Args:
             target_dir_path (str | Path): The path to the target directory where the MetaInfo will be saved.
             flash_reference_relation (bool, optional): Whether to include flash reference relation in the saved MetaInfo. Defaults to False.
+            dirty_file_names (Set[str], optional): The files changed since the last checkpoint. With the sharded layout only their shards are rebuilt. Defaults to None (all files).
+            clear_journal (bool, optional): Whether to clear the document journal once the snapshot is saved. Defaults to True.
+
+        Returns:
+            bool: Whether the hierarchy was saved.
         """
         with self.checkpoint_lock:
             # 转换 target_dir_path 为 Path 对象
@@ -411,17 +567,28 @@ class MetaInfo:
                 target_dir.mkdir(parents=True, exist_ok=True)
                 logger.debug(f"Created directory: {target_dir}")
 
-            # 保存 project_hierarchy.json 文件
+            # 保存 project_hierarchy，已有的存储格式优先，新建时使用配置的格式
+            setting = SettingsManager.get_setting()
+            hierarchy_store = get_hierarchy_store(
+                target_dir,
+                setting.project.hierarchy_layout,
+                compact=setting.project.compact_json,
+            )
+            partial = (
+                dirty_file_names is not None and hierarchy_store.supports_partial_save
+            )
             now_hierarchy_json = self.to_hierarchy_json(
-                flash_reference_relation=flash_reference_relation
+                flash_reference_relation=flash_reference_relation,
+                file_names=dirty_file_names if partial else None,
             )
-            hierarchy_file = target_dir / "project_hierarchy.json"
             try:
-                with hierarchy_file.open("w", encoding="utf-8") as writer:
-                    json.dump(now_hierarchy_json, writer, indent=2, ensure_ascii=False)
-                logger.debug(f"Saved hierarchy JSON to {hierarchy_file}")
+                hierarchy_store.save(now_hierarchy_json, partial=partial)
+                logger.debug(f"Saved hierarchy JSON to {hierarchy_store.path}")
             except IOError as e:
-                logger.error(f"Failed to save hierarchy JSON to {hierarchy_file}: {e}")
+                logger.error(
+                    f"Failed to save hierarchy JSON to {hierarchy_store.path}: {e}"
+                )
+                return False  # 快照没有写成功，保留journal
 
             # 保存 meta-info.json 文件
             meta_info_file = target_dir / "meta-info.json"
@@ -439,6 +606,11 @@ class MetaInfo:
             except IOError as e:
                 logger.error(f"Failed to save meta-info JSON to {meta_info_file}: {e}")
 
+            if clear_journal:
+                # 快照已经包含了journal中的所有文档
+                truncate_journal(target_dir)
+            return True
+
     def print_task_list(self, task_dict: Dict[Task]):
         """打印"""
         task_table = PrettyTable(
@@ -476,26 +648,60 @@ class MetaInfo:
         walk_tree(self.target_repo_hierarchical_tree)
         return files
 
+    def find_item_by_key_path(self, key_path) -> Optional[DocItem]:
+        """根据从根节点开始的children key路径找到对象，索引在第一次查询时建立
+
+        Args:
+            key_path (list): The keys from the repo root to the item, as returned by DocItem.get_key_path.
+
+        Returns:
+            Optional[DocItem]: The item if found, otherwise None.
+        """
+        return self.get_item_index().get(tuple(key_path))
+
+    def get_item_index(self) -> Dict[tuple, DocItem]:
+        """children key路径 -> DocItem，按先序遍历的顺序，根节点的路径是()"""
+        if self.item_index is None:
+            self.item_index = {}
+            stack = [((), self.target_repo_hierarchical_tree)]
+            while stack:
+                key_path, now_item = stack.pop()
+                self.item_index[key_path] = now_item
+                stack.extend(
+                    (key_path + (child_name,), child)
+                    for child_name, child in reversed(now_item.children.items())
+                )
+        return self.item_index
+
     def find_obj_with_lineno(self, file_node: DocItem, start_line_num) -> DocItem:
         """每个DocItem._file，对于所有的行，建立他们对应的对象是谁
-        一个行属于这个obj的范围，并且没法属于他的儿子的范围了"""
-        now_node = file_node
-        # if
-        assert now_node != None
-        while len(now_node.children) > 0:
-            find_qualify_child = False
-            for _, child in now_node.children.items():
-                assert child.content != None
-                if (
-                    child.content["code_start_line"] <= start_line_num
-                    and child.content["code_end_line"] >= start_line_num
-                ):
-                    now_node = child
-                    find_qualify_child = True
-                    break
-            if not find_qualify_child:
-                return now_node
-        return now_node
+        一个行属于这个obj的范围，并且没法属于他的儿子的范围了
+
+        索引在第一次查询时建立，缓存在file节点上"""
+        assert file_node != None
+        segment_starts, segment_items = (
+            file_node.lineno_index or file_node.build_lineno_index()
+        )
+        return segment_items[bisect.bisect_right(segment_starts, start_line_num) - 1]
+
+    def build_reference_index(self, file_nodes: List[DocItem]) -> ReferenceIndex:
+        """为所有文件建立项目级的引用索引，每个文件只parse一次，没有变化的文件从.project_doc_record中的缓存读取"""
+        target_names = set()
+        for file_node in file_nodes:
+            for item in file_node.get_travel_list()[1:]:
+                target_names.add(item.obj_name)
+        setting = SettingsManager.get_setting()
+        reference_index = ReferenceIndex(
+            self.repo_path,
+            target_names=target_names,
+            cache_path=setting.project.target_repo
+            / setting.project.hierarchy_name
+            / "reference_cache.json",
+        )
+        return reference_index.build(
+            [file_node.get_full_name() for file_node in file_nodes],
+            process_count=setting.project.max_process_count,
+        )
 
     def parse_reference(self):
         """双向提取所有引用关系"""
@@ -509,6 +715,8 @@ class MetaInfo:
             white_list_file_names = [cont["file_path"] for cont in self.white_list]
             white_list_obj_names = [cont["id_text"] for cont in self.white_list]
 
+        reference_index = self.build_reference_index(file_nodes)
+
         for file_node in tqdm(file_nodes, desc="parsing bidirectional reference"):
             """检测一个文件内的所有引用信息，只能检测引用该文件内某个obj的其他内容。
             1. 如果某个文件是jump-files，就不应该出现在这个循环里
@@ -535,14 +743,22 @@ class MetaInfo:
                 ):
                     in_file_only = True  # 作为加速，如果有白名单，白名单obj同文件夹下的也parse，但是只找同文件内的引用
 
-                reference_list = find_all_referencer(
-                    repo_path=self.repo_path,
+                reference_list = reference_index.find_all_referencer(
                     variable_name=now_obj.obj_name,
                     file_path=rel_file_path,
                     line_number=now_obj.content["code_start_line"],
                     column_number=now_obj.content["name_column"],
                     in_file_only=in_file_only,
                 )
+                if reference_list is None:  # 索引里没有这个定义(比如name_column不准)，回退到逐个对象查询
+                    reference_list = find_all_referencer(
+                        repo_path=self.repo_path,
+                        variable_name=now_obj.obj_name,
+                        file_path=rel_file_path,
+                        line_number=now_obj.content["code_start_line"],
+                        column_number=now_obj.content["name_column"],
+                        in_file_only=in_file_only,
+                    )
                 for referencer_pos in reference_list:  # 对于每个引用
                     referencer_file_ral_path = referencer_pos[0]
                     if referencer_file_ral_path in self.fake_file_reflection.values():
@@ -615,65 +831,87 @@ class MetaInfo:
             # logger.info(f"find {ref_count} refer-relation in {file_node.get_full_name()}")
 
     def get_task_manager(self, now_node: DocItem, task_available_func) -> TaskManager:
-        """先写一个退化的版本，只考虑拓扑引用关系"""
+        """用Kahn算法按拓扑顺序构建任务，只考虑拓扑引用关系
+
+        一个任务依赖于所有引用者和他的子节点。每次优先选择依赖已全部处理、并且在(按depth排序的)列表中最靠前的节点；
+        如果不存在这样的节点，说明剩下的节点成环，此时选择非special引用中未处理数量最少的节点来打破环。
+        """
         doc_items = now_node.get_travel_list()
         if self.white_list != None:
+            white_list_keys = set(
+                (cont["file_path"], cont["id_text"]) for cont in self.white_list
+            )
 
             def in_white_list(item: DocItem):
-                for cont in self.white_list:
-                    if (
-                        item.get_file_name() == cont["file_path"]
-                        and item.obj_name == cont["id_text"]
-                    ):
-                        return True
-                return False
+                return (item.get_file_name(), item.obj_name) in white_list_keys
 
             doc_items = list(filter(in_white_list, doc_items))
         doc_items = list(filter(task_available_func, doc_items))
         doc_items = sorted(doc_items, key=lambda x: x.depth)  # 叶子节点在前面
-        deal_items = []
+
+        # DocItem是dataclass，==会递归比较所有字段，这里统一用id和列表中的位置做索引
+        position = {id(item): pos for pos, item in enumerate(doc_items)}
+        unresolved_count = [0] * len(doc_items)  # 所有未处理依赖的数量(best_break_level)
+        unresolved_normal_count = [0] * len(doc_items)  # 非special引用中未处理的数量(second_best_break_level)
+        dependents: Dict[int, List[tuple[int, bool]]] = {}  # 被依赖者 -> [(依赖者位置, 是否为非special引用)]
+        available_cache: Dict[int, bool] = {}
+
+        def is_available(item: DocItem) -> bool:
+            if id(item) not in available_cache:
+                available_cache[id(item)] = task_available_func(item)
+            return available_cache[id(item)]
+
+        for pos, item in enumerate(doc_items):
+            for _, child in item.children.items():  # 父亲依赖儿子的关系是一定要走的
+                if is_available(child):
+                    unresolved_count[pos] += 1
+                    dependents.setdefault(id(child), []).append((pos, False))
+            for referenced, special in zip(
+                item.reference_who, item.special_reference_type
+            ):
+                if is_available(referenced):
+                    unresolved_count[pos] += 1
+                    if not special:
+                        unresolved_normal_count[pos] += 1
+                    dependents.setdefault(id(referenced), []).append(
+                        (pos, not special)
+                    )
+
+        self.report_reference_cycles(doc_items, position, is_available)
+
+        ready_heap = [pos for pos in range(len(doc_items)) if unresolved_count[pos] == 0]
+        heapq.heapify(ready_heap)
+        # 打破环时使用的堆，(second_best_break_level, 位置)，过期的条目在弹出时跳过
+        break_heap = [(unresolved_normal_count[pos], pos) for pos in range(len(doc_items))]
+        heapq.heapify(break_heap)
+        dealt = [False] * len(doc_items)
+
         task_manager = TaskManager()
         bar = tqdm(total=len(doc_items), desc="parsing topology task-list")
-        while doc_items:
-            min_break_level = 1e7
-            target_item = None
-            for item in doc_items:
+        for _ in range(len(doc_items)):
+            while ready_heap and dealt[ready_heap[0]]:
+                heapq.heappop(ready_heap)
+            if ready_heap:
+                target_pos = heapq.heappop(ready_heap)
+            else:
                 """一个任务依赖于所有引用者和他的子节点,我们不能保证引用不成环(也许有些仓库的废代码会出现成环)。
                 这时就只能选择一个相对来说遵守程度最好的了
                 有特殊情况func-def中的param def可能会出现循环引用
                 另外循环引用真实存在，对于一些bind类的接口真的会发生，比如：
                 ChatDev/WareHouse/Gomoku_HumanAgentInteraction_20230920135038/main.py里面的: on-click、show-winner、restart
                 """
-                best_break_level = 0
-                second_best_break_level = 0
-                for _, child in item.children.items():  # 父亲依赖儿子的关系是一定要走的
-                    if task_available_func(child) and (child not in deal_items):
-                        best_break_level += 1
-                for referenced, special in zip(
-                    item.reference_who, item.special_reference_type
-                ):
-                    if task_available_func(referenced) and (
-                        referenced not in deal_items
-                    ):
-                        best_break_level += 1
+                while True:
+                    break_level, target_pos = heapq.heappop(break_heap)
                     if (
-                        task_available_func(referenced)
-                        and (not special)
-                        and (referenced not in deal_items)
+                        not dealt[target_pos]
+                        and break_level == unresolved_normal_count[target_pos]
                     ):
-                        second_best_break_level += 1
-                if best_break_level == 0:
-                    min_break_level = -1
-                    target_item = item
-                    break
-                if second_best_break_level < min_break_level:
-                    target_item = item
-                    min_break_level = second_best_break_level
-
-            if min_break_level > 0:
-                print(
-                    f"circle-reference(second-best still failed), level={min_break_level}: {target_item.get_full_name()}"
-                )
+                        break
+                if break_level > 0:
+                    print(
+                        f"circle-reference(second-best still failed), level={break_level}: {doc_items[target_pos].get_full_name()}"
+                    )
+            target_item = doc_items[target_pos]
 
             item_denp_task_ids = []
             for _, child in target_item.children.items():
@@ -689,12 +927,98 @@ class MetaInfo:
                     dependency_task_id=item_denp_task_ids, extra=target_item
                 )
                 target_item.multithread_task_id = task_id
-            deal_items.append(target_item)
-            doc_items.remove(target_item)
+
+            dealt[target_pos] = True
+            for dependent_pos, is_normal_reference in dependents.get(
+                id(target_item), []
+            ):
+                unresolved_count[dependent_pos] -= 1
+                if unresolved_count[dependent_pos] == 0:
+                    heapq.heappush(ready_heap, dependent_pos)
+                if is_normal_reference:
+                    unresolved_normal_count[dependent_pos] -= 1
+                    heapq.heappush(
+                        break_heap,
+                        (unresolved_normal_count[dependent_pos], dependent_pos),
+                    )
             bar.update(1)
 
         return task_manager
 
+    @staticmethod
+    def report_reference_cycles(
+        doc_items: List[DocItem], position: Dict[int, int], is_available: Callable
+    ) -> List[List[DocItem]]:
+        """用Tarjan算法找出待生成对象之间真实存在的引用环(强连通分量)，并打印出来
+
+        Returns:
+            List[List[DocItem]]: 所有包含不止一个节点的强连通分量。
+        """
+
+        def successors(item: DocItem):
+            for child in item.children.values():
+                if id(child) in position and is_available(child):
+                    yield child
+            for referenced in item.reference_who:
+                if id(referenced) in position and is_available(referenced):
+                    yield referenced
+
+        index_of: Dict[int, int] = {}
+        low_link: Dict[int, int] = {}
+        on_stack = set()
+        stack: List[DocItem] = []
+        cycles: List[List[DocItem]] = []
+        next_index = 0
+
+        for root in doc_items:
+            if id(root) in index_of:
+                continue
+            index_of[id(root)] = low_link[id(root)] = next_index
+            next_index += 1
+            stack.append(root)
+            on_stack.add(id(root))
+            work = [(root, successors(root))]
+            while work:
+                now_item, now_successors = work[-1]
+                pushed = False
+                for successor in now_successors:
+                    if id(successor) not in index_of:
+                        index_of[id(successor)] = low_link[id(successor)] = next_index
+                        next_index += 1
+                        stack.append(successor)
+                        on_stack.add(id(successor))
+                        work.append((successor, successors(successor)))
+                        pushed = True
+                        break
+                    elif id(successor) in on_stack:
+                        low_link[id(now_item)] = min(
+                            low_link[id(now_item)], index_of[id(successor)]
+                        )
+                if pushed:
+                    continue
+                work.pop()
+                if work:
+                    father = work[-1][0]
+                    low_link[id(father)] = min(low_link[id(father)], low_link[id(now_item)])
+                if low_link[id(now_item)] == index_of[id(now_item)]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(id(member))
+                        component.append(member)
+                        if member is now_item:
+                            break
+                    if len(component) > 1:
+                        cycles.append(component)
+
+        for component in cycles:
+            logger.info(
+                f"Reference cycle detected ({len(component)} objects): "
+                + ", ".join(item.get_full_name() for item in component[:5])
+                + (" ..." if len(component) > 5 else "")
+            )
+        return cycles
+
     def get_topology(self, task_available_func) -> TaskManager:
         """计算repo中所有对象的拓扑顺序"""
         self.parse_reference()
@@ -714,121 +1038,191 @@ class MetaInfo:
         travel(self.target_repo_hierarchical_tree)
 
     def load_doc_from_older_meta(self, older_meta: MetaInfo):
-        """older_meta是老版本的、已经生成doc的meta info"""
-        logger.info("merge doc from an older version of metainfo")
-        root_item = self.target_repo_hierarchical_tree  # 新版的根节点
-        deleted_items = []
+        """older_meta是老版本的、已经生成doc的meta info
 
-        def find_item(now_item: DocItem) -> Optional[DocItem]:
-            """
-            Find an item in the new version of meta based on its original item.
-
-            Args:
-                now_item (DocItem): The original item to be found in the new version of meta.
-
-            Returns:
-                Optional[DocItem]: The corresponding item in the new version of meta if found, otherwise None.
-            """
-            nonlocal root_item
-            if now_item.father == None:  # The root node can always be found
-                return root_item
-            father_find_result = find_item(now_item.father)
-            if not father_find_result:
-                return None
-            # 注意：这里需要考虑 now_item.obj_name可能会有重名，并不一定等于
-            real_name = None
-            for child_real_name, temp_item in now_item.father.children.items():
-                if temp_item == now_item:
-                    real_name = child_real_name
-                    break
-            assert real_name != None
-            # if real_name != now_item.obj_name:
-            #     import pdb; pdb.set_trace()
-            if real_name in father_find_result.children.keys():
-                result_item = father_find_result.children[real_name]
-                return result_item
-            return None
-
-        def travel(now_older_item: DocItem):  # 只寻找源码是否被修改的信息
-            # if now_older_item.get_full_name() == "autogen/_pydantic.py/type2schema":
-            #     import pdb; pdb.set_trace()
-            result_item = find_item(now_older_item)
+        两棵树都按children key路径建立索引，新旧对象在一次遍历中对应起来(hash join)，
+        源码是否被修改通过比较每个对象的code hash判断，旧对象的hash直接读取保存在记录里的code_hash。
+        key路径对不上的对象再交给RenameMatcher，重命名、移动过的对象沿用旧的文档。
+        """
+        logger.info("merge doc from an older version of metainfo")
+        new_index = self.get_item_index()
+        deleted_items: List[DocItem] = []
+        missing_item_ids = set()  # 新版中找不到的旧对象，它们的子对象也不再单独记录
+        matched_items = []  # (旧对象, 新对象)
+
+        # 旧树的索引是先序的，父对象总是先于子对象处理
+        for key_path, now_older_item in older_meta.get_item_index().items():
+            if id(now_older_item.father) in missing_item_ids:
+                missing_item_ids.add(id(now_older_item))
+                continue
+            result_item = new_index.get(key_path)
             if not result_item:  # 新版文件中找不到原来的item，就回退
-                deleted_items.append(
-                    [now_older_item.get_full_name(), now_older_item.item_type.name]
-                )
-                return
+                missing_item_ids.add(id(now_older_item))
+                deleted_items.append(now_older_item)
+                continue
             result_item.md_content = now_older_item.md_content
             result_item.item_status = now_older_item.item_status
-            # if result_item.obj_name == "run":
-            #     import pdb; pdb.set_trace()
             if "code_content" in now_older_item.content.keys():
                 assert "code_content" in result_item.content.keys()
-                if (
-                    now_older_item.content["code_content"]
-                    != result_item.content["code_content"]
-                ):  # 源码被修改了
+                if not self.is_code_unchanged(now_older_item, result_item):  # 源码被修改了
                     result_item.item_status = DocItemStatus.code_changed
+            matched_items.append((now_older_item, result_item))
 
-            for _, child in now_older_item.children.items():
-                travel(child)
-
-        travel(older_meta.target_repo_hierarchical_tree)
+        moved_items = self.carry_over_moved_items(
+            older_meta, missing_item_ids, matched_items
+        )
 
         """接下来，parse现在的双向引用，观察谁的引用者改了"""
+        # 引用索引按文件内容缓存，这里只有内容变化的文件(以及依赖它们的文件)会被jedi重新解析
         self.parse_reference()
 
-        def travel2(now_older_item: DocItem):
-            result_item = find_item(now_older_item)
-            if not result_item:  # 新版文件中找不到原来的item，就回退
-                return
+        # 重命名、移动过的引用者换成新的名字再比较，否则只是文件改名也会被当成引用者变化
+        moved_names = {
+            old_item.get_full_name(strict=True): new_item.get_full_name(strict=True)
+            for old_item, new_item in moved_items
+        }
+        for now_older_item, result_item in matched_items:
+            if result_item.item_status != DocItemStatus.doc_up_to_date:
+                continue  # 已经需要重新生成的对象不用再比较引用者
             """result_item引用的人是否变化了"""
-            new_reference_names = [
+            new_reference_names = set(
                 name.get_full_name(strict=True) for name in result_item.who_reference_me
-            ]
-            old_reference_names = now_older_item.who_reference_me_name_list
-            # if now_older_item.get_full_name() == "autogen/_pydantic.py/type2schema":
-            #     import pdb; pdb.set_trace()
-            if not (set(new_reference_names) == set(old_reference_names)) and (
-                result_item.item_status == DocItemStatus.doc_up_to_date
-            ):
-                if set(new_reference_names) <= set(
-                    old_reference_names
-                ):  # 旧的referencer包含新的referencer
+            )
+            old_reference_names = set(
+                moved_names.get(name, name)
+                for name in now_older_item.who_reference_me_name_list
+            )
+            if new_reference_names != old_reference_names:
+                if new_reference_names <= old_reference_names:  # 旧的referencer包含新的referencer
                     result_item.item_status = DocItemStatus.referencer_not_exist
                 else:
                     result_item.item_status = DocItemStatus.add_new_referencer
-            for _, child in now_older_item.children.items():
-                travel2(child)
 
-        travel2(older_meta.target_repo_hierarchical_tree)
+        if moved_items:
+            saved_count = sum(
+                new_item.item_status == DocItemStatus.doc_up_to_date
+                for _, new_item in moved_items
+            )
+            logger.info(
+                f"Rename detection: carried {len(moved_items)} documents over to renamed or moved objects, "
+                f"saving {saved_count} LLM calls"
+            )
+        moved_item_ids = {id(old_item) for old_item, _ in moved_items}
+        self.deleted_items_from_older_meta = [
+            [item.get_full_name(), item.item_type.name]
+            for item in deleted_items
+            if id(item) not in moved_item_ids
+        ]
 
-        self.deleted_items_from_older_meta = deleted_items
+    @staticmethod
+    def is_code_unchanged(older_item: DocItem, new_item: DocItem) -> bool:
+        """源码完全相同，或者开启了ignore_cosmetic_changes并且AST指纹相同(只改了格式、注释)"""
+        if older_item.get_code_hash() == new_item.get_code_hash():
+            return True
+        setting = SettingsManager.get_setting()
+        if not setting.project.ignore_cosmetic_changes:
+            return False
+        older_fingerprint = get_code_fingerprint(
+            older_item.content["code_content"],
+            ignore_docstrings=setting.project.ignore_docstring_changes,
+        )
+        if older_fingerprint is None:
+            return False
+        unchanged = older_fingerprint == get_code_fingerprint(
+            new_item.content["code_content"],
+            ignore_docstrings=setting.project.ignore_docstring_changes,
+        )
+        if unchanged:
+            logger.debug(f"Cosmetic change only, keeping the doc: {new_item.get_full_name()}")
+        return unchanged
+
+    def carry_over_moved_items(
+        self, older_meta: MetaInfo, missing_item_ids: Set[int], matched_items: List
+    ) -> List:
+        """
+        Carry the documents of renamed or moved objects over to their new counterparts.
+
+        Code that is unchanged keeps its old status, so its document is not regenerated. Code that
+        was renamed or edited is marked as code_changed.
+
+        Args:
+            older_meta (MetaInfo): The older MetaInfo.
+            missing_item_ids (Set[int]): The ids of the older items that were not found at the same key path.
+            matched_items (list): The (older item, new item) pairs, the new pairs are appended to it.
+
+        Returns:
+            list: The (older item, new item) pairs whose documents were carried over.
+        """
+        object_types = [
+            DocItemType._class,
+            DocItemType._function,
+            DocItemType._class_function,
+            DocItemType._sub_function,
+        ]
+        old_items = [
+            item
+            for item in older_meta.get_item_index().values()
+            if id(item) in missing_item_ids
+            and item.item_type in object_types
+            and item.md_content
+        ]
+        if not old_items:
+            return []
+        matched_new_ids = {id(new_item) for _, new_item in matched_items}
+        new_items = [
+            item
+            for item in self.get_item_index().values()
+            if id(item) not in matched_new_ids and item.item_type in object_types
+        ]
+        setting = SettingsManager.get_setting()
+        matcher = RenameMatcher(
+            self.get_item_index(),
+            get_git_renames(self.repo_path, older_meta.document_version),
+            similarity_threshold=setting.project.rename_similarity_threshold,
+        )
+
+        moved_items = matcher.match(old_items, new_items)
+        for old_item, new_item in moved_items:
+            new_item.md_content = old_item.md_content
+            if self.is_code_unchanged(old_item, new_item):
+                new_item.item_status = old_item.item_status
+            else:
+                new_item.item_status = DocItemStatus.code_changed
+            logger.debug(
+                f"Moved: {old_item.get_full_name()} -> {new_item.get_full_name()} ({new_item.item_status.name})"
+            )
+        matched_items.extend(moved_items)
+        return moved_items
 
     @staticmethod
     def from_project_hierarchy_path(repo_path: str) -> MetaInfo:
         """project_hierarchy_json全是压平的文件，递归的文件目录都在最终的key里面, 把他转换到我们的数据结构"""
-        project_hierarchy_json_path = os.path.join(repo_path, "project_hierarchy.json")
-        logger.info(f"parsing from {project_hierarchy_json_path}")
-        if not os.path.exists(project_hierarchy_json_path):
+        hierarchy_store = get_hierarchy_store(repo_path)
+        logger.info(f"parsing from {hierarchy_store.path}")
+        if not hierarchy_store.exists():
             raise NotImplementedError("Invalid operation detected")
 
-        with open(project_hierarchy_json_path, "r", encoding="utf-8") as reader:
-            project_hierarchy_json = json.load(reader)
-        return MetaInfo.from_project_hierarchy_json(project_hierarchy_json)
+        return MetaInfo.from_project_hierarchy_json(hierarchy_store.load())
 
-    def to_hierarchy_json(self, flash_reference_relation=False):
+    def to_hierarchy_json(self, flash_reference_relation=False, file_names=None):
         """
         Convert the document metadata to a hierarchical JSON representation.
 
         Args:
             flash_reference_relation (bool): If True, the latest bidirectional reference relations will be written back to the meta file.
+            file_names (Set[str], optional): Only convert these files. Defaults to None (all files).
 
         Returns:
             dict: A dictionary representing the hierarchical JSON structure of the document metadata.
         """
         hierachy_json = {}
         file_item_list = self.get_all_files()
+        if file_names is not None:
+            file_item_list = [
+                file_item
+                for file_item in file_item_list
+                if file_item.get_full_name() in file_names
+            ]
         for file_item in file_item_list:
             file_hierarchy_content = []
 
@@ -839,6 +1233,9 @@ class MetaInfo:
                 temp_json_obj["type"] = now_obj.item_type.to_str()
                 temp_json_obj["md_content"] = now_obj.md_content
                 temp_json_obj["item_status"] = now_obj.item_status.name
+                code_hash = now_obj.get_code_hash()
+                if code_hash is not None:  # 下次合并时旧版本的对象不用再计算hash
+                    temp_json_obj["code_hash"] = code_hash
 
                 if flash_reference_relation:
                     temp_json_obj["who_reference_me"] = [
@@ -868,6 +1265,67 @@ class MetaInfo:
             hierachy_json[file_item.get_full_name()] = file_hierarchy_content
         return hierachy_json
 
+    @staticmethod
+    def find_fathers_by_nesting(obj_item_list: List[DocItem]) -> List[Optional[DocItem]]:
+        """用嵌套栈为文件内的每个对象找到父亲：包含它的code范围的节点里，范围最小的那个(None代表文件本身)
+
+        对象按(起始行升序, 结束行降序)排序后扫描，栈里始终是当前位置所有外层对象的链，复杂度O(n log n)。
+        code范围完全相同的对象互相不算包含；范围相同的多个候选里，选列表中最靠前的那个。
+        如果出现交叉(而不是嵌套)的范围，退化为逐对比较。
+        """
+        groups: Dict[tuple[int, int], List[int]] = {}  # (起始行, 结束行) -> 列表中的下标
+        for index, item in enumerate(obj_item_list):
+            groups.setdefault((item.code_start_line, item.code_end_line), []).append(
+                index
+            )
+
+        fathers: List[Optional[DocItem]] = [None] * len(obj_item_list)
+        stack: List[tuple[int, int]] = []
+        for code_range in sorted(groups.keys(), key=lambda r: (r[0], -r[1])):
+            while stack and stack[-1][1] < code_range[1]:
+                if stack[-1][1] >= code_range[0]:  # 交叉的范围，嵌套栈不再适用
+                    return MetaInfo.find_fathers_pairwise(obj_item_list)
+                stack.pop()
+            if stack:
+                father = obj_item_list[groups[stack[-1]][0]]
+                for index in groups[code_range]:
+                    fathers[index] = father
+            stack.append(code_range)
+        return fathers
+
+    @staticmethod
+    def find_fathers_pairwise(obj_item_list: List[DocItem]) -> List[Optional[DocItem]]:
+        """逐对比较的方式寻找父亲，复杂度是O(n^2)，只在范围交叉时使用"""
+
+        def code_contain(item, other_item) -> bool:
+            if (
+                other_item.code_end_line == item.code_end_line
+                and other_item.code_start_line == item.code_start_line
+            ):
+                return False
+            if (
+                other_item.code_end_line < item.code_end_line
+                or other_item.code_start_line > item.code_start_line
+            ):
+                return False
+            return True
+
+        fathers: List[Optional[DocItem]] = []
+        for item in obj_item_list:
+            potential_father = None
+            for other_item in obj_item_list:
+                if code_contain(item, other_item):
+                    if potential_father == None or (
+                        (other_item.code_end_line - other_item.code_start_line)
+                        < (
+                            potential_father.code_end_line
+                            - potential_father.code_start_line
+                        )
+                    ):
+                        potential_father = other_item
+            fathers.append(potential_father)
+        return fathers
+
     @staticmethod
     def from_project_hierarchy_json(project_hierarchy_json) -> MetaInfo:
         setting = SettingsManager.get_setting()
@@ -899,22 +1357,24 @@ class MetaInfo:
             now_structure = target_meta_info.target_repo_hierarchical_tree
             while pos < len(recursive_file_path) - 1:
                 if recursive_file_path[pos] not in now_structure.children.keys():
-                    now_structure.children[recursive_file_path[pos]] = DocItem(
-                        item_type=DocItemType._dir,
-                        md_content="",
-                        obj_name=recursive_file_path[pos],
+                    now_structure.add_child(
+                        recursive_file_path[pos],
+                        DocItem(
+                            item_type=DocItemType._dir,
+                            md_content="",
+                            obj_name=recursive_file_path[pos],
+                        ),
                     )
-                    now_structure.children[
-                        recursive_file_path[pos]
-                    ].father = now_structure
                 now_structure = now_structure.children[recursive_file_path[pos]]
                 pos += 1
             if recursive_file_path[-1] not in now_structure.children.keys():
-                now_structure.children[recursive_file_path[pos]] = DocItem(
-                    item_type=DocItemType._file,
-                    obj_name=recursive_file_path[-1],
+                now_structure.add_child(
+                    recursive_file_path[pos],
+                    DocItem(
+                        item_type=DocItemType._file,
+                        obj_name=recursive_file_path[-1],
+                    ),
                 )
-                now_structure.children[recursive_file_path[pos]].father = now_structure
 
             # 然后parse file内容
             assert type(file_content) == list
@@ -922,15 +1382,16 @@ class MetaInfo:
                 recursive_file_path
             )
             assert file_item.item_type == DocItemType._file
-            """用类线段树的方式：
+            """用嵌套栈的方式：
             1.先parse所有节点，再找父子关系
             2.一个节点的父节点，所有包含他的code范围的节点里的，最小的节点
-            复杂度是O(n^2)
+            复杂度是O(n log n)
             3.最后来处理节点的type问题
             """
 
             obj_item_list: List[DocItem] = []
             for value in file_content:
+                value = intern_record_strings(value)
                 obj_doc_item = DocItem(
                     obj_name=value["name"],
                     content=value,
@@ -940,6 +1401,8 @@ class MetaInfo:
                 )
                 if "item_status" in value.keys():
                     obj_doc_item.item_status = DocItemStatus[value["item_status"]]
+                if "code_hash" in value.keys():
+                    obj_doc_item.code_hash_cache = value["code_hash"]
                 if "reference_who" in value.keys():
                     obj_doc_item.reference_who_name_list = value["reference_who"]
                 if "special_reference_type" in value.keys():
@@ -951,36 +1414,10 @@ class MetaInfo:
                 obj_item_list.append(obj_doc_item)
 
             # 接下里寻找可能的父亲
-            for item in obj_item_list:
-                potential_father = None
-                for other_item in obj_item_list:
-
-                    def code_contain(item, other_item) -> bool:
-                        if (
-                            other_item.code_end_line == item.code_end_line
-                            and other_item.code_start_line == item.code_start_line
-                        ):
-                            return False
-                        if (
-                            other_item.code_end_line < item.code_end_line
-                            or other_item.code_start_line > item.code_start_line
-                        ):
-                            return False
-                        return True
-
-                    if code_contain(item, other_item):
-                        if potential_father == None or (
-                            (other_item.code_end_line - other_item.code_start_line)
-                            < (
-                                potential_father.code_end_line
-                                - potential_father.code_start_line
-                            )
-                        ):
-                            potential_father = other_item
-
+            father_list = MetaInfo.find_fathers_by_nesting(obj_item_list)
+            for item, potential_father in zip(obj_item_list, father_list):
                 if potential_father == None:
                     potential_father = file_item
-                item.father = potential_father
                 child_name = item.obj_name
                 if child_name in potential_father.children.keys():
                     # 如果存在同层次的重名问题，就重命名成 xxx_i的形式
@@ -993,7 +1430,7 @@ class MetaInfo:
                     logger.warning(
                         f"Name duplicate in {file_item.get_full_name()}: rename to {item.obj_name}->{child_name}"
                     )
-                potential_father.children[child_name] = item
+                potential_father.add_child(child_name, item)
                 # print(f"{potential_father.get_full_name()} -> {item.get_full_name()}")
 
             def change_items(now_item: DocItem):
@@ -1014,7 +1451,6 @@ class MetaInfo:
 
             change_items(file_item)
 
-        target_meta_info.target_repo_hierarchical_tree.parse_tree_path(now_path=[])
         target_meta_info.target_repo_hierarchical_tree.check_depth()
         return target_meta_info
 
@@ -1,18 +1,38 @@
 # FileHandler 类，实现对文件的读写操作，这里的文件包括markdown文件和python文件
 # repo_agent/file_handler.py
 import ast
+import io
 import json
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import git
 from colorama import Fore, Style
 from tqdm import tqdm
 
+from repo_agent.hierarchy_store import get_hierarchy_store
 from repo_agent.log import logger
 from repo_agent.settings import SettingsManager
+from repo_agent.structure_cache import get_blob_hash
 from repo_agent.utils.gitignore_checker import GitignoreChecker
 from repo_agent.utils.meta_info_utils import latest_verison_substring
 
+_worker_file_handler = None  # 子进程内复用的FileHandler，由_init_worker设置
+
+
+def _init_worker(file_handler):
+    global _worker_file_handler
+    _worker_file_handler = file_handler
+
+
+def _generate_file_structure_in_worker(file_path):
+    """在子进程中解析单个文件，异常转成字符串返回，由父进程统一记录日志"""
+    try:
+        return _worker_file_handler.generate_file_structure(file_path), None
+    except Exception as e:
+        return None, str(e)
+
 
 class FileHandler:
     """
@@ -60,14 +80,6 @@ class FileHandler:
             dict: A dictionary containing the code information.
         """
 
-        code_info = {}
-        code_info["type"] = code_type
-        code_info["name"] = code_name
-        code_info["md_content"] = []
-        code_info["code_start_line"] = start_line
-        code_info["code_end_line"] = end_line
-        code_info["params"] = params
-
         with open(
             os.path.join(
                 self.repo_path, file_path if file_path != None else self.file_path
@@ -76,20 +88,50 @@ class FileHandler:
             encoding="utf-8",
         ) as code_file:
             lines = code_file.readlines()
-            code_content = "".join(lines[start_line - 1 : end_line])
-            # 获取对象名称在第一行代码中的位置
-            name_column = lines[start_line - 1].find(code_name)
-            # 判断代码中是否有return字样
-            if "return" in code_content:
-                have_return = True
-            else:
-                have_return = False
-
-            code_info["have_return"] = have_return
-            # # 使用 json.dumps 来转义字符串，并去掉首尾的引号
-            # code_info['code_content'] = json.dumps(code_content)[1:-1]
-            code_info["code_content"] = code_content
-            code_info["name_column"] = name_column
+        return self.get_obj_code_info_from_lines(
+            code_type, code_name, start_line, end_line, params, lines
+        )
+
+    @staticmethod
+    def get_obj_code_info_from_lines(
+        code_type, code_name, start_line, end_line, params, lines
+    ):
+        """
+        Get the code information for a given object from the already-read lines of its file.
+
+        Args:
+            code_type (str): The type of the code.
+            code_name (str): The name of the code.
+            start_line (int): The starting line number of the code.
+            end_line (int): The ending line number of the code.
+            params (list): The parameters of the code.
+            lines (list): The lines of the whole file, as returned by readlines().
+
+        Returns:
+            dict: A dictionary containing the code information.
+        """
+        code_info = {}
+        code_info["type"] = code_type
+        code_info["name"] = code_name
+        code_info["md_content"] = []
+        code_info["code_start_line"] = start_line
+        code_info["code_end_line"] = end_line
+        code_info["params"] = params
+
+        code_content = "".join(lines[start_line - 1 : end_line])
+        # 获取对象名称在第一行代码中的位置
+        name_column = lines[start_line - 1].find(code_name)
+        # 判断代码中是否有return字样
+        if "return" in code_content:
+            have_return = True
+        else:
+            have_return = False
+
+        code_info["have_return"] = have_return
+        # # 使用 json.dumps 来转义字符串，并去掉首尾的引号
+        # code_info['code_content'] = json.dumps(code_content)[1:-1]
+        code_info["code_content"] = code_content
+        code_info["name_column"] = name_column
 
         return code_info
 
@@ -187,28 +229,22 @@ class FileHandler:
             the name of the node, the starting line number, the ending line number, the name of the parent node, and a list of parameters (if any).
         """
         tree = ast.parse(code_content)
-        self.add_parent_references(tree)
         functions_and_classes = []
-        for node in ast.walk(tree):
+        # 单次广度优先遍历(与ast.walk的顺序相同)，Python 3.8+ 的节点自带end_lineno，不需要再递归子树
+        pending_nodes = deque([tree])
+        while pending_nodes:
+            node = pending_nodes.popleft()
+            pending_nodes.extend(ast.iter_child_nodes(node))
             if isinstance(node, (ast.FunctionDef, ast.ClassDef, ast.AsyncFunctionDef)):
-                # if node.name == "recursive_check":
-                #     import pdb; pdb.set_trace()
                 start_line = node.lineno
-                end_line = self.get_end_lineno(node)
-                # def get_recursive_parent_name(node):
-                #     now = node
-                #     while "parent" in dir(now):
-                #         if isinstance(now.parent, (ast.FunctionDef, ast.ClassDef, ast.AsyncFunctionDef)):
-                #             assert 'name' in dir(now.parent)
-                #             return now.parent.name
-                #         now = now.parent
-                #     return None
-                # parent_name = get_recursive_parent_name(node)
+                end_line = getattr(node, "end_lineno", None) or self.get_end_lineno(
+                    node
+                )
                 parameters = (
-                    [arg.arg for arg in node.args.args] if "args" in dir(node) else []
+                    [arg.arg for arg in node.args.args]
+                    if not isinstance(node, ast.ClassDef)
+                    else []
                 )
-                all_names = [item[1] for item in functions_and_classes]
-                # (parent_name == None or parent_name in all_names) and
                 functions_and_classes.append(
                     (type(node).__name__, node.name, start_line, end_line, parameters)
                 )
@@ -244,29 +280,41 @@ class FileHandler:
         """
         with open(os.path.join(self.repo_path, file_path), "r", encoding="utf-8") as f:
             content = f.read()
-            structures = self.get_functions_and_classes(content)
-            file_objects = []  # 以列表的形式存储
-            for struct in structures:
-                structure_type, name, start_line, end_line, params = struct
-                code_info = self.get_obj_code_info(
-                    structure_type, name, start_line, end_line, params, file_path
-                )
-                file_objects.append(code_info)
+        # 整个文件只读一次，所有对象的代码都从内存中的行缓冲里切出来
+        lines = io.StringIO(content).readlines()
+        file_objects = []  # 以列表的形式存储
+        for struct in self.get_functions_and_classes(content):
+            structure_type, name, start_line, end_line, params = struct
+            code_info = self.get_obj_code_info_from_lines(
+                structure_type, name, start_line, end_line, params, lines
+            )
+            file_objects.append(code_info)
 
         return file_objects
 
-    def generate_overall_structure(self, file_path_reflections, jump_files) -> dict:
+    def generate_overall_structure(
+        self, file_path_reflections, jump_files, process_count=1, structure_cache=None
+    ) -> dict:
         """获取目标仓库的文件情况，通过AST-walk获取所有对象等情况。
         对于jump_files: 不会parse，当做不存在
+
+        Args:
+            file_path_reflections (dict): The fake file path reflections.
+            jump_files (list): Files that are treated as nonexistent.
+            process_count (int, optional): If greater than 1, files are parsed in a process pool with chunked scheduling. Defaults to 1.
+            structure_cache (StructureCache, optional): If given, files whose content hash is cached are not parsed again. Defaults to None.
+
+        Returns:
+            dict: The per-file object lists keyed by file path, in the order the files were found.
         """
-        repo_structure = {}
         gitignore_checker = GitignoreChecker(
             directory=self.repo_path,
             gitignore_path=os.path.join(self.repo_path, ".gitignore"),
         )
 
-        bar = tqdm(gitignore_checker.check_files_and_folders())
-        for not_ignored_files in bar:
+        # 跳过规则在父进程里按原来的顺序执行，只有需要parse的文件才交给worker
+        file_paths = []
+        for not_ignored_files in gitignore_checker.check_files_and_folders():
             normal_file_names = not_ignored_files
             if not_ignored_files in jump_files:
                 print(
@@ -291,19 +339,84 @@ class FileHandler:
             # if not_ignored_files in file_path_reflections.keys():
             #     not_ignored_files = file_path_reflections[not_ignored_files] #获取fake_file_path
             #     print(f"{Fore.LIGHTYELLOW_EX}[Unstaged ChangeFile] load fake-file-content: {Style.RESET_ALL}{normal_file_names}")
-
-            try:
-                repo_structure[normal_file_names] = self.generate_file_structure(
-                    not_ignored_files
-                )
-            except Exception as e:
+            file_paths.append(not_ignored_files)
+
+        # 内容没有变化的文件直接从缓存中读取，只parse剩下的文件
+        cached_structures = {}
+        file_hashes = {}
+        if structure_cache is not None:
+            for not_ignored_files in file_paths:
+                try:
+                    with open(
+                        os.path.join(self.repo_path, not_ignored_files), "rb"
+                    ) as reader:
+                        file_hashes[not_ignored_files] = get_blob_hash(reader.read())
+                except OSError:
+                    continue
+                file_structure = structure_cache.get(file_hashes[not_ignored_files])
+                if file_structure is not None:
+                    cached_structures[not_ignored_files] = file_structure
+            logger.info(
+                f"Structure cache: {len(cached_structures)} files reused, {len(file_paths) - len(cached_structures)} files to parse"
+            )
+        dirty_file_paths = [
+            file_path for file_path in file_paths if file_path not in cached_structures
+        ]
+
+        bar = tqdm(
+            zip(
+                dirty_file_paths,
+                self.generate_file_structures(dirty_file_paths, process_count),
+            ),
+            total=len(dirty_file_paths),
+        )
+        for not_ignored_files, (file_structure, error) in bar:
+            if error is not None:
                 logger.error(
-                    f"Alert: An error occurred while generating file structure for {not_ignored_files}: {e}"
+                    f"Alert: An error occurred while generating file structure for {not_ignored_files}: {error}"
                 )
                 continue
+            cached_structures[not_ignored_files] = file_structure
+            if not_ignored_files in file_hashes:
+                structure_cache.put(file_hashes[not_ignored_files], file_structure)
             bar.set_description(f"generating repo structure: {not_ignored_files}")
+        if structure_cache is not None:
+            structure_cache.save()
+
+        # 保持原来的文件顺序
+        repo_structure = {}
+        for not_ignored_files in file_paths:
+            if not_ignored_files in cached_structures:
+                repo_structure[not_ignored_files] = cached_structures[not_ignored_files]
         return repo_structure
 
+    def generate_file_structures(self, file_paths, process_count=1):
+        """
+        按顺序产出每个文件的(file_structure, error)，process_count大于1时使用进程池
+
+        Args:
+            file_paths (list): The file paths relative to the repository root.
+            process_count (int, optional): The number of worker processes. Defaults to 1.
+        """
+        if process_count <= 1 or len(file_paths) <= 1:
+            for file_path in file_paths:
+                try:
+                    yield self.generate_file_structure(file_path), None
+                except Exception as e:
+                    yield None, str(e)
+            return
+
+        # 分块调度，减少小文件多时的进程间通信开销；executor.map保证结果顺序与输入一致
+        chunksize = max(1, len(file_paths) // (process_count * 4))
+        with ProcessPoolExecutor(
+            max_workers=process_count,
+            initializer=_init_worker,
+            initargs=(self,),
+        ) as executor:
+            yield from executor.map(
+                _generate_file_structure_in_worker, file_paths, chunksize=chunksize
+            )
+
     def convert_to_markdown_file(self, file_path=None):
         """
         Converts the content of a file to markdown format.
@@ -317,8 +430,8 @@ class FileHandler:
         Raises:
             ValueError: If no file object is found for the specified file path in project_hierarchy.json.
         """
-        with open(self.project_hierarchy, "r", encoding="utf-8") as f:
-            json_data = json.load(f)
+        # sharded格式下只会读取这一个文件的shard
+        json_data = get_hierarchy_store(self.project_hierarchy).load()
 
         if file_path is None:
             file_path = self.file_path
@@ -0,0 +1,540 @@
+"""project_hierarchy的存储后端：单个json文件(monolithic)，每个源文件一个记录文件再加一个manifest(sharded)，或者SQLite数据库(sqlite)"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from repo_agent.log import logger
+from repo_agent.settings import HierarchyLayout
+from repo_agent.utils.json_codec import get_json_codec
+
+HIERARCHY_JSON_NAME = "project_hierarchy.json"
+SHARD_DIR_NAME = "project_hierarchy"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+SQLITE_DB_NAME = "project_hierarchy.db"
+SQLITE_SCHEMA_VERSION = 1
+
+# 对象中单独存表的字段，其余字段原样存成json
+REFERENCE_FIELDS = ("who_reference_me", "reference_who")
+
+
+def write_text_atomic(path: Path, text: str | bytes):
+    """先写临时文件再替换，中途崩溃也不会留下写了一半的文件"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + ".tmp")
+    if isinstance(text, str):
+        text = text.encode("utf-8")
+    with temp_path.open("wb") as writer:
+        writer.write(text)
+    os.replace(temp_path, path)
+
+
+class MonolithicHierarchyStore:
+    """The legacy layout: the whole hierarchy in `<hierarchy_name>/project_hierarchy.json`."""
+
+    layout = HierarchyLayout.MONOLITHIC
+    supports_partial_save = False
+
+    def __init__(self, target_dir_path: str | Path, compact: bool = False):
+        self.path = Path(target_dir_path) / HIERARCHY_JSON_NAME
+        self.compact = compact  # 不缩进，给机器读取的记录用
+        self.codec = get_json_codec()
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def load(self) -> dict:
+        return self.codec.loads_hierarchy(self.path.read_bytes())
+
+    def save(self, hierarchy_json: dict, partial: bool = False):
+        assert not partial, "the monolithic layout always rewrites the whole file"
+        write_text_atomic(self.path, self.codec.dumps(hierarchy_json, self.compact))
+
+    def remove(self):
+        self.path.unlink()
+
+
+class LazyHierarchy(Mapping):
+    """只读的 文件路径 -> 对象列表 映射，访问某个文件时才从store中读取这个文件的记录"""
+
+    def __init__(self, store: ShardedHierarchyStore, file_names: List[str]):
+        self.store = store
+        self.file_names = file_names
+        self.file_name_set = set(file_names)
+
+    def __getitem__(self, file_name: str) -> list:
+        if file_name not in self.file_name_set:
+            raise KeyError(file_name)
+        return self.store.load_shard(file_name)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.file_names)
+
+    def __len__(self) -> int:
+        return len(self.file_names)
+
+
+class ShardedHierarchyStore:
+    """
+    One record file per source file plus a small manifest, under `<hierarchy_name>/project_hierarchy/`.
+
+    The shard of `pkg/module.py` is `project_hierarchy/pkg/module.py.json`. The manifest keeps the
+    file order and a hash of every shard, so saving only rewrites the shards whose content changed,
+    and loading only reads a shard when its file is accessed.
+    """
+
+    layout = HierarchyLayout.SHARDED
+    supports_partial_save = True
+
+    def __init__(self, target_dir_path: str | Path, compact: bool = False):
+        self.path = Path(target_dir_path) / SHARD_DIR_NAME
+        self.manifest_path = self.path / MANIFEST_NAME
+        self.compact = compact
+        self.codec = get_json_codec()
+
+    def exists(self) -> bool:
+        return self.manifest_path.exists()
+
+    def get_shard_path(self, file_name: str) -> Path:
+        return self.path / (file_name + ".json")
+
+    def load_manifest(self) -> Dict[str, dict]:
+        if not self.exists():
+            return {}
+        manifest = self.codec.load_file(self.manifest_path)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(
+                f"Unsupported hierarchy manifest version {manifest.get('version')} in {self.manifest_path}"
+            )
+        return manifest["files"]
+
+    def load(self) -> LazyHierarchy:
+        return LazyHierarchy(self, list(self.load_manifest().keys()))
+
+    def load_shard(self, file_name: str) -> list:
+        return self.codec.load_file(self.get_shard_path(file_name))
+
+    def save(self, hierarchy_json: dict, partial: bool = False):
+        """
+        Write the shards of the given files and the manifest.
+
+        Args:
+            hierarchy_json (dict): The per-file object lists to save.
+            partial (bool, optional): If True, hierarchy_json only contains the dirty files and the other shards are kept.
+                Otherwise it is the whole hierarchy and the shards of files that no longer exist are deleted. Defaults to False.
+        """
+        old_files = self.load_manifest()
+        new_files = dict(old_files) if partial else {}
+        written_count = 0
+        for file_name, file_content in hierarchy_json.items():
+            shard_text = self.codec.dumps(file_content, self.compact)
+            shard_hash = hashlib.sha1(shard_text).hexdigest()
+            old_entry = old_files.get(file_name)
+            shard_path = self.get_shard_path(file_name)
+            if (
+                old_entry is None
+                or old_entry["hash"] != shard_hash
+                or not shard_path.exists()
+            ):
+                write_text_atomic(shard_path, shard_text)
+                written_count += 1
+            new_files[file_name] = {"hash": shard_hash}
+
+        removed_files = [name for name in old_files if name not in new_files]
+        for file_name in removed_files:
+            self.remove_shard(file_name)
+
+        write_text_atomic(
+            self.manifest_path,
+            self.codec.dumps(
+                {"version": MANIFEST_VERSION, "files": new_files}, self.compact
+            ),
+        )
+        logger.debug(
+            f"Saved sharded hierarchy to {self.path}: {written_count} shards written, {len(removed_files)} removed"
+        )
+
+    def remove_shard(self, file_name: str):
+        shard_path = self.get_shard_path(file_name)
+        if shard_path.exists():
+            shard_path.unlink()
+        # 删除变空的目录，但不删除shard根目录
+        parent = shard_path.parent
+        while parent != self.path and parent.exists() and not any(parent.iterdir()):
+            parent.rmdir()
+            parent = parent.parent
+
+    def remove(self):
+        shutil.rmtree(self.path)
+
+
+class SqliteHierarchyStore:
+    """
+    The hierarchy in a SQLite database, `<hierarchy_name>/project_hierarchy.db`.
+
+    Tables:
+        files: one row per source file, with its order in the hierarchy and a hash of its objects.
+        items: one row per object. name, type, item_status and the code lines are columns (indexed
+            by name, file and status), the rest of the object is kept as JSON.
+        item_references: the who_reference_me / reference_who lists, indexed by the referenced name.
+        doc_versions: the md_content list, one row per document version.
+
+    The database runs in WAL mode, so readers such as the chat UI are not blocked by a checkpoint,
+    and every save is a single transaction.
+    """
+
+    layout = HierarchyLayout.SQLITE
+    supports_partial_save = True
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files (
+        file_name TEXT PRIMARY KEY,
+        position INTEGER NOT NULL,
+        content_hash TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS items (
+        file_name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        type TEXT,
+        item_status TEXT,
+        code_start_line INTEGER,
+        code_end_line INTEGER,
+        record TEXT NOT NULL,
+        PRIMARY KEY (file_name, position)
+    );
+    CREATE INDEX IF NOT EXISTS idx_items_name ON items (name);
+    CREATE INDEX IF NOT EXISTS idx_items_status ON items (item_status);
+    CREATE TABLE IF NOT EXISTS item_references (
+        file_name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        direction TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        target TEXT NOT NULL,
+        PRIMARY KEY (file_name, position, direction, seq)
+    );
+    CREATE INDEX IF NOT EXISTS idx_item_references_target ON item_references (target);
+    CREATE TABLE IF NOT EXISTS doc_versions (
+        file_name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        version INTEGER NOT NULL,
+        md_content TEXT,
+        PRIMARY KEY (file_name, position, version)
+    );
+    """
+
+    def __init__(self, target_dir_path: str | Path, compact: bool = True):
+        self.path = Path(target_dir_path) / SQLITE_DB_NAME
+        self.local = threading.local()  # sqlite3的连接不能跨线程使用，每个线程一个连接
+        self.codec = get_json_codec()  # 数据库中的record总是紧凑的，compact参数只是为了和其他store的接口一致
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def connect(self, write: bool = False) -> sqlite3.Connection:
+        """
+        当前线程的连接。只有写(或者数据库还不存在)时才设置WAL并建表，
+        chat UI这样只读的调用方不会改动数据库。
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            write = write or not self.path.exists()
+            if write:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path)
+            self.local.connection = connection
+            self.local.schema_ready = False
+        if write and not self.local.schema_ready:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(self.SCHEMA)
+            connection.execute(f"PRAGMA user_version={SQLITE_SCHEMA_VERSION}")
+            self.local.schema_ready = True
+        return connection
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    def load(self) -> LazyHierarchy:
+        rows = self.connect().execute("SELECT file_name FROM files ORDER BY position")
+        return LazyHierarchy(self, [file_name for (file_name,) in rows])
+
+    def load_shard(self, file_name: str) -> list:
+        """读取一个文件的所有对象，和json格式中的对象完全相同(包括字段顺序)"""
+        return self.query_items("items.file_name = ?", (file_name,))
+
+    def find_items(self, name=None, file_name=None, item_status=None) -> List[dict]:
+        """
+        Query objects through the name, file and status indexes.
+
+        Returns:
+            list: The matching objects in hierarchy order, each with an extra "file_name" key.
+        """
+        conditions, params = [], []
+        for column, value in (
+            ("name", name),
+            ("file_name", file_name),
+            ("item_status", item_status),
+        ):
+            if value is not None:
+                conditions.append(f"items.{column} = ?")
+                params.append(value)
+        return self.query_items(
+            " AND ".join(conditions) or "1", tuple(params), with_file_name=True
+        )
+
+    def query_items(self, where: str, params: tuple, with_file_name=False) -> List[dict]:
+        """按条件查询对象，文档版本和引用关系各用一次join查询一起读出，而不是每个对象查一次"""
+        connection = self.connect()
+        item_rows = connection.execute(
+            f"SELECT items.file_name, items.position, items.record FROM items "
+            f"JOIN files ON files.file_name = items.file_name "
+            f"WHERE {where} ORDER BY files.position, items.position",
+            params,
+        ).fetchall()
+        if not item_rows:
+            return []
+        md_contents: Dict[tuple, list] = {}
+        for file_name, position, md_content in connection.execute(
+            "SELECT doc_versions.file_name, doc_versions.position, doc_versions.md_content "
+            "FROM doc_versions JOIN items ON items.file_name = doc_versions.file_name "
+            "AND items.position = doc_versions.position "
+            f"JOIN files ON files.file_name = items.file_name WHERE {where} "
+            "ORDER BY doc_versions.file_name, doc_versions.position, doc_versions.version",
+            params,
+        ):
+            md_contents.setdefault((file_name, position), []).append(md_content)
+        references: Dict[tuple, list] = {}
+        for file_name, position, direction, target in connection.execute(
+            "SELECT item_references.file_name, item_references.position, item_references.direction, item_references.target "
+            "FROM item_references JOIN items ON items.file_name = item_references.file_name "
+            "AND items.position = item_references.position "
+            f"JOIN files ON files.file_name = items.file_name WHERE {where} "
+            "ORDER BY item_references.file_name, item_references.position, item_references.direction, item_references.seq",
+            params,
+        ):
+            references.setdefault((file_name, position, direction), []).append(target)
+
+        objects = []
+        for file_name, position, record in item_rows:
+            obj = self.codec.loads(record)
+            key = (file_name, position)
+            obj["md_content"] = md_contents.get(key, [])
+            for direction in REFERENCE_FIELDS:
+                if direction in obj:
+                    obj[direction] = references.get(key + (direction,), [])
+            if with_file_name:
+                obj["file_name"] = file_name
+            objects.append(obj)
+        return objects
+
+    def save(self, hierarchy_json: dict, partial: bool = False):
+        """
+        Save the given files in one transaction, rewriting only the files whose objects changed.
+
+        Args:
+            hierarchy_json (dict): The per-file object lists to save.
+            partial (bool, optional): If True, hierarchy_json only contains the dirty files and the other files are kept.
+                Otherwise it is the whole hierarchy and files that no longer exist are deleted. Defaults to False.
+        """
+        connection = self.connect(write=True)
+        try:
+            with connection:  # 一个事务，出错时整体回滚
+                old_hashes = dict(
+                    connection.execute("SELECT file_name, content_hash FROM files")
+                )
+                next_position = (
+                    connection.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM files").fetchone()[0]
+                    if partial
+                    else 0
+                )
+                written_count = 0
+                for file_name, file_content in hierarchy_json.items():
+                    content_hash = hashlib.sha1(
+                        self.codec.dumps(file_content, compact=True)
+                    ).hexdigest()
+                    if partial and file_name in old_hashes:
+                        connection.execute(
+                            "UPDATE files SET content_hash = ? WHERE file_name = ?",
+                            (content_hash, file_name),
+                        )
+                    else:
+                        connection.execute(
+                            "INSERT OR REPLACE INTO files (file_name, position, content_hash) VALUES (?, ?, ?)",
+                            (file_name, next_position, content_hash),
+                        )
+                        next_position += 1
+                    if old_hashes.get(file_name) == content_hash:
+                        continue
+                    self.delete_file_rows(connection, file_name, keep_file=True)
+                    self.insert_file_rows(connection, file_name, file_content)
+                    written_count += 1
+
+                removed_files = (
+                    [] if partial else [name for name in old_hashes if name not in hierarchy_json]
+                )
+                for file_name in removed_files:
+                    self.delete_file_rows(connection, file_name)
+            # 把WAL合并回数据库文件，不等待正在读的连接
+            connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        except sqlite3.Error as e:
+            raise IOError(f"SQLite error while saving {self.path}: {e}") from e
+        logger.debug(
+            f"Saved hierarchy to {self.path}: {written_count} files written, {len(removed_files)} removed"
+        )
+
+    def insert_file_rows(self, connection: sqlite3.Connection, file_name: str, file_content: list):
+        for position, obj in enumerate(file_content):
+            # md_content和引用关系单独存表，record中保留占位，这样读回来的字段顺序不变
+            record = {
+                key: (None if key in ("md_content",) + REFERENCE_FIELDS else value)
+                for key, value in obj.items()
+            }
+            connection.execute(
+                "INSERT INTO items (file_name, position, name, type, item_status, code_start_line, code_end_line, record) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    file_name,
+                    position,
+                    obj.get("name", ""),
+                    obj.get("type"),
+                    obj.get("item_status"),
+                    obj.get("code_start_line"),
+                    obj.get("code_end_line"),
+                    self.codec.dumps(record, compact=True).decode("utf-8"),
+                ),
+            )
+            connection.executemany(
+                "INSERT INTO doc_versions (file_name, position, version, md_content) VALUES (?, ?, ?, ?)",
+                [
+                    (file_name, position, version, md_content)
+                    for version, md_content in enumerate(obj.get("md_content") or [])
+                ],
+            )
+            for direction in REFERENCE_FIELDS:
+                connection.executemany(
+                    "INSERT INTO item_references (file_name, position, direction, seq, target) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (file_name, position, direction, seq, target)
+                        for seq, target in enumerate(obj.get(direction) or [])
+                    ],
+                )
+
+    @staticmethod
+    def delete_file_rows(connection: sqlite3.Connection, file_name: str, keep_file=False):
+        for table in ("items", "item_references", "doc_versions"):
+            connection.execute(f"DELETE FROM {table} WHERE file_name = ?", (file_name,))
+        if not keep_file:
+            connection.execute("DELETE FROM files WHERE file_name = ?", (file_name,))
+
+    def remove(self):
+        self.close()
+        for suffix in ("", "-wal", "-shm"):
+            path = self.path.with_name(self.path.name + suffix)
+            if path.exists():
+                path.unlink()
+
+
+def get_store_for_layout(
+    target_dir_path: str | Path, layout: HierarchyLayout, compact: bool = False
+):
+    if layout == HierarchyLayout.SQLITE:
+        return SqliteHierarchyStore(target_dir_path)
+    if layout == HierarchyLayout.SHARDED:
+        return ShardedHierarchyStore(target_dir_path, compact)
+    return MonolithicHierarchyStore(target_dir_path, compact)
+
+
+def get_hierarchy_store(
+    target_dir_path: str | Path,
+    default_layout: Optional[HierarchyLayout] = None,
+    compact: bool = False,
+):
+    """
+    Get the store of the hierarchy under target_dir_path.
+
+    The layout that already exists on disk wins, so that switching the setting never leaves two
+    diverging copies behind (use `migrate_hierarchy` to convert). `default_layout` only decides the
+    layout of a new record, and defaults to the monolithic layout. `compact` writes JSON without
+    indentation; either form is read back.
+    """
+    for layout in (
+        HierarchyLayout.SQLITE,
+        HierarchyLayout.SHARDED,
+        HierarchyLayout.MONOLITHIC,
+    ):
+        store = get_store_for_layout(target_dir_path, layout, compact)
+        if store.exists():
+            return store
+    return get_store_for_layout(
+        target_dir_path, default_layout or HierarchyLayout.MONOLITHIC, compact
+    )
+
+
+def save_file_record(hierarchy_store, hierarchy_json: Mapping, file_name: str, file_content):
+    """更新单个文件的记录：支持部分保存的格式只写这一个文件，否则整体重写"""
+    if hierarchy_store.supports_partial_save:
+        hierarchy_store.save({file_name: file_content}, partial=True)
+    else:
+        hierarchy_json = dict(hierarchy_json)
+        hierarchy_json[file_name] = file_content
+        hierarchy_store.save(hierarchy_json)
+
+
+def migrate_hierarchy(target_dir_path: str | Path, layout: HierarchyLayout) -> int:
+    """
+    Convert the hierarchy under target_dir_path to the given layout and remove the old one.
+
+    Returns:
+        int: The number of files in the hierarchy.
+
+    Raises:
+        FileNotFoundError: If there is no hierarchy under target_dir_path.
+    """
+    source_store = get_hierarchy_store(target_dir_path)
+    if not source_store.exists():
+        raise FileNotFoundError(f"No project hierarchy found in {target_dir_path}")
+    hierarchy_json = dict(source_store.load())
+    if source_store.layout == layout:
+        return len(hierarchy_json)
+    get_store_for_layout(target_dir_path, layout).save(hierarchy_json)
+    source_store.remove()
+    return len(hierarchy_json)
+
+
+def export_hierarchy_json(
+    target_dir_path: str | Path, output_path: str | Path, compact: bool = False
+) -> int:
+    """
+    Export the hierarchy under target_dir_path, whatever its layout, to a legacy project_hierarchy.json file.
+
+    Args:
+        target_dir_path (str | Path): The directory that contains the hierarchy.
+        output_path (str | Path): The JSON file to write.
+        compact (bool, optional): Write the JSON without indentation. Defaults to False.
+
+    Returns:
+        int: The number of files exported.
+
+    Raises:
+        FileNotFoundError: If there is no hierarchy under target_dir_path.
+    """
+    source_store = get_hierarchy_store(target_dir_path)
+    if not source_store.exists():
+        raise FileNotFoundError(f"No project hierarchy found in {target_dir_path}")
+    hierarchy_json = dict(source_store.load())
+    write_text_atomic(
+        Path(output_path), get_json_codec().dumps(hierarchy_json, compact)
+    )
+    return len(hierarchy_json)
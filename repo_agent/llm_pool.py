@@ -0,0 +1,208 @@
+"""多个LLM后端的负载均衡：按进行中的请求数或者延迟选择后端，定期健康检查，请求失败时切换到其他后端"""
+
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from llama_index.llms.openai_like import OpenAILike
+
+from repo_agent.log import logger
+from repo_agent.settings import LlmRouting
+
+try:
+    from spooky.configuration import ConfigLoader
+    from spooky.llm import build_client
+except ModuleNotFoundError:  # pragma: no cover - spooky lives in src/ and might not be installed
+    ConfigLoader = None
+    build_client = None
+
+LATENCY_SMOOTHING = 0.2  # 延迟的指数移动平均系数
+
+
+class LlmEndpoint:
+    """一个LLM后端：发请求用的OpenAILike客户端、健康检查用的spooky客户端，以及路由用的统计"""
+
+    def __init__(self, name: str, llm: OpenAILike, health_client=None):
+        self.name = name
+        self.llm = llm
+        self.health_client = health_client
+        self.outstanding = 0  # 正在进行的请求数
+        self.latency: Optional[float] = None  # 延迟的指数移动平均
+        self.healthy = True
+        self.request_count = 0
+        self.failure_count = 0
+
+    def get_score(self, routing: LlmRouting) -> float:
+        """分数越低越优先"""
+        if routing == LlmRouting.LATENCY_WEIGHTED:
+            # 还没有延迟数据的后端按最快的算，先让它接一些请求
+            return (self.outstanding + 1) * (self.latency or 0.0)
+        return float(self.outstanding)
+
+
+class LlmEndpointPool:
+    """
+    Spreads the LLM requests of one run over several endpoints.
+
+    Each request goes to the healthy endpoint with the fewest requests in flight, or with the lowest
+    (requests in flight + 1) * average latency for latency-weighted routing. An endpoint whose request
+    fails with a connection error, a timeout or a server error is taken out of the rotation at once,
+    so the retry of that request goes elsewhere, and it comes back when a health check succeeds.
+    Health checks run in a background thread through the `ping()` of the spooky local model clients.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[LlmEndpoint],
+        routing: LlmRouting = LlmRouting.LEAST_OUTSTANDING,
+        health_check_interval: float = 30.0,
+    ):
+        """
+        Args:
+            endpoints (List[LlmEndpoint]): The endpoints, at least one.
+            routing (LlmRouting, optional): How an endpoint is chosen. Defaults to LlmRouting.LEAST_OUTSTANDING.
+            health_check_interval (float, optional): Seconds between two health checks of all endpoints. Defaults to 30.0.
+        """
+        if not endpoints:
+            raise ValueError("An LLM endpoint pool needs at least one endpoint.")
+        self.endpoints = endpoints
+        self.routing = routing
+        self.health_check_interval = health_check_interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.health_thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_models_config(
+        cls,
+        models_config_path: Path,
+        server_names: List[str],
+        make_llm: Callable[[str, str, Optional[str]], OpenAILike],
+        routing: LlmRouting = LlmRouting.LEAST_OUTSTANDING,
+        health_check_interval: float = 30.0,
+    ) -> LlmEndpointPool:
+        """
+        Build a pool from the `local_servers` of config/models.yaml.
+
+        A server is called through its OpenAI compatible API at `chat_base_url`, which defaults to
+        `<base_url>/v1`, with its `model`, which defaults to the model of the run.
+
+        Args:
+            models_config_path (Path): The path to models.yaml.
+            server_names (List[str]): The names of the servers to use.
+            make_llm (Callable): Builds the client from (api base, api key, model or None).
+            routing (LlmRouting, optional): How an endpoint is chosen. Defaults to LlmRouting.LEAST_OUTSTANDING.
+            health_check_interval (float, optional): Seconds between two health checks. Defaults to 30.0.
+
+        Returns:
+            LlmEndpointPool: The pool, not started yet.
+        """
+        if ConfigLoader is None or build_client is None:
+            raise RuntimeError(
+                "Load balancing over local servers needs the spooky package, install it with `pip install -e .`."
+            )
+        servers = ConfigLoader(models_path=Path(models_config_path)).load_local_servers()
+        endpoints = []
+        for name in server_names:
+            if name not in servers:
+                raise ValueError(f"Server '{name}' is not defined in {models_config_path}")
+            server = servers[name]
+            api_key = os.getenv(server.api_key_env) if server.api_key_env else None
+            chat_base_url = server.chat_base_url or f"{server.base_url.rstrip('/')}/v1"
+            endpoints.append(
+                LlmEndpoint(
+                    name=name,
+                    llm=make_llm(chat_base_url, api_key, server.model),
+                    health_client=build_client(
+                        provider=server.provider, base_url=server.base_url, api_key=api_key
+                    ),
+                )
+            )
+        return cls(endpoints, routing=routing, health_check_interval=health_check_interval)
+
+    def start(self) -> LlmEndpointPool:
+        """检查一次所有后端的健康状况，然后在后台定期检查"""
+        self.check_health()
+        healthy = [endpoint.name for endpoint in self.endpoints if endpoint.healthy]
+        logger.info(f"LLM endpoints: {len(healthy)}/{len(self.endpoints)} healthy ({', '.join(healthy) or 'none'})")
+        self.health_thread = threading.Thread(target=self.health_loop, daemon=True)
+        self.health_thread.start()
+        return self
+
+    def close(self):
+        self.stop_event.set()
+        if self.health_thread is not None:
+            self.health_thread.join()
+            self.health_thread = None
+
+    def health_loop(self):
+        while not self.stop_event.wait(self.health_check_interval):
+            self.check_health()
+
+    def check_health(self):
+        for endpoint in self.endpoints:
+            if endpoint.health_client is None:
+                # 没有健康检查的后端，在下一轮检查时重新加入
+                with self.lock:
+                    endpoint.healthy = True
+                continue
+            try:
+                endpoint.health_client.ping()
+                healthy = True
+            except Exception as e:  # ping失败时抛出LocalModelError，也可能是其他网络错误
+                logger.debug(f"Health check of LLM endpoint {endpoint.name} failed: {e}")
+                healthy = False
+            with self.lock:
+                if healthy != endpoint.healthy:
+                    logger.info(f"LLM endpoint {endpoint.name} is {'back' if healthy else 'down'}")
+                endpoint.healthy = healthy
+
+    def acquire(self) -> LlmEndpoint:
+        """选择一个后端，调用方在请求结束后需要调用release"""
+        with self.lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+            if not candidates:
+                # 全部不健康时仍然要尝试，可能健康检查还没来得及恢复
+                candidates = self.endpoints
+            endpoint = min(candidates, key=lambda e: e.get_score(self.routing))
+            endpoint.outstanding += 1
+            endpoint.request_count += 1
+            return endpoint
+
+    def has_healthy_endpoint(self) -> bool:
+        with self.lock:
+            return any(endpoint.healthy for endpoint in self.endpoints)
+
+    def release(self, endpoint: LlmEndpoint, latency: Optional[float] = None, failed: bool = False):
+        """
+        Report the outcome of a request sent to an endpoint from acquire.
+
+        Args:
+            endpoint (LlmEndpoint): The endpoint.
+            latency (float, optional): The latency of a successful request. Defaults to None.
+            failed (bool, optional): The endpoint failed to answer, take it out of the rotation until it passes a health check. Defaults to False.
+        """
+        with self.lock:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.failure_count += 1
+                if endpoint.healthy and any(
+                    other.healthy for other in self.endpoints if other is not endpoint
+                ):
+                    logger.warning(f"LLM endpoint {endpoint.name} failed, failing over to the other endpoints")
+                    endpoint.healthy = False
+            elif latency is not None:
+                if endpoint.latency is None:
+                    endpoint.latency = latency
+                else:
+                    endpoint.latency += LATENCY_SMOOTHING * (latency - endpoint.latency)
+
+    def log_stats(self):
+        for endpoint in self.endpoints:
+            logger.info(
+                f"LLM endpoint {endpoint.name}: {endpoint.request_count} requests, {endpoint.failure_count} failed"
+                + (f", {endpoint.latency:.2f}s average latency" if endpoint.latency is not None else "")
+            )
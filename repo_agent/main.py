@@ -6,7 +6,8 @@ from pydantic import ValidationError
 from repo_agent.doc_meta_info import DocItem, MetaInfo
 from repo_agent.log import logger, set_logger_level_from_config
 from repo_agent.runner import Runner, delete_fake_files
-from repo_agent.settings import SettingsManager, LogLevel
+from repo_agent.hierarchy_store import export_hierarchy_json, migrate_hierarchy
+from repo_agent.settings import HierarchyLayout, LlmRouting, SettingsManager, LogLevel
 from repo_agent.utils.meta_info_utils import delete_fake_files, make_fake_files
 
 try:
@@ -121,6 +122,203 @@ def handle_setting_error(e: ValidationError):
     default=4,
     show_default=True,
 )
+@click.option(
+    "--async-mode",
+    "-am",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="If set, generates documents on an asyncio event loop instead of worker threads.",
+)
+@click.option(
+    "--max-concurrent-requests",
+    "-mcr",
+    default=64,
+    show_default=True,
+    help="The maximum number of in-flight LLM requests in async mode.",
+    type=int,
+)
+@click.option(
+    "--max-process-count",
+    "-mpc",
+    default=1,
+    show_default=True,
+    help="The number of processes used for CPU-bound parsing such as repo structure scanning and reference resolving. Independent of --max-thread-count.",
+    type=int,
+)
+@click.option(
+    "--structure-cache-size",
+    "-scs",
+    default=20000,
+    show_default=True,
+    help="The maximum number of per-file AST structures cached by content hash next to project_hierarchy.json. 0 disables the cache.",
+    type=int,
+)
+@click.option(
+    "--checkpoint-every-items",
+    "-cei",
+    default=50,
+    show_default=True,
+    help="Fold the journal of generated documents into project_hierarchy.json after this many documents.",
+    type=int,
+)
+@click.option(
+    "--checkpoint-interval",
+    "-ci",
+    default=30.0,
+    show_default=True,
+    help="Fold the journal of generated documents into project_hierarchy.json at least every this many seconds.",
+    type=float,
+)
+@click.option(
+    "--hierarchy-layout",
+    "-hl",
+    default=HierarchyLayout.MONOLITHIC.value,
+    show_default=True,
+    help="The storage layout of a new project hierarchy: one project_hierarchy.json, one record file per source file plus a manifest, or an indexed SQLite database. An existing hierarchy keeps its layout, use `migrate-hierarchy` to convert it.",
+    type=click.Choice([layout.value for layout in HierarchyLayout], case_sensitive=False),
+)
+@click.option(
+    "--compact-json",
+    "-cj",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="If set, writes the project hierarchy as JSON without indentation, which is smaller and faster for machine consumers.",
+)
+@click.option(
+    "--rename-similarity-threshold",
+    "-rst",
+    default=0.9,
+    show_default=True,
+    help="The minimum token similarity for a new object to inherit the document of a renamed or moved one. Set to 1 to only carry documents across moves whose normalized code is identical.",
+    type=click.FloatRange(0.0, 1.0),
+)
+@click.option(
+    "--ignore-cosmetic-changes/--no-ignore-cosmetic-changes",
+    default=True,
+    show_default=True,
+    help="Keep the documents of objects whose code only changed in formatting or comments, compared by an AST fingerprint.",
+)
+@click.option(
+    "--ignore-docstring-changes",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="If set, changes that only touch docstrings also keep the existing documents. Requires --ignore-cosmetic-changes.",
+)
+@click.option(
+    "--llm-cache-size",
+    "-lcs",
+    default=10000,
+    show_default=True,
+    help="The maximum number of LLM responses cached by prompt hash next to project_hierarchy.json, the least recently used ones are evicted. 0 disables the cache.",
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--bypass-llm-cache",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="If set, always calls the LLM instead of reusing cached responses. New responses are still cached.",
+)
+@click.option(
+    "--max-prompt-tokens",
+    "-mpt",
+    default=16000,
+    show_default=True,
+    help="The token budget of the prompt for one object. Callers and callees that do not fit are shortened to their documents or only listed by name, the nearest ones are kept first. 0 disables the budget.",
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--batch-size",
+    "-bs",
+    default=1,
+    show_default=True,
+    help="Document up to this many small objects of the same file with one request. Objects whose document cannot be parsed from the response are retried one by one. 1 disables batching.",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--batch-max-lines",
+    "-bml",
+    default=15,
+    show_default=True,
+    help="Only objects with at most this many lines of code are batched.",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="If set, streams the responses and logs the time to first token and tokens/s of every request.",
+)
+@click.option(
+    "--max-completion-tokens",
+    "-mct",
+    default=0,
+    show_default=True,
+    help="The maximum number of tokens generated for one response. With --stream, runaway responses are also cut off on the client. Cut off responses are kept but not cached. 0 means no limit.",
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--llm-max-retries",
+    "-lmr",
+    default=3,
+    show_default=True,
+    help="How many times a request is retried, with jittered exponential backoff, after a rate limit, a timeout or a server error.",
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--adaptive-concurrency",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="If set, adjusts the number of requests in flight to the backend: it grows while requests succeed and is halved on rate limits, errors and latency spikes. --max-thread-count (or --max-concurrent-requests with --async-mode) is the upper bound.",
+)
+@click.option(
+    "--requests-per-minute",
+    "-rpm",
+    default=0,
+    show_default=True,
+    help="The maximum number of LLM requests per minute. 0 means no limit.",
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--tokens-per-minute",
+    "-tpm",
+    default=0,
+    show_default=True,
+    help="The maximum number of LLM tokens per minute, estimated locally before each request. 0 means no limit.",
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--llm-servers",
+    "-lsv",
+    default="",
+    help="A comma-separated list of local_servers from the models config. If set, requests are load balanced over these servers instead of --base-url, with health checks and automatic failover. Servers running different models give nondeterministic documents.",
+)
+@click.option(
+    "--models-config",
+    default="config/models.yaml",
+    show_default=True,
+    help="The models config that defines the local_servers used by --llm-servers.",
+    type=click.Path(dir_okay=False),
+)
+@click.option(
+    "--llm-routing",
+    default=LlmRouting.LEAST_OUTSTANDING.value,
+    show_default=True,
+    help="How a request picks one of the --llm-servers: the fewest requests in flight, or the lowest (requests in flight + 1) * average latency.",
+    type=click.Choice([routing.value for routing in LlmRouting], case_sensitive=False),
+)
+@click.option(
+    "--health-check-interval",
+    default=30.0,
+    show_default=True,
+    help="Seconds between two health checks of the --llm-servers.",
+    type=click.FloatRange(min=0, min_open=True),
+)
 @click.option(
     "--log-level",
     "-ll",
@@ -148,6 +346,32 @@ def run(
     ignore_list,
     language,
     max_thread_count,
+    async_mode,
+    max_concurrent_requests,
+    max_process_count,
+    structure_cache_size,
+    checkpoint_every_items,
+    checkpoint_interval,
+    hierarchy_layout,
+    compact_json,
+    rename_similarity_threshold,
+    ignore_cosmetic_changes,
+    ignore_docstring_changes,
+    llm_cache_size,
+    bypass_llm_cache,
+    max_prompt_tokens,
+    batch_size,
+    batch_max_lines,
+    stream,
+    max_completion_tokens,
+    llm_max_retries,
+    adaptive_concurrency,
+    requests_per_minute,
+    tokens_per_minute,
+    llm_servers,
+    models_config,
+    llm_routing,
+    health_check_interval,
     log_level,
     print_hierarchy,
 ):
@@ -166,6 +390,32 @@ def run(
             request_timeout=request_timeout,
             openai_base_url=base_url,
             max_thread_count=max_thread_count,
+            async_mode=async_mode,
+            max_concurrent_requests=max_concurrent_requests,
+            max_process_count=max_process_count,
+            structure_cache_size=structure_cache_size,
+            checkpoint_every_items=checkpoint_every_items,
+            checkpoint_interval=checkpoint_interval,
+            hierarchy_layout=hierarchy_layout,
+            compact_json=compact_json,
+            rename_similarity_threshold=rename_similarity_threshold,
+            ignore_cosmetic_changes=ignore_cosmetic_changes,
+            ignore_docstring_changes=ignore_docstring_changes,
+            llm_cache_size=llm_cache_size,
+            bypass_llm_cache=bypass_llm_cache,
+            max_prompt_tokens=max_prompt_tokens,
+            batch_size=batch_size,
+            batch_max_lines=batch_max_lines,
+            stream=stream,
+            max_completion_tokens=max_completion_tokens,
+            llm_max_retries=llm_max_retries,
+            adaptive_concurrency=adaptive_concurrency,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            llm_servers=[item.strip() for item in llm_servers.split(",") if item.strip()],
+            models_config_path=models_config,
+            llm_routing=llm_routing,
+            health_check_interval=health_check_interval,
         )
         set_logger_level_from_config(log_level=log_level)
     except ValidationError as e:
@@ -188,6 +438,64 @@ def clean():
     logger.success("Fake files have been cleaned up.")
 
 
+@cli.command("migrate-hierarchy")
+@click.option(
+    "--layout",
+    "-l",
+    required=True,
+    help="The layout to convert the project hierarchy to.",
+    type=click.Choice([layout.value for layout in HierarchyLayout], case_sensitive=False),
+)
+def migrate_hierarchy_layout(layout):
+    """Convert the project hierarchy between the monolithic, sharded and sqlite layouts."""
+    try:
+        # Fetch and validate the settings using the SettingsManager
+        setting = SettingsManager.get_setting()
+    except ValidationError as e:
+        handle_setting_error(e)
+        return
+
+    target_dir = setting.project.target_repo / setting.project.hierarchy_name
+    try:
+        file_count = migrate_hierarchy(target_dir, HierarchyLayout(layout.lower()))
+    except FileNotFoundError as e:
+        raise click.ClickException(str(e))
+    logger.success(
+        f"Project hierarchy of {file_count} files is stored in the {layout} layout."
+    )
+
+
+@cli.command("export-hierarchy")
+@click.option(
+    "--output",
+    "-o",
+    required=True,
+    help="The path of the legacy project_hierarchy.json file to write.",
+    type=click.Path(dir_okay=False),
+)
+@click.option(
+    "--compact",
+    is_flag=True,
+    default=False,
+    help="If set, writes the JSON without indentation.",
+)
+def export_hierarchy(output, compact):
+    """Export the project hierarchy, whatever its layout, to a legacy project_hierarchy.json file."""
+    try:
+        # Fetch and validate the settings using the SettingsManager
+        setting = SettingsManager.get_setting()
+    except ValidationError as e:
+        handle_setting_error(e)
+        return
+
+    target_dir = setting.project.target_repo / setting.project.hierarchy_name
+    try:
+        file_count = export_hierarchy_json(target_dir, output, compact)
+    except FileNotFoundError as e:
+        raise click.ClickException(str(e))
+    logger.success(f"Exported the project hierarchy of {file_count} files to {output}.")
+
+
 @cli.command()
 def diff():
     """Check for changes and print which documents will be updated or generated."""
@@ -1,18 +1,24 @@
 from __future__ import annotations
 
+import asyncio
 import random
 import threading
 import time
-from typing import Any, Callable, Dict, List
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
 
 from colorama import Fore, Style
 
+from repo_agent.log import logger
+
 
 class Task:
     def __init__(self, task_id: int, dependencies: List[Task], extra_info: Any = None):
         self.task_id = task_id
         self.extra_info = extra_info
         self.dependencies = dependencies
+        self.dependents: List[Task] = []  # 反向索引：依赖于本任务的任务
+        self.remain_dependency_count = len(dependencies)  # 尚未完成的依赖数(入度)
         self.status = 0  # 任务状态：0未开始，1正在进行，2已经完成，3出错了
 
 
@@ -26,15 +32,28 @@ class TaskManager:
         Attributes:
         - task_dict (Dict[int, Task]): A dictionary that maps task IDs to Task objects.
         - task_lock (threading.Lock): A lock used for thread synchronization when accessing the task_dict.
+        - task_condition (threading.Condition): A condition bound to task_lock, notified whenever a task becomes ready or the task_dict is drained.
+        - ready_queue (deque): Tasks whose dependencies are all completed, in the order they became ready.
+          Tasks taken by take_ready_batch stay in it and are skipped when popped.
+        - batch_key (Callable, optional): Maps the extra info of a task to the key of the batch it can join, or None.
+        - ready_by_key (Dict[Hashable, deque]): Ready tasks grouped by batch key, see enable_batching.
         - now_id (int): The current task ID.
         - query_id (int): The current query ID.
+        - completed_count (int): The number of completed tasks.
+        - start_time (float, optional): When the first task was handed out, for the progress report.
         - sync_func (None): A placeholder for a synchronization function.
 
         """
         self.task_dict: Dict[int, Task] = {}
         self.task_lock = threading.Lock()
+        self.task_condition = threading.Condition(self.task_lock)
+        self.ready_queue: Deque[Task] = deque()
+        self.batch_key: Optional[Callable[[Any], Optional[Hashable]]] = None
+        self.ready_by_key: Dict[Hashable, Deque[Task]] = {}
         self.now_id = 0
         self.query_id = 0
+        self.completed_count = 0
+        self.start_time: Optional[float] = None
 
     @property
     def all_success(self) -> bool:
@@ -53,54 +72,381 @@ class TaskManager:
         """
         with self.task_lock:
             depend_tasks = [self.task_dict[task_id] for task_id in dependency_task_id]
-            self.task_dict[self.now_id] = Task(
+            new_task = Task(
                 task_id=self.now_id, dependencies=depend_tasks, extra_info=extra
             )
+            for depend_task in depend_tasks:
+                depend_task.dependents.append(new_task)
+            self.task_dict[self.now_id] = new_task
+            if new_task.remain_dependency_count == 0:
+                self.push_ready(new_task)
+                self.task_condition.notify()
             self.now_id += 1
             return self.now_id - 1
 
-    def get_next_task(self, process_id: int):
+    def enable_batching(self, batch_key: Callable[[Any], Optional[Hashable]]):
+        """
+        Group ready tasks by `batch_key(extra_info)` so that take_ready_batch can find them without scanning.
+
+        Args:
+            batch_key (Callable): Returns the batch key of a task, or None if the task is never batched.
+        """
+        with self.task_lock:
+            self.batch_key = batch_key
+            self.ready_by_key = {}
+            for task in self.ready_queue:
+                self.index_ready(task)
+
+    def index_ready(self, task: Task):
+        key = self.batch_key(task.extra_info) if self.batch_key is not None else None
+        if key is not None:
+            self.ready_by_key.setdefault(key, deque()).append(task)
+
+    def push_ready(self, task: Task):
+        """调用方需要持有task_lock"""
+        self.ready_queue.append(task)
+        self.index_ready(task)
+
+    def drop_taken_tasks(self):
+        """丢掉ready_queue开头已经被take_ready_batch取走的任务，调用方需要持有task_lock"""
+        while self.ready_queue and self.ready_queue[0].status != 0:
+            self.ready_queue.popleft()
+
+    def get_next_task(self, process_id: int, block: bool = False):
         """
         Get the next task for a given process ID.
 
         Args:
             process_id (int): The ID of the process.
+            block (bool, optional): If True, wait until a task becomes ready or all tasks are done. Defaults to False.
 
         Returns:
             tuple: A tuple containing the next task object and its ID.
                    If there are no available tasks, returns (None, -1).
         """
-        with self.task_lock:
+        with self.task_condition:
             self.query_id += 1
-            for task_id in self.task_dict.keys():
-                ready = (
-                    len(self.task_dict[task_id].dependencies) == 0
-                ) and self.task_dict[task_id].status == 0
-                if ready:
-                    self.task_dict[task_id].status = 1
-                    print(
-                        f"{Fore.RED}[process {process_id}]{Style.RESET_ALL}: get task({task_id}), remain({len(self.task_dict)})"
-                    )
-                    return self.task_dict[task_id], task_id
-            return None, -1
+            self.drop_taken_tasks()
+            while block and not self.ready_queue and len(self.task_dict) > 0:
+                self.task_condition.wait()
+                self.drop_taken_tasks()
+            if not self.ready_queue:
+                return None, -1
+            task = self.ready_queue.popleft()
+            task.status = 1
+            if self.start_time is None:
+                self.start_time = time.perf_counter()
+            print(
+                f"{Fore.RED}[process {process_id}]{Style.RESET_ALL}: get task({task.task_id}), remain({len(self.task_dict)})"
+            )
+            return task, task.task_id
+
+    def take_ready_batch(self, task: Task, max_count: int) -> List[Task]:
+        """
+        Take up to `max_count` other ready tasks with the same batch key as `task`, to be handled together with it.
+
+        Args:
+            task (Task): A task returned by get_next_task.
+            max_count (int): The maximum number of tasks to take.
+
+        Returns:
+            List[Task]: The taken tasks, already marked as in progress. Empty if batching is not enabled.
+        """
+        with self.task_lock:
+            if self.batch_key is None or max_count <= 0:
+                return []
+            key = self.batch_key(task.extra_info)
+            same_key = self.ready_by_key.get(key)
+            batch = []
+            while same_key and len(batch) < max_count:
+                other = same_key.popleft()
+                if other.status == 0 and other is not task:
+                    other.status = 1
+                    batch.append(other)
+            if same_key is not None and not same_key:
+                del self.ready_by_key[key]
+            return batch
+
+    def get_progress(self) -> str:
+        """已完成的任务数、速度和预计剩余时间，调用方需要持有task_lock"""
+        total = self.completed_count + len(self.task_dict)
+        progress = f"completed({self.completed_count}/{total})"
+        if self.start_time is None:
+            return progress
+        elapsed = time.perf_counter() - self.start_time
+        if elapsed <= 0 or self.completed_count == 0:
+            return progress
+        rate = self.completed_count / elapsed
+        return f"{progress}, {rate:.2f} tasks/s, eta {len(self.task_dict) / rate:.0f}s"
 
     def mark_completed(self, task_id: int):
         """
         Marks a task as completed and removes it from the task dictionary.
 
+        Dependents whose last pending dependency is this task are moved to the ready queue,
+        and blocked workers are woken up immediately.
+
         Args:
             task_id (int): The ID of the task to mark as completed.
 
         """
-        with self.task_lock:
-            target_task = self.task_dict[task_id]
-            for task in self.task_dict.values():
-                if target_task in task.dependencies:
-                    task.dependencies.remove(target_task)
-            self.task_dict.pop(task_id)  # 从任务字典中移除
+        with self.task_condition:
+            target_task = self.task_dict.pop(task_id)  # 从任务字典中移除
+            target_task.status = 2
+            self.completed_count += 1
+            print(f"{Fore.GREEN}[dispatcher]{Style.RESET_ALL}: {self.get_progress()}")
+            ready_count = 0
+            for dependent in target_task.dependents:
+                dependent.remain_dependency_count -= 1
+                if dependent.remain_dependency_count == 0:
+                    self.push_ready(dependent)
+                    ready_count += 1
+            if len(self.task_dict) == 0:
+                # 所有任务都完成了，唤醒所有等待的worker让它们退出
+                self.task_condition.notify_all()
+            elif ready_count > 0:
+                self.task_condition.notify(ready_count)
+
+
+class TokenBucket:
+    """按分钟计的预算(请求数或者token数)，匀速恢复，最多攒一分钟的量"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.available = float(per_minute)
+        self.refill_rate = per_minute / 60.0
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def get_wait_time(self, amount: float) -> float:
+        """还需要等多久才够amount，调用前需要先refill"""
+        amount = min(amount, self.capacity)  # 超过一分钟预算的请求也要能发出去
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.refill_rate
 
 
-def worker(task_manager, process_id: int, handler: Callable):
+def get_backoff_delay(
+    attempt: int, base_delay: float = 1.0, max_delay: float = 60.0, retry_after: Optional[float] = None
+) -> float:
+    """
+    Exponential backoff with full jitter: a random delay between 0 and min(max_delay, base_delay * 2 ** attempt).
+
+    Args:
+        attempt (int): The number of failed attempts so far, starting from 0.
+        base_delay (float, optional): The upper bound of the first delay. Defaults to 1.0.
+        max_delay (float, optional): The largest upper bound. Defaults to 60.0.
+        retry_after (float, optional): The delay the server asked for, the result is never shorter. Defaults to None.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits the requests in flight against the LLM backend, shared by all workers.
+
+    With `adaptive`, the limit follows AIMD (additive increase, multiplicative decrease): every request
+    that succeeds without a latency spike raises the limit by 1/limit, so roughly by one per round of
+    requests, and a rate-limit response, an overload error or a latency spike cuts it. Cuts are at most
+    once per cooldown, a burst of 429s from the same round only halves the limit once. Latency spikes
+    are detected on the time to first token, since the full response time mostly follows the output length.
+
+    Requests-per-minute and tokens-per-minute budgets are enforced with token buckets. A request
+    reserves its estimated tokens and corrects them with the actual usage when it is released.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        adaptive: bool = True,
+        min_limit: int = 1,
+        initial_limit: Optional[int] = None,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        latency_tolerance: float = 3.0,
+        backoff_factor: float = 0.5,
+        cooldown: float = 1.0,
+    ):
+        """
+        Args:
+            max_limit (int): The largest number of requests in flight.
+            adaptive (bool, optional): Adjust the limit to the backend. Otherwise it stays at max_limit. Defaults to True.
+            min_limit (int, optional): The smallest limit. Defaults to 1.
+            initial_limit (int, optional): The limit to start from. Defaults to half of max_limit when adaptive.
+            requests_per_minute (int, optional): The request budget, 0 for none. Defaults to 0.
+            tokens_per_minute (int, optional): The token budget, 0 for none. Defaults to 0.
+            latency_tolerance (float, optional): A time to first token above this multiple of the lowest one seen is a spike. Defaults to 3.0.
+            backoff_factor (float, optional): The limit is multiplied by this on a rate limit or an error. Defaults to 0.5.
+            cooldown (float, optional): The minimum seconds between two cuts. Defaults to 1.0.
+        """
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.adaptive = adaptive
+        if initial_limit is None:
+            initial_limit = max(self.min_limit, max_limit // 2) if adaptive else max_limit
+        self.limit = float(initial_limit)
+        self.latency_tolerance = latency_tolerance
+        self.backoff_factor = backoff_factor
+        self.cooldown = cooldown
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.condition = threading.Condition()
+        self.async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []  # 等待release的aacquire
+        self.in_flight = 0
+        self.min_latency: Optional[float] = None
+        self.last_cut_at = 0.0
+        self.success_count = 0
+        self.rate_limited_count = 0
+        self.error_count = 0
+
+    def try_acquire(self, tokens: int) -> Optional[float]:
+        """调用方需要持有condition。返回0表示拿到了名额，正数表示需要等待的秒数，None表示需要等别的请求结束"""
+        if self.in_flight >= int(self.limit):
+            return None
+        wait_time = 0.0
+        for bucket, amount in ((self.request_bucket, 1), (self.token_bucket, tokens)):
+            if bucket is not None:
+                bucket.refill()
+                wait_time = max(wait_time, bucket.get_wait_time(amount))
+        if wait_time > 0:
+            return wait_time
+        if self.request_bucket is not None:
+            self.request_bucket.available -= 1
+        if self.token_bucket is not None:
+            self.token_bucket.available -= min(tokens, self.token_bucket.capacity)
+        self.in_flight += 1
+        return 0.0
+
+    def acquire(self, tokens: int = 0):
+        """Block until a request with about `tokens` tokens may be sent."""
+        with self.condition:
+            while True:
+                wait_time = self.try_acquire(tokens)
+                if wait_time == 0:
+                    return
+                self.condition.wait(timeout=wait_time)
+
+    async def aacquire(self, tokens: int = 0):
+        """Asynchronous version of acquire. Waits on a future that release resolves instead of blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                wait_time = self.try_acquire(tokens)
+                if wait_time == 0:
+                    return
+                if wait_time is None:
+                    # 在condition内登记，检查和登记之间的release不会丢失
+                    waiter = loop.create_future()
+                    self.async_waiters.append((loop, waiter))
+            if wait_time is None:
+                await waiter
+            else:
+                await asyncio.sleep(wait_time)  # 只有预算不足时才按令牌桶的等待时间睡眠
+
+    @staticmethod
+    def wake_async_waiter(waiter: asyncio.Future):
+        if not waiter.done():  # 等待的协程可能已经被取消
+            waiter.set_result(None)
+
+    def wake_async_waiters(self):
+        """调用方需要持有condition。release可能在其他线程里调用，通过call_soon_threadsafe唤醒每个事件循环上的等待者"""
+        for loop, waiter in self.async_waiters:
+            try:
+                loop.call_soon_threadsafe(self.wake_async_waiter, waiter)
+            except RuntimeError:  # 事件循环已经关闭
+                pass
+        self.async_waiters.clear()
+
+    def release(
+        self,
+        latency: Optional[float] = None,
+        rate_limited: bool = False,
+        failed: bool = False,
+        error: bool = False,
+        reserved_tokens: int = 0,
+        used_tokens: Optional[int] = None,
+    ):
+        """
+        Report the outcome of a request acquired before.
+
+        Args:
+            latency (float, optional): The time to first token of a successful streamed request, checked for latency spikes.
+                Defaults to None (no latency check, e.g. without streaming).
+            rate_limited (bool, optional): The backend answered with a rate limit. Defaults to False.
+            failed (bool, optional): The request failed in another way that indicates overload, e.g. a timeout. Defaults to False.
+            error (bool, optional): The request failed in a way that says nothing about the load, e.g. a bad request.
+                It counts as a failure but does not cut the limit. Defaults to False.
+            reserved_tokens (int, optional): The tokens passed to acquire. Defaults to 0.
+            used_tokens (int, optional): The tokens actually used, if known. Defaults to None.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if self.token_bucket is not None and used_tokens is not None:
+                self.token_bucket.available -= used_tokens - min(reserved_tokens, self.token_bucket.capacity)
+            if rate_limited:
+                self.rate_limited_count += 1
+                self.cut("rate limited")
+            elif failed:
+                self.error_count += 1
+                self.cut("request failed")
+            elif error:
+                self.error_count += 1
+            else:
+                self.success_count += 1
+                self.on_success(latency)
+            self.condition.notify_all()
+            self.wake_async_waiters()
+
+    def on_success(self, latency: Optional[float]):
+        if latency is not None:
+            if self.min_latency is None or latency < self.min_latency:
+                self.min_latency = latency
+            else:
+                # 基准延迟缓慢上浮，后端整体变慢之后不会一直被当成拥塞
+                self.min_latency *= 1.01
+            if latency > self.min_latency * self.latency_tolerance:
+                self.cut(f"time to first token {latency:.1f}s")
+                return
+        if self.adaptive and self.limit < self.max_limit:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+    def cut(self, reason: str):
+        """乘性减小并发上限，冷却时间内最多减一次"""
+        now = time.monotonic()
+        if not self.adaptive or now - self.last_cut_at < self.cooldown:
+            return
+        self.last_cut_at = now
+        new_limit = max(float(self.min_limit), self.limit * self.backoff_factor)
+        if int(new_limit) != int(self.limit):
+            logger.debug(f"Concurrency limit {int(self.limit)} -> {int(new_limit)}: {reason}")
+        self.limit = new_limit
+
+    def log_stats(self):
+        if self.success_count + self.rate_limited_count + self.error_count == 0:
+            return
+        logger.info(
+            f"LLM concurrency: limit {int(self.limit)}/{self.max_limit} at the end, "
+            f"{self.success_count} succeeded, {self.rate_limited_count} rate limited, {self.error_count} failed"
+        )
+
+
+def worker(
+    task_manager,
+    process_id: int,
+    handler: Callable,
+    batch_handler: Optional[Callable[[List[Any]], Any]] = None,
+    max_batch_size: int = 1,
+):
     """
     Worker function that performs tasks assigned by the task manager.
 
@@ -108,23 +454,82 @@ def worker(task_manager, process_id: int, handler: Callable):
         task_manager: The task manager object that assigns tasks to workers.
         process_id (int): The ID of the current worker process.
         handler (Callable): The function that handles the tasks.
+        batch_handler (Callable, optional): Handles the extra info of several ready tasks with the same batch key
+            at once, see TaskManager.enable_batching. Defaults to None.
+        max_batch_size (int, optional): The maximum number of tasks passed to batch_handler. Defaults to 1.
 
     Returns:
         None
     """
     while True:
-        if task_manager.all_success:
+        task, task_id = task_manager.get_next_task(process_id, block=True)
+        if task is None:  # 阻塞返回None说明所有任务都已完成
             return
-        task, task_id = task_manager.get_next_task(process_id)
-        if task is None:
-            time.sleep(0.5)
-            continue
+        batch = [task]
+        if batch_handler is not None:
+            batch += task_manager.take_ready_batch(task, max_batch_size - 1)
         # print(f"will perform task: {task_id}")
-        handler(task.extra_info)
-        task_manager.mark_completed(task.task_id)
+        if len(batch) > 1:
+            batch_handler([batch_task.extra_info for batch_task in batch])
+        else:
+            handler(task.extra_info)
+        for batch_task in batch:
+            task_manager.mark_completed(batch_task.task_id)
         # print(f"task complete: {task_id}")
 
 
+async def async_worker(
+    task_manager: TaskManager,
+    handler: Callable[[Any], Awaitable[Any]],
+    max_concurrency: int,
+    batch_handler: Optional[Callable[[List[Any]], Awaitable[Any]]] = None,
+    max_batch_size: int = 1,
+):
+    """
+    Asyncio counterpart of `worker`: walks the dependency DAG on a single event loop.
+
+    Every ready task is scheduled as a coroutine as soon as its dependencies complete,
+    while a semaphore bounds how many handlers run at the same time.
+
+    Args:
+        task_manager (TaskManager): The task manager object that assigns tasks.
+        handler (Callable): The coroutine function that handles the tasks.
+        max_concurrency (int): The maximum number of handlers in flight.
+        batch_handler (Callable, optional): The coroutine function that handles several ready tasks
+            with the same batch key at once, see TaskManager.enable_batching. Defaults to None.
+        max_batch_size (int, optional): The maximum number of tasks passed to batch_handler. Defaults to 1.
+
+    Returns:
+        None
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_task(batch: List[Task]):
+        async with semaphore:
+            if len(batch) > 1:
+                await batch_handler([batch_task.extra_info for batch_task in batch])
+            else:
+                await handler(batch[0].extra_info)
+        for batch_task in batch:
+            task_manager.mark_completed(batch_task.task_id)
+
+    running = set()
+    while not task_manager.all_success:
+        while True:
+            task, _ = task_manager.get_next_task(len(running))
+            if task is None:
+                break
+            batch = [task]
+            if batch_handler is not None:
+                batch += task_manager.take_ready_batch(task, max_batch_size - 1)
+            running.add(asyncio.create_task(run_task(batch)))
+        if not running:  # 没有正在执行的任务，也没有就绪的任务
+            break
+        done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for finished in done:
+            finished.result()  # 把handler中的异常抛出来
+
+
 if __name__ == "__main__":
     task_manager = TaskManager()
 
@@ -47,3 +47,42 @@ message_templates = [
 ]
 
 chat_template = ChatPromptTemplate(message_templates=message_templates)
+
+batch_doc_generation_instruction = (
+    "You are an AI documentation assistant, and your task is to generate documentation based on the given code of several objects "
+    "from the same file, {file_path}. "
+    "The purpose of the documentation is to help developers and beginners understand the function and specific usage of the code.\n\n"
+    "The objects are as follows:\n\n"
+    "{objects}\n\n"
+    "For each object, write out the function of the object in bold plain text, followed by a detailed analysis in plain text "
+    "(including all details), in language {language} to serve as the documentation for this part of the code.\n\n"
+    "The standard format of each document is as follows:\n\n"
+    "**name**: The function of name is XXX. (Only code name and one sentence function description are required)\n"
+    "**parameters**: The parameters (attributes for a Class) of this object.\n"
+    "· parameter1: XXX\n"
+    "· ...\n"
+    "**Code Description**: The description of this object, including its relationship with its callers and callees from a functional perspective.\n"
+    "**Note**: Points to note about the use of the code\n"
+    "**Output Example**: Mock up a possible appearance of the return value, only for objects marked as having a return value.\n\n"
+    "Please note:\n"
+    "- Start the document of object N with a line containing only [[DOC N]], and write the documents of all {object_count} objects in order.\n"
+    "- Any part of the content you generate SHOULD NOT CONTAIN Markdown hierarchical heading and divider syntax.\n"
+    "- Write mainly in the desired language. If necessary, you can write with some English words in the analysis and description "
+    "to enhance the document's readability because you do not need to translate the function name or variable name into the target language.\n"
+)
+
+batch_object_template = (
+    "[[OBJECT {index}]] {code_type_tell} {code_name}, path {object_path}{have_return_tell}\n"
+    "{relationships}"
+    "```\n{code_content}\n```"
+)
+
+batch_message_templates = [
+    ChatMessage(content=batch_doc_generation_instruction, role=MessageRole.SYSTEM),
+    ChatMessage(
+        content=documentation_guideline,
+        role=MessageRole.USER,
+    ),
+]
+
+batch_chat_template = ChatPromptTemplate(message_templates=batch_message_templates)
@@ -0,0 +1,149 @@
+"""Prompt的token预算：本地计算token数，引用关系太多时按远近取舍，放不下的对象只列出名字"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List, Tuple
+
+from repo_agent.log import logger
+
+if TYPE_CHECKING:
+    from repo_agent.doc_meta_info import DocItem
+
+CHARS_PER_TOKEN = 4  # 没有tiktoken时按字符数估算
+OVERFLOW_RESERVE_TOKENS = 64  # 每一部分(调用、被调用)给"其余对象"的摘要行预留的token
+
+
+class TokenCounter:
+    """
+    Count tokens locally with tiktoken, or estimate them from the text length when tiktoken or
+    the encoding of the model is not available (e.g. offline).
+    """
+
+    def __init__(self, model: str):
+        self.encoding = None
+        try:
+            import tiktoken
+
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:  # 不认识的模型，用最常见的编码近似
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:  # tiktoken没有安装，或者下载编码文件失败
+            logger.debug(f"Estimating prompt tokens from characters, tiktoken unavailable: {e}")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+@dataclass
+class ReferenceCandidate:
+    """引用或者被引用的一个对象，以及它在prompt中的两种写法"""
+
+    doc_item: DocItem
+    is_referencer: bool  # True: 调用了当前对象；False: 被当前对象调用
+    full_text: str  # 文档和源码
+    brief_text: str  # 只有文档，没有文档时只有源码的第一行
+    distance: int
+
+
+def get_tree_distance(doc_item: DocItem, other_item: DocItem) -> int:
+    """两个对象在目录/文件/类的树上的距离，同一个类里的方法最近，不同目录的对象最远"""
+    key_path, other_key_path = doc_item.get_key_path(), other_item.get_key_path()
+    common = 0
+    for key, other_key in zip(key_path, other_key_path):
+        if key != other_key:
+            break
+        common += 1
+    return len(key_path) + len(other_key_path) - 2 * common
+
+
+def fit_references(
+    candidates: List[ReferenceCandidate], budget: int, counter: TokenCounter
+) -> Tuple[List[Tuple[ReferenceCandidate, str]], List[ReferenceCandidate]]:
+    """
+    Choose how each reference is written so that all of them fit into `budget` tokens.
+
+    References are ranked by their distance to the documented object, callees before callers at
+    the same distance. In that order, each reference keeps its code and document if they still fit,
+    falls back to its document alone, or is left out and only named in a summary line.
+
+    Args:
+        candidates (List[ReferenceCandidate]): The references and referencers of the object.
+        budget (int): The tokens available for all references, including the summary lines.
+        counter (TokenCounter): The token counter of the model.
+
+    Returns:
+        tuple: The kept (candidate, text) pairs in rank order, and the omitted candidates.
+    """
+    section_count = len({candidate.is_referencer for candidate in candidates})
+    remaining = budget - OVERFLOW_RESERVE_TOKENS * section_count
+    kept, omitted = [], []
+    for candidate in sorted(candidates, key=lambda c: (c.distance, c.is_referencer)):
+        for text in (candidate.full_text, candidate.brief_text):
+            tokens = counter.count(text)
+            if tokens <= remaining:
+                remaining -= tokens
+                kept.append((candidate, text))
+                break
+        else:
+            omitted.append(candidate)
+    return kept, omitted
+
+
+def summarize_omitted(omitted: List[ReferenceCandidate], counter: TokenCounter) -> str:
+    """把放不下的对象合并成一行，在预留的token内尽量多地列出名字"""
+    if not omitted:
+        return ""
+    prefix = f"{len(omitted)} more objects are omitted for length: "
+    names = []
+    for candidate in omitted:
+        name = candidate.doc_item.get_full_name()
+        rest = len(omitted) - len(names) - 1
+        summary = prefix + ", ".join(names + [name]) + (f", and {rest} more" if rest else "")
+        if counter.count(summary) > OVERFLOW_RESERVE_TOKENS:
+            break
+        names.append(name)
+    rest = len(omitted) - len(names)
+    return prefix + ", ".join(names + ([f"and {rest} more"] if rest else []))
+
+
+class PromptBudgetStats:
+    """一次运行中prompt预算的统计，多个线程共用"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prompt_count = 0
+        self.trimmed_prompt_count = 0
+        self.full_tokens = 0
+        self.sent_tokens = 0
+        self.over_budget_count = 0
+
+    def record(self, full_tokens: int, sent_tokens: int, budget: int):
+        with self.lock:
+            self.prompt_count += 1
+            self.full_tokens += full_tokens
+            self.sent_tokens += sent_tokens
+            if sent_tokens < full_tokens:
+                self.trimmed_prompt_count += 1
+            if sent_tokens > budget:
+                self.over_budget_count += 1
+
+    def log_stats(self):
+        if self.prompt_count == 0:
+            return
+        saved_tokens = self.full_tokens - self.sent_tokens
+        logger.info(
+            f"Prompt budget: trimmed references of {self.trimmed_prompt_count}/{self.prompt_count} prompts, "
+            f"{saved_tokens} of {self.full_tokens} prompt tokens saved "
+            f"({saved_tokens / max(self.full_tokens, 1):.0%})"
+        )
+        if self.over_budget_count > 0:
+            logger.warning(
+                f"{self.over_budget_count} prompts are over the budget even without references, their own code is too long."
+            )
@@ -0,0 +1,308 @@
+"""项目级的引用索引：每个模块只parse一次，一次性解析出所有名字的定义位置，再用倒排索引回答引用关系"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import jedi
+from tqdm import tqdm
+
+from repo_agent.log import logger
+from repo_agent.structure_cache import get_blob_hash
+from repo_agent.utils.json_codec import get_json_codec
+
+Position = Tuple[str, int, int]  # (相对于仓库根目录的文件路径, 行号, 列号)
+FileIndexResult = Tuple[
+    List[Position], List[Tuple[Position, Position]], Set[str], Set[str]
+]  # (定义位置, (定义位置, 引用位置), 解析时依赖的其他文件, 不在target_names中而没有解析的名字)
+
+REFERENCE_CACHE_VERSION = 3
+
+_worker_index: Optional[ReferenceIndex] = None  # 子进程内复用的索引对象，由_init_worker创建
+
+
+def _init_worker(repo_path, target_names):
+    global _worker_index
+    _worker_index = ReferenceIndex(repo_path, target_names=target_names)
+
+
+def _index_file_in_worker(file_path: str):
+    assert _worker_index is not None
+    return _worker_index.index_file(file_path)
+
+
+class ReferenceIndex:
+    """
+    Batched, project-wide reference index backed by jedi.
+
+    Instead of building a new `jedi.Script` and calling `get_references` once per object,
+    every module is parsed once with a shared `jedi.Project`. Each name usage is resolved
+    to its definition(s) in a single pass, and the results are kept in an inverted index
+    keyed by the definition position `(file, line, column)`.
+    """
+
+    def __init__(
+        self,
+        repo_path,
+        target_names: Optional[Set[str]] = None,
+        cache_path: Optional[Path] = None,
+    ):
+        """
+        Args:
+            repo_path: The root path of the target repository.
+            target_names (Set[str], optional): Only usages whose name is in this set are resolved. Defaults to None (resolve all names).
+            cache_path (Path, optional): A JSON file that persists per-file results keyed by git blob hash. Defaults to None (no cache).
+        """
+        self.repo_path = str(repo_path)
+        self.target_names = target_names
+        self.cache_path = cache_path
+        self.project = jedi.Project(self.repo_path)
+        self.definitions: Set[Position] = set()  # 已经被索引过的所有定义位置
+        self.references: Dict[Position, Set[Position]] = {}  # 定义位置 -> 引用它的位置
+        self.file_hashes: Dict[str, Optional[str]] = {}
+
+    def build(self, file_paths: Iterable[str], process_count: int = 1):
+        """
+        为给定的所有文件建立索引，文件路径相对于仓库根目录
+
+        如果指定了cache_path，内容(以及它依赖的文件)没有变化的文件直接从缓存中读取，只重新解析其余的文件。
+
+        Args:
+            file_paths (Iterable[str]): The module paths relative to the repository root.
+            process_count (int, optional): If greater than 1, files are sharded across a process pool. Defaults to 1.
+        """
+        file_paths = list(file_paths)
+        cache = self.load_cache()
+        new_cache: Dict[str, dict] = {}
+        dirty_file_paths = []
+        for file_path in file_paths:
+            cache_entry = cache.get(file_path)
+            if cache_entry is not None and self.is_cache_entry_valid(file_path, cache_entry):
+                result = self.cache_entry_to_result(file_path, cache_entry)
+                self.merge(result[0], result[1])
+                new_cache[file_path] = cache_entry
+            else:
+                dirty_file_paths.append(file_path)
+        if self.cache_path is not None:
+            logger.info(
+                f"Reference cache: {len(file_paths) - len(dirty_file_paths)} files reused, {len(dirty_file_paths)} files to resolve"
+            )
+
+        for file_path, result in zip(
+            dirty_file_paths, self.index_files(dirty_file_paths, process_count)
+        ):
+            self.merge(result[0], result[1])
+            new_cache[file_path] = self.result_to_cache_entry(file_path, result)
+
+        self.save_cache(new_cache)  # 只保留本次出现过的文件，缓存的大小不会无限增长
+        return self
+
+    def index_files(self, file_paths: List[str], process_count: int = 1):
+        """按顺序产出每个文件的index_file结果，process_count大于1时使用进程池"""
+        if process_count <= 1 or len(file_paths) <= 1:
+            for file_path in tqdm(file_paths, desc="indexing references"):
+                yield self.index_file(file_path)
+            return
+
+        # 每个进程返回(定义位置列表, (定义位置, 引用位置)列表, 依赖文件, 跳过的名字)这种紧凑的元组，在父进程里合并
+        chunksize = max(1, len(file_paths) // (process_count * 4))
+        with ProcessPoolExecutor(
+            max_workers=process_count,
+            initializer=_init_worker,
+            initargs=(self.repo_path, self.target_names),
+        ) as executor:
+            results = executor.map(_index_file_in_worker, file_paths, chunksize=chunksize)
+            yield from tqdm(
+                results,
+                total=len(file_paths),
+                desc=f"indexing references ({process_count} processes)",
+            )
+
+    def get_file_hash(self, file_path: str) -> Optional[str]:
+        """计算文件内容的git blob hash，文件不存在时返回None"""
+        if file_path not in self.file_hashes:
+            try:
+                with open(os.path.join(self.repo_path, file_path), "rb") as reader:
+                    content = reader.read()
+                self.file_hashes[file_path] = get_blob_hash(content)
+            except OSError:
+                self.file_hashes[file_path] = None
+        return self.file_hashes[file_path]
+
+    def is_cache_entry_valid(self, file_path: str, cache_entry: dict) -> bool:
+        """
+        文件本身和它解析时依赖的文件都没有变化，并且当时跳过的名字现在也都不需要解析时，缓存才有效
+
+        比如a.py调用了b.newfunc()，而newfunc是后来才加到b.py里的，缓存时这个名字被跳过了，
+        a.py也就没有记录对b.py的依赖，只能通过跳过的名字发现它需要重新解析。
+        """
+        if cache_entry.get("hash") != self.get_file_hash(file_path):
+            return False
+        skipped_names = cache_entry["skipped_names"]
+        if skipped_names and (
+            self.target_names is None or not self.target_names.isdisjoint(skipped_names)
+        ):
+            return False
+        return all(
+            self.get_file_hash(dependency) == dependency_hash
+            for dependency, dependency_hash in cache_entry["dependencies"].items()
+        )
+
+    def result_to_cache_entry(self, file_path: str, result: FileIndexResult) -> dict:
+        definitions, reference_pairs, dependencies, skipped_names = result
+        return {
+            "hash": self.get_file_hash(file_path),
+            "definitions": [[line, column] for _, line, column in definitions],
+            "references": [
+                [definition[0], definition[1], definition[2], referencer[1], referencer[2]]
+                for definition, referencer in reference_pairs
+            ],
+            "dependencies": {
+                dependency: self.get_file_hash(dependency) for dependency in dependencies
+            },
+            "skipped_names": sorted(skipped_names),
+        }
+
+    @staticmethod
+    def cache_entry_to_result(file_path: str, cache_entry: dict) -> FileIndexResult:
+        definitions = [(file_path, line, column) for line, column in cache_entry["definitions"]]
+        reference_pairs = [
+            ((def_file, def_line, def_column), (file_path, line, column))
+            for def_file, def_line, def_column, line, column in cache_entry["references"]
+        ]
+        return (
+            definitions,
+            reference_pairs,
+            set(cache_entry["dependencies"].keys()),
+            set(cache_entry["skipped_names"]),
+        )
+
+    def load_cache(self) -> Dict[str, dict]:
+        if self.cache_path is None or not Path(self.cache_path).exists():
+            return {}
+        try:
+            cache = get_json_codec().load_file(self.cache_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load reference cache {self.cache_path}: {e}")
+            return {}
+        if cache.get("version") != REFERENCE_CACHE_VERSION:
+            return {}
+        return cache.get("files", {})
+
+    def save_cache(self, files: Dict[str, dict]):
+        if self.cache_path is None:
+            return
+        cache_path = Path(self.cache_path)
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            cache_path.write_bytes(
+                get_json_codec().dumps(
+                    {"version": REFERENCE_CACHE_VERSION, "files": files}, compact=True
+                )
+            )
+        except IOError as e:
+            logger.error(f"Failed to save reference cache to {cache_path}: {e}")
+
+    def merge(self, definitions: Iterable[Position], reference_pairs: Iterable[Tuple[Position, Position]]):
+        """把index_file的结果合并进倒排索引"""
+        self.definitions.update(definitions)
+        for definition, referencer in reference_pairs:
+            self.references.setdefault(definition, set()).add(referencer)
+
+    def index_file(self, file_path: str) -> FileIndexResult:
+        """
+        Parse one module and resolve every name in it.
+
+        Args:
+            file_path (str): The path of the module relative to the repository root.
+
+        Returns:
+            tuple: The definition positions found in this module, a list of (definition position, referencer position) pairs,
+                the other repository files that the resolved names point into, and the names skipped by `target_names`.
+        """
+        abs_file_path = os.path.join(self.repo_path, file_path)
+        definitions: List[Position] = []
+        reference_pairs: List[Tuple[Position, Position]] = []
+        dependencies: Set[str] = set()
+        skipped_names: Set[str] = set()
+        try:
+            with open(abs_file_path, "r", encoding="utf-8") as reader:
+                code = reader.read()
+            script = jedi.Script(code, path=abs_file_path, project=self.project)
+            names = script.get_names(all_scopes=True, definitions=True, references=True)
+        except Exception as e:
+            logger.error(f"Error occurred while indexing references of {file_path}: {e}")
+            return definitions, reference_pairs, dependencies, skipped_names
+
+        # 同一个作用域里同名的定义(比如 try 里 import、except 里再赋值)会被jedi当做同一个名字，
+        # 其中一个被引用，其他的也算作引用者
+        same_scope_definitions: Dict[tuple, List[Position]] = {}
+        same_scope_targets: Dict[tuple, Set[Position]] = {}
+
+        for name in names:
+            position = (file_path, name.line, name.column)
+            is_definition = name.is_definition()
+            if is_definition:
+                definitions.append(position)
+            dependency_only = False
+            if self.target_names is not None and name.name not in self.target_names:
+                skipped_names.add(name.name)
+                if name.type != "module":
+                    continue
+                # import语句里的模块名总是要解析，记录对被import的模块的依赖：
+                # `import lib`之后调用的lib.run()在run加进lib.py之前解析不到任何文件
+                dependency_only = True
+            try:
+                # 用Script.goto而不是Name.goto，前者每次都会重置jedi的递归限制
+                targets = script.goto(name.line, name.column, follow_imports=True)
+            except Exception as e:
+                logger.debug(f"jedi goto failed at {position}: {e}")
+                continue
+
+            hit_definitions = set()
+            for target in targets:
+                if target.module_path is None:
+                    continue
+                target_path = os.path.relpath(str(target.module_path), self.repo_path)
+                if target_path != file_path and not target_path.startswith(".."):
+                    dependencies.add(target_path)  # 解析结果依赖于这个文件的内容
+                if target.name == name.name and not dependency_only:
+                    hit_definitions.add((target_path, target.line, target.column))
+
+            if is_definition:
+                parent = name.parent()
+                scope_key = (parent.line, parent.column, name.name)
+                same_scope_definitions.setdefault(scope_key, []).append(position)
+                same_scope_targets.setdefault(scope_key, set()).update(hit_definitions)
+
+            for definition in hit_definitions:
+                if definition != position:
+                    reference_pairs.append((definition, position))
+
+        for scope_key, scope_definitions in same_scope_definitions.items():
+            for definition in same_scope_targets[scope_key]:
+                for position in scope_definitions:
+                    if position != definition:
+                        reference_pairs.append((definition, position))
+        return definitions, reference_pairs, dependencies, skipped_names
+
+    def find_all_referencer(
+        self, variable_name, file_path, line_number, column_number, in_file_only=False
+    ) -> Optional[List[Position]]:
+        """
+        Look up the referencers of the object defined at (file_path, line_number, column_number).
+
+        Returns:
+            list or None: The referencer positions sorted the same way as jedi sorts `get_references`,
+                or None if the definition was not indexed (the caller should fall back to jedi).
+        """
+        definition = (file_path, line_number, column_number)
+        if definition not in self.definitions:
+            return None
+        referencers = self.references.get(definition, set())
+        if in_file_only:
+            referencers = [pos for pos in referencers if pos[0] == file_path]
+        return sorted(referencers)
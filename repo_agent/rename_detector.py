@@ -0,0 +1,223 @@
+"""重命名、移动检测：把旧版本中找不到的对象和新版本中新增的对象对应起来，让文档跟着代码走"""
+
+from __future__ import annotations
+
+import difflib
+import hashlib
+import re
+import textwrap
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import git
+
+from repo_agent.log import logger
+
+if TYPE_CHECKING:
+    from repo_agent.doc_meta_info import DocItem
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+NAME_PLACEHOLDER = "<obj_name>"
+
+
+def get_git_renames(repo_path, since_commit: str) -> Dict[str, str]:
+    """
+    Get the python files renamed since a commit, using git's rename detection.
+
+    The working tree is compared with since_commit, so renames that are staged or committed
+    after since_commit are both found.
+
+    Args:
+        repo_path: The path to the repository.
+        since_commit (str): The commit the older documents were generated from.
+
+    Returns:
+        dict: Old file path -> new file path, relative to the repository root.
+    """
+    if not since_commit:
+        return {}
+    try:
+        name_status = git.Repo(repo_path).git.diff(
+            "-M", "--name-status", since_commit, "--", "*.py"
+        )
+    except (git.GitCommandError, git.InvalidGitRepositoryError, git.NoSuchPathError) as e:
+        logger.warning(f"Git rename detection skipped: {e}")
+        return {}
+    renames = {}
+    for line in name_status.splitlines():
+        parts = line.split("\t")
+        if len(parts) == 3 and parts[0].startswith("R"):
+            renames[parts[1]] = parts[2]
+    return renames
+
+
+def normalize_code(code_content: str, obj_name: str) -> str:
+    """去掉缩进和空行，并把对象自己的名字替换成占位符，移动到类里或者改名之后结果不变"""
+    code_content = textwrap.dedent(code_content)
+    if obj_name:
+        code_content = re.sub(rf"\b{re.escape(obj_name)}\b", NAME_PLACEHOLDER, code_content)
+    return "\n".join(line.rstrip() for line in code_content.splitlines() if line.strip())
+
+
+def get_normalized_code_hash(doc_item: DocItem) -> Optional[str]:
+    if "code_content" not in doc_item.content:
+        return None
+    normalized = normalize_code(doc_item.content["code_content"], doc_item.obj_name)
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def get_match_kind(doc_item: DocItem) -> str:
+    """源码中的定义类型(ClassDef、FunctionDef等)，函数移进类里变成方法时不变"""
+    return doc_item.content.get("type", "")
+
+
+def get_code_similarity(old_item: DocItem, new_item: DocItem) -> float:
+    """两个对象源码在token级别上的相似度，0到1之间"""
+    old_tokens = TOKEN_PATTERN.findall(
+        normalize_code(old_item.content.get("code_content", ""), old_item.obj_name)
+    )
+    new_tokens = TOKEN_PATTERN.findall(
+        normalize_code(new_item.content.get("code_content", ""), new_item.obj_name)
+    )
+    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    if matcher.real_quick_ratio() == 0 or matcher.quick_ratio() == 0:
+        return 0.0
+    return matcher.ratio()
+
+
+class RenameMatcher:
+    """
+    Match the objects that disappeared from the older MetaInfo with the objects that are new in the
+    current one, so that their documents can be carried over.
+
+    Matching is tried in order of confidence:
+        1. git renames: an object keeps its key path inside a renamed file.
+        2. normalized code: the code is the same up to indentation, blank lines and the object's own
+           name, which covers moving a function into or out of a class and renaming it.
+        3. token similarity: the code of an object with the same name, or in the same (possibly
+           renamed) file, is at least `similarity_threshold` similar.
+
+    A match has to be unambiguous. When several new objects fit equally well, e.g. identical getters,
+    the one with the same name and file is preferred, and if that does not single one out the old
+    object is left unmatched rather than carrying its document to an arbitrary object.
+    """
+
+    def __init__(
+        self,
+        new_index: Dict[tuple, DocItem],
+        file_renames: Dict[str, str],
+        similarity_threshold: float = 0.9,
+    ):
+        """
+        Args:
+            new_index (Dict[tuple, DocItem]): The key path index of the current MetaInfo.
+            file_renames (Dict[str, str]): Old file path -> new file path, see get_git_renames.
+            similarity_threshold (float, optional): The minimum token similarity of a fuzzy match. Defaults to 0.9.
+        """
+        self.new_index = new_index
+        self.file_renames = file_renames
+        self.similarity_threshold = similarity_threshold
+
+    def match(
+        self, old_items: List[DocItem], new_items: List[DocItem]
+    ) -> List[Tuple[DocItem, DocItem]]:
+        """
+        Args:
+            old_items (List[DocItem]): The objects of the older MetaInfo that have no counterpart at the same key path.
+            new_items (List[DocItem]): The objects of the current MetaInfo that had no counterpart at the same key path.
+
+        Returns:
+            list: (old item, new item) pairs, each item is used at most once.
+        """
+        unmatched_new_ids = {id(item) for item in new_items}
+        pairs = []
+
+        def take(old_item: DocItem, new_item: DocItem):
+            unmatched_new_ids.discard(id(new_item))
+            pairs.append((old_item, new_item))
+
+        remaining_old_items = []
+        for old_item in old_items:
+            new_item = self.find_in_renamed_file(old_item)
+            if new_item is not None and id(new_item) in unmatched_new_ids:
+                take(old_item, new_item)
+            else:
+                remaining_old_items.append(old_item)
+
+        new_items_by_hash: Dict[Tuple, List[DocItem]] = {}
+        for new_item in new_items:
+            if id(new_item) in unmatched_new_ids:
+                key = (get_match_kind(new_item), get_normalized_code_hash(new_item))
+                new_items_by_hash.setdefault(key, []).append(new_item)
+        old_items, remaining_old_items = remaining_old_items, []
+        for old_item in old_items:
+            candidates = [
+                new_item
+                for new_item in new_items_by_hash.get(
+                    (get_match_kind(old_item), get_normalized_code_hash(old_item)), []
+                )
+                if id(new_item) in unmatched_new_ids
+            ]
+            new_item = self.pick_unique(old_item, candidates)
+            if new_item is not None:
+                take(old_item, new_item)
+            else:
+                remaining_old_items.append(old_item)
+
+        new_items_by_name: Dict[str, List[DocItem]] = {}
+        new_items_by_file: Dict[str, List[DocItem]] = {}
+        for new_item in new_items:
+            if id(new_item) in unmatched_new_ids:
+                new_items_by_name.setdefault(new_item.obj_name, []).append(new_item)
+                new_items_by_file.setdefault(new_item.get_file_name(), []).append(new_item)
+        for old_item in remaining_old_items:
+            old_file_name = old_item.get_file_name()
+            candidates = new_items_by_name.get(old_item.obj_name, []) + new_items_by_file.get(
+                self.file_renames.get(old_file_name, old_file_name), []
+            )
+            best_items, best_similarity = [], self.similarity_threshold
+            seen_ids = set()  # 同名并且在同一个文件里的对象会出现两次
+            for new_item in candidates:
+                if id(new_item) not in unmatched_new_ids or id(new_item) in seen_ids:
+                    continue
+                seen_ids.add(id(new_item))
+                if get_match_kind(new_item) != get_match_kind(old_item):
+                    continue
+                similarity = get_code_similarity(old_item, new_item)
+                if similarity > best_similarity:
+                    best_items, best_similarity = [new_item], similarity
+                elif similarity == best_similarity:
+                    best_items.append(new_item)
+            best_item = self.pick_unique(old_item, best_items)
+            if best_item is not None:
+                take(old_item, best_item)
+        return pairs
+
+    def pick_unique(self, old_item: DocItem, candidates: List[DocItem]) -> Optional[DocItem]:
+        """
+        从同样匹配的候选对象中选出唯一的一个：只有一个候选时直接使用，否则依次只保留同名、
+        同文件(考虑文件重命名)的候选，仍然不唯一时返回None，不把文档给一个随便选的对象
+        """
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else None
+        old_file_name = old_item.get_file_name()
+        new_file_name = self.file_renames.get(old_file_name, old_file_name)
+        for is_closer in (
+            lambda item: item.obj_name == old_item.obj_name,
+            lambda item: item.get_file_name() == new_file_name,
+        ):
+            narrowed = [item for item in candidates if is_closer(item)]
+            if len(narrowed) == 1:
+                return narrowed[0]
+            if narrowed:
+                candidates = narrowed
+        return None
+
+    def find_in_renamed_file(self, old_item: DocItem) -> Optional[DocItem]:
+        """旧对象所在的文件被git识别为重命名时，在新文件的相同位置找对应的对象"""
+        old_file_name = old_item.get_file_name()
+        if old_file_name not in self.file_renames:
+            return None
+        old_file_keys = old_file_name.split("/")
+        inner_key_path = old_item.get_key_path()[len(old_file_keys) :]
+        new_file_keys = self.file_renames[old_file_name].split("/")
+        return self.new_index.get(tuple(new_file_keys + inner_key_path))
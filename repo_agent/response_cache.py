@@ -0,0 +1,154 @@
+"""持久化的LLM响应缓存：相同的模型、温度和prompt直接返回上次的文档，重跑、断点续跑时不再重复请求"""
+
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+from repo_agent.log import logger
+from repo_agent.utils.json_codec import get_json_codec
+
+LLM_CACHE_NAME = "llm_cache.db"
+EVICT_EVERY_PUTS = 100  # 淘汰需要扫描索引，不在每次写入时都做
+
+
+def make_cache_key(model: str, temperature: float, messages: Sequence) -> str:
+    """
+    Hash the model, the temperature and the rendered chat messages.
+
+    Args:
+        model (str): The model name.
+        temperature (float): The sampling temperature.
+        messages (Sequence[ChatMessage]): The messages returned by ChatEngine.build_prompt.
+
+    Returns:
+        str: The sha256 hex digest used as the cache key.
+    """
+    payload = {
+        "model": model,
+        "temperature": temperature,
+        "messages": [
+            [str(getattr(message.role, "value", message.role)), message.content or ""]
+            for message in messages
+        ],
+    }
+    return hashlib.sha256(get_json_codec().dumps(payload, compact=True)).hexdigest()
+
+
+class ResponseCache:
+    """
+    LLM responses in a SQLite database, `<hierarchy_name>/llm_cache.db`, with LRU eviction.
+
+    `get` and `put` are safe to call from the worker threads, each thread uses its own connection.
+    Once the cache holds more than `max_entries` responses, the least recently used ones are deleted.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        cache_key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        last_used REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used);
+    """
+
+    def __init__(self, cache_path: str | Path, max_entries: int, bypass: bool = False):
+        """
+        Args:
+            cache_path (str | Path): The SQLite database file.
+            max_entries (int): The maximum number of cached responses.
+            bypass (bool, optional): Never read from the cache, but still store new responses. Defaults to False.
+        """
+        self.cache_path = Path(cache_path)
+        self.max_entries = max_entries
+        self.bypass = bypass
+        self.local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+        self.put_count = 0
+
+    def connect(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.cache_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(self.SCHEMA)
+            self.local.connection = connection
+        return connection
+
+    def get(self, cache_key: str) -> Optional[str]:
+        if self.bypass:
+            return None
+        try:
+            connection = self.connect()
+            with connection:
+                row = connection.execute(
+                    "SELECT response FROM responses WHERE cache_key = ?", (cache_key,)
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE responses SET last_used = ? WHERE cache_key = ?",
+                        (time.time(), cache_key),
+                    )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read the LLM response cache {self.cache_path}: {e}")
+            row = None
+        with self.stats_lock:
+            if row is None:
+                self.miss_count += 1
+            else:
+                self.hit_count += 1
+        return None if row is None else row[0]
+
+    def put(self, cache_key: str, response: str):
+        try:
+            connection = self.connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses (cache_key, response, last_used) VALUES (?, ?, ?)",
+                    (cache_key, response, time.time()),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write the LLM response cache {self.cache_path}: {e}")
+            return
+        with self.stats_lock:
+            self.put_count += 1
+            should_evict = self.put_count % EVICT_EVERY_PUTS == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """只保留最近用到的max_entries条响应"""
+        try:
+            connection = self.connect()
+            with connection:
+                connection.execute(
+                    "DELETE FROM responses WHERE cache_key IN ("
+                    "SELECT cache_key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to evict from the LLM response cache {self.cache_path}: {e}")
+
+    def log_stats(self):
+        total = self.hit_count + self.miss_count
+        if total > 0:
+            logger.info(
+                f"LLM response cache: {self.hit_count} hits, {self.miss_count} misses "
+                f"({self.hit_count / total:.0%} hit rate)"
+            )
+
+    def close(self):
+        """淘汰多余的条目并关闭当前线程的连接"""
+        self.evict()
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import shutil
@@ -13,10 +14,12 @@ from tqdm import tqdm
 
 from repo_agent.change_detector import ChangeDetector
 from repo_agent.chat_engine import ChatEngine
+from repo_agent.checkpoint_journal import CheckpointJournal
 from repo_agent.doc_meta_info import DocItem, DocItemStatus, MetaInfo, need_to_generate
 from repo_agent.file_handler import FileHandler
+from repo_agent.hierarchy_store import get_hierarchy_store, save_file_record
 from repo_agent.log import logger
-from repo_agent.multi_task_dispatch import worker
+from repo_agent.multi_task_dispatch import TaskManager, async_worker, worker
 from repo_agent.project_manager import ProjectManager
 from repo_agent.settings import SettingsManager
 from repo_agent.utils.meta_info_utils import delete_fake_files, make_fake_files
@@ -53,6 +56,7 @@ class Runner:
             target_dir_path=self.absolute_project_hierarchy_path
         )
         self.runner_lock = threading.Lock()
+        self.doc_journal: CheckpointJournal | None = None  # 由run_task_manager创建
 
     def get_all_pys(self, directory):
         """
@@ -89,15 +93,181 @@ class Runner:
                 )
                 doc_item.md_content.append(response_message)  # type: ignore
                 doc_item.item_status = DocItemStatus.doc_up_to_date
-                self.meta_info.checkpoint(
-                    target_dir_path=self.absolute_project_hierarchy_path
+                self.doc_journal.record(doc_item)
+        except Exception:
+            logger.exception(
+                f"Document generation failed after multiple attempts, skipping: {doc_item.get_full_name()}"
+            )
+            doc_item.item_status = DocItemStatus.doc_has_not_been_generated
+
+    async def agenerate_doc_for_a_single_item(self, doc_item: DocItem):
+        """为一个对象异步生成文档，asyncio 模式下使用"""
+        try:
+            if not need_to_generate(doc_item, self.setting.project.ignore_list):
+                print(
+                    f"Content ignored/Document generated, skipping: {doc_item.get_full_name()}"
                 )
+            else:
+                print(
+                    f" -- Generating document  {Fore.LIGHTYELLOW_EX}{doc_item.item_type.name}: {doc_item.get_full_name()}{Style.RESET_ALL}"
+                )
+                response_message = await self.chat_engine.agenerate_doc(
+                    doc_item=doc_item,
+                )
+                doc_item.md_content.append(response_message)  # type: ignore
+                doc_item.item_status = DocItemStatus.doc_up_to_date
+                # 写journal是同步的文件IO，并且可能等待后台合并，放到线程里执行，避免阻塞事件循环
+                await asyncio.to_thread(self.doc_journal.record, doc_item)
         except Exception:
             logger.exception(
                 f"Document generation failed after multiple attempts, skipping: {doc_item.get_full_name()}"
             )
             doc_item.item_status = DocItemStatus.doc_has_not_been_generated
 
+    def get_batch_key(self, doc_item: DocItem):
+        """小对象按文件分批生成文档，大对象返回None，单独生成"""
+        code_content = doc_item.content.get("code_content")
+        if not code_content or code_content.count("\n") + 1 > self.setting.project.batch_max_lines:
+            return None
+        return doc_item.get_file_name()
+
+    def filter_batch(self, doc_items: list[DocItem]) -> list[DocItem]:
+        """去掉一批中不需要生成文档的对象"""
+        pending = []
+        for doc_item in doc_items:
+            if need_to_generate(doc_item, self.setting.project.ignore_list):
+                pending.append(doc_item)
+            else:
+                print(
+                    f"Content ignored/Document generated, skipping: {doc_item.get_full_name()}"
+                )
+        if len(pending) > 1:
+            print(
+                f" -- Generating {len(pending)} documents in one request  {Fore.LIGHTYELLOW_EX}{pending[0].get_file_name()}: {', '.join(doc_item.obj_name for doc_item in pending)}{Style.RESET_ALL}"
+            )
+        return pending
+
+    def apply_batch_docs(self, pending: list[DocItem], docs: dict) -> list[DocItem]:
+        """把批量生成的文档写回对象，返回没有解析出文档、需要单独生成的对象"""
+        failed = []
+        for index, doc_item in enumerate(pending):
+            if index in docs:
+                doc_item.md_content.append(docs[index])
+                doc_item.item_status = DocItemStatus.doc_up_to_date
+            else:
+                failed.append(doc_item)
+        if docs and failed:
+            logger.warning(
+                f"Could not parse {len(failed)}/{len(pending)} documents from a batched response, generating them one by one"
+            )
+        return failed
+
+    def mark_batch_failed(self, doc_items: list[DocItem]):
+        """批量生成意外失败时，把还没有生成文档的对象标记为未生成，和逐个生成失败时一样"""
+        logger.exception(
+            f"Batched document generation failed, skipping: {', '.join(doc_item.get_full_name() for doc_item in doc_items)}"
+        )
+        for doc_item in doc_items:
+            if doc_item.item_status != DocItemStatus.doc_up_to_date:
+                doc_item.item_status = DocItemStatus.doc_has_not_been_generated
+
+    def generate_docs_for_a_batch(self, doc_items: list[DocItem]):
+        """为同一个文件中的多个小对象用一次请求生成文档，解析失败的对象退回到逐个生成"""
+        try:
+            pending = self.filter_batch(doc_items)
+            docs = {}
+            if len(pending) > 1:
+                try:
+                    docs = self.chat_engine.generate_docs(pending)
+                except Exception:
+                    logger.exception(
+                        f"Batched document generation failed, generating one by one: {pending[0].get_file_name()}"
+                    )
+            failed = self.apply_batch_docs(pending, docs)
+            for index in docs:
+                self.doc_journal.record(pending[index])
+            for doc_item in failed:
+                self.generate_doc_for_a_single_item(doc_item)
+        except Exception:
+            # 这里的异常不能抛给worker，否则这一批任务不会被标记完成，其他worker会一直等下去
+            self.mark_batch_failed(doc_items)
+
+    async def agenerate_docs_for_a_batch(self, doc_items: list[DocItem]):
+        """generate_docs_for_a_batch的异步版本，asyncio 模式下使用"""
+        try:
+            pending = self.filter_batch(doc_items)
+            docs = {}
+            if len(pending) > 1:
+                try:
+                    docs = await self.chat_engine.agenerate_docs(pending)
+                except Exception:
+                    logger.exception(
+                        f"Batched document generation failed, generating one by one: {pending[0].get_file_name()}"
+                    )
+            failed = self.apply_batch_docs(pending, docs)
+            for index in docs:
+                await asyncio.to_thread(self.doc_journal.record, pending[index])
+            for doc_item in failed:
+                await self.agenerate_doc_for_a_single_item(doc_item)
+        except Exception:
+            self.mark_batch_failed(doc_items)
+
+    def run_task_manager(self, task_manager: TaskManager):
+        """按照配置，用多线程或asyncio的方式执行task_manager中的所有任务
+
+        生成的文档先写进journal，由后台线程定期合并进快照，结束时把剩余的journal合并掉
+        """
+        self.doc_journal = CheckpointJournal(
+            self.meta_info,
+            self.absolute_project_hierarchy_path,
+            compact_every_items=self.setting.project.checkpoint_every_items,
+            compact_interval=self.setting.project.checkpoint_interval,
+        ).start()
+        try:
+            self.dispatch_tasks(task_manager)
+        finally:
+            self.doc_journal.close()
+            self.chat_engine.close_response_cache()
+            self.chat_engine.log_prompt_stats()
+            self.chat_engine.log_stream_stats()
+            self.chat_engine.log_concurrency_stats()
+            self.chat_engine.log_llm_pool_stats()
+
+    def dispatch_tasks(self, task_manager: TaskManager):
+        batch_size = self.setting.project.batch_size
+        if batch_size > 1:
+            task_manager.enable_batching(self.get_batch_key)
+        if self.setting.project.async_mode:
+            logger.info(
+                f"Running tasks with asyncio, max concurrent requests: {self.setting.project.max_concurrent_requests}"
+            )
+            asyncio.run(
+                async_worker(
+                    task_manager,
+                    self.agenerate_doc_for_a_single_item,
+                    self.setting.project.max_concurrent_requests,
+                    batch_handler=self.agenerate_docs_for_a_batch if batch_size > 1 else None,
+                    max_batch_size=batch_size,
+                )
+            )
+            return
+
+        threads = [
+            threading.Thread(
+                target=worker,
+                args=(task_manager, process_id, self.generate_doc_for_a_single_item),
+                kwargs={
+                    "batch_handler": self.generate_docs_for_a_batch if batch_size > 1 else None,
+                    "max_batch_size": batch_size,
+                },
+            )
+            for process_id in range(self.setting.project.max_thread_count)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
     def first_generate(self):
         """
         生成所有文档，完成后刷新并保存文件系统中的文档信息。
@@ -117,22 +287,7 @@ class Runner:
         self.meta_info.print_task_list(task_manager.task_dict)
 
         try:
-            # 创建并启动线程
-            threads = [
-                threading.Thread(
-                    target=worker,
-                    args=(
-                        task_manager,
-                        process_id,
-                        self.generate_doc_for_a_single_item,
-                    ),
-                )
-                for process_id in range(self.setting.project.max_thread_count)
-            ]
-            for thread in threads:
-                thread.start()
-            for thread in threads:
-                thread.join()
+            self.run_task_manager(task_manager)
 
             # 所有任务完成后刷新文档
             self.markdown_refresh()
@@ -284,7 +439,7 @@ class Runner:
             1.新建一个project-hierachy
             2.和老的hierarchy做merge,处理以下情况：
             - 创建一个新文件：需要生成对应的doc
-            - 文件、对象被删除：对应的doc也删除(按照目前的实现，文件重命名算是删除再添加)
+            - 文件、对象被删除：对应的doc也删除(文件、对象被重命名或移动时，RenameMatcher会把doc带到新的对象上)
             - 引用关系变了：对应的obj-doc需要重新生成
             
             merge后的new_meta_info中：
@@ -318,17 +473,7 @@ class Runner:
                 "No tasks in the queue, all documents are completed and up to date."
             )
 
-        threads = [
-            threading.Thread(
-                target=worker,
-                args=(task_manager, process_id, self.generate_doc_for_a_single_item),
-            )
-            for process_id in range(self.setting.project.max_thread_count)
-        ]
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
+        self.run_task_manager(task_manager)
 
         self.meta_info.in_generation_process = False
         self.meta_info.document_version = self.change_detector.repo.head.commit.hexsha
@@ -385,10 +530,17 @@ class Runner:
             # 文件对象file_dict中添加一个新的对象
             file_dict[name] = code_info
 
-        json_data[file_handler.file_path] = file_dict
-        # 将新的项写入json文件
-        with open(self.project_manager.project_hierarchy, "w", encoding="utf-8") as f:
-            json.dump(json_data, f, indent=4, ensure_ascii=False)
+        # 将新的项写入project_hierarchy
+        save_file_record(
+            get_hierarchy_store(
+                self.absolute_project_hierarchy_path,
+                self.setting.project.hierarchy_layout,
+                compact=self.setting.project.compact_json,
+            ),
+            json_data,
+            file_handler.file_path,
+            file_dict,
+        )
         logger.info(
             f"The structural information of the newly added file {file_handler.file_path} has been written into a JSON file."
         )
@@ -434,21 +586,25 @@ class Runner:
         )
         logger.info(f"检测到变更对象：\n{changes_in_pyfile}")
 
-        # 判断project_hierarchy.json文件中能否找到对应.py文件路径的项
-        with open(self.project_manager.project_hierarchy, "r", encoding="utf-8") as f:
-            json_data = json.load(f)
+        # 判断project_hierarchy中能否找到对应.py文件路径的项，sharded/sqlite格式下只读取这一个文件
+        hierarchy_store = get_hierarchy_store(
+            self.absolute_project_hierarchy_path,
+            self.setting.project.hierarchy_layout,
+            compact=self.setting.project.compact_json,
+        )
+        json_data = hierarchy_store.load() if hierarchy_store.exists() else {}
 
         # 如果找到了对应文件
         if file_handler.file_path in json_data:
-            # 更新json文件中的内容
-            json_data[file_handler.file_path] = self.update_existing_item(
-                json_data[file_handler.file_path], file_handler, changes_in_pyfile
+            # 更新json文件中的内容，并写回project_hierarchy
+            save_file_record(
+                hierarchy_store,
+                json_data,
+                file_handler.file_path,
+                self.update_existing_item(
+                    json_data[file_handler.file_path], file_handler, changes_in_pyfile
+                ),
             )
-            # 将更新后的file写回到json文件中
-            with open(
-                self.project_manager.project_hierarchy, "w", encoding="utf-8"
-            ) as f:
-                json.dump(json_data, f, indent=4, ensure_ascii=False)
 
             logger.info(f"已更新{file_handler.file_path}文件的json结构信息。")
 
@@ -6,6 +6,7 @@ from pydantic import (
     DirectoryPath,
     Field,
     HttpUrl,
+    NonNegativeInt,
     PositiveFloat,
     PositiveInt,
     SecretStr,
@@ -23,6 +24,17 @@ class LogLevel(StrEnum):
     CRITICAL = "CRITICAL"
 
 
+class LlmRouting(StrEnum):
+    LEAST_OUTSTANDING = "least-outstanding"  # 进行中的请求最少的后端
+    LATENCY_WEIGHTED = "latency-weighted"  # (进行中的请求数+1)*平均延迟最小的后端
+
+
+class HierarchyLayout(StrEnum):
+    MONOLITHIC = "monolithic"  # 整个hierarchy存在一个project_hierarchy.json里
+    SHARDED = "sharded"  # 每个源文件一个记录文件，外加一个manifest
+    SQLITE = "sqlite"  # 存在一个SQLite数据库里，按名字、文件、状态建了索引
+
+
 class ProjectSettings(BaseSettings):
     target_repo: DirectoryPath = ""  # type: ignore
     hierarchy_name: str = ".project_doc_record"
@@ -30,6 +42,32 @@ class ProjectSettings(BaseSettings):
     ignore_list: list[str] = []
     language: str = "English"
     max_thread_count: PositiveInt = 4
+    async_mode: bool = False
+    max_concurrent_requests: PositiveInt = 64
+    max_process_count: PositiveInt = 1
+    structure_cache_size: NonNegativeInt = 20000
+    checkpoint_every_items: PositiveInt = 50
+    checkpoint_interval: PositiveFloat = 30.0
+    hierarchy_layout: HierarchyLayout = HierarchyLayout.MONOLITHIC
+    compact_json: bool = False  # 不缩进地写project_hierarchy，给机器读取时更小更快
+    rename_similarity_threshold: float = Field(default=0.9, ge=0.0, le=1.0)
+    ignore_cosmetic_changes: bool = True  # 只改了格式、注释的对象不重新生成文档
+    ignore_docstring_changes: bool = False  # 只改了docstring的对象也不重新生成文档
+    llm_cache_size: NonNegativeInt = 10000  # 缓存的LLM响应条数，0表示不使用缓存
+    bypass_llm_cache: bool = False  # 不读缓存，但仍然写入新的响应
+    max_prompt_tokens: NonNegativeInt = 16000  # 单个对象prompt的token预算，0表示不限制
+    batch_size: PositiveInt = 1  # 同一个文件中的小对象最多几个合并成一次请求，1表示不合并
+    batch_max_lines: PositiveInt = 15  # 不超过这么多行的对象才参与合并
+    stream: bool = False  # 流式接收响应，记录首个token延迟和生成速度
+    max_completion_tokens: NonNegativeInt = 0  # 单个响应最多生成的token数，0表示不限制
+    llm_max_retries: NonNegativeInt = 3  # 限流、超时、服务端错误时的重试次数
+    adaptive_concurrency: bool = False  # 按延迟和限流响应自动调整同时进行的请求数(AIMD)
+    requests_per_minute: NonNegativeInt = 0  # 每分钟最多发出的请求数，0表示不限制
+    tokens_per_minute: NonNegativeInt = 0  # 每分钟最多使用的token数，0表示不限制
+    llm_servers: list[str] = []  # config/models.yaml中local_servers的名字，非空时在这些后端之间负载均衡
+    models_config_path: Path = Path("config/models.yaml")
+    llm_routing: LlmRouting = LlmRouting.LEAST_OUTSTANDING
+    health_check_interval: PositiveFloat = 30.0
     log_level: LogLevel = LogLevel.INFO
 
     @field_validator("language")
@@ -98,6 +136,32 @@ class SettingsManager:
         temperature: float,
         request_timeout: int,
         openai_base_url: str,
+        async_mode: bool = False,
+        max_concurrent_requests: int = 64,
+        max_process_count: int = 1,
+        structure_cache_size: int = 20000,
+        checkpoint_every_items: int = 50,
+        checkpoint_interval: float = 30.0,
+        hierarchy_layout: str = HierarchyLayout.MONOLITHIC,
+        compact_json: bool = False,
+        rename_similarity_threshold: float = 0.9,
+        ignore_cosmetic_changes: bool = True,
+        ignore_docstring_changes: bool = False,
+        llm_cache_size: int = 10000,
+        bypass_llm_cache: bool = False,
+        max_prompt_tokens: int = 16000,
+        batch_size: int = 1,
+        batch_max_lines: int = 15,
+        stream: bool = False,
+        max_completion_tokens: int = 0,
+        llm_max_retries: int = 3,
+        adaptive_concurrency: bool = False,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        llm_servers: list[str] = [],
+        models_config_path: Path = Path("config/models.yaml"),
+        llm_routing: str = LlmRouting.LEAST_OUTSTANDING,
+        health_check_interval: float = 30.0,
     ):
         project_settings = ProjectSettings(
             target_repo=target_repo,
@@ -106,6 +170,32 @@ class SettingsManager:
             ignore_list=ignore_list,
             language=language,
             max_thread_count=max_thread_count,
+            async_mode=async_mode,
+            max_concurrent_requests=max_concurrent_requests,
+            max_process_count=max_process_count,
+            structure_cache_size=structure_cache_size,
+            checkpoint_every_items=checkpoint_every_items,
+            checkpoint_interval=checkpoint_interval,
+            hierarchy_layout=HierarchyLayout(hierarchy_layout),
+            compact_json=compact_json,
+            rename_similarity_threshold=rename_similarity_threshold,
+            ignore_cosmetic_changes=ignore_cosmetic_changes,
+            ignore_docstring_changes=ignore_docstring_changes,
+            llm_cache_size=llm_cache_size,
+            bypass_llm_cache=bypass_llm_cache,
+            max_prompt_tokens=max_prompt_tokens,
+            batch_size=batch_size,
+            batch_max_lines=batch_max_lines,
+            stream=stream,
+            max_completion_tokens=max_completion_tokens,
+            llm_max_retries=llm_max_retries,
+            adaptive_concurrency=adaptive_concurrency,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            llm_servers=llm_servers,
+            models_config_path=models_config_path,
+            llm_routing=LlmRouting(llm_routing),
+            health_check_interval=health_check_interval,
             log_level=LogLevel(log_level),
         )
 
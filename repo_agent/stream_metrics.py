@@ -0,0 +1,95 @@
+"""流式生成的指标：首个token的延迟、生成速度，用来尽早发现卡住或者变慢的后端"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import List, Optional
+
+from repo_agent.log import logger
+
+
+class StreamMetrics:
+    """
+    Timing of one streamed response.
+
+    Every non-empty delta counts as one token, which is what OpenAI compatible backends send.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.first_token_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+        self.token_count = 0
+        self.truncated = False
+
+    def on_delta(self, delta: str):
+        if not delta:
+            return
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.token_count += 1
+
+    def finish(self, truncated: bool = False):
+        self.end_time = time.perf_counter()
+        self.truncated = truncated
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        if self.first_token_time is None:
+            return None
+        return self.first_token_time - self.start_time
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        if self.first_token_time is None or self.end_time is None:
+            return None
+        duration = self.end_time - self.first_token_time
+        return self.token_count / duration if duration > 0 else None
+
+
+class StreamStats:
+    """一次运行中所有流式请求的统计，多个线程共用"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.truncated_count = 0
+        self.token_count = 0
+        self.generation_seconds = 0.0
+        self.first_token_latencies: List[float] = []
+
+    def record(self, metrics: StreamMetrics, name: str = ""):
+        ttft = metrics.time_to_first_token
+        logger.debug(
+            f"Streamed {metrics.token_count} tokens for {name}: "
+            f"time to first token {'-' if ttft is None else f'{ttft:.2f}s'}, "
+            f"{metrics.tokens_per_second or 0:.1f} tokens/s"
+            + (", truncated" if metrics.truncated else "")
+        )
+        with self.lock:
+            self.request_count += 1
+            self.truncated_count += int(metrics.truncated)
+            self.token_count += metrics.token_count
+            if ttft is not None and metrics.end_time is not None:
+                self.first_token_latencies.append(ttft)
+                self.generation_seconds += metrics.end_time - metrics.first_token_time
+
+    def log_stats(self):
+        if self.request_count == 0:
+            return
+        latencies = sorted(self.first_token_latencies)
+        if latencies:
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            ttft_summary = f"time to first token p50 {p50:.2f}s, p95 {p95:.2f}s, max {latencies[-1]:.2f}s"
+        else:
+            ttft_summary = "no tokens received"
+        tokens_per_second = self.token_count / self.generation_seconds if self.generation_seconds > 0 else 0
+        logger.info(
+            f"Streamed {self.request_count} responses: {ttft_summary}, {tokens_per_second:.1f} tokens/s"
+        )
+        if self.truncated_count > 0:
+            logger.warning(
+                f"{self.truncated_count} responses were cut off at the max completion tokens."
+            )
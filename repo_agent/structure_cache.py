@@ -0,0 +1,88 @@
+"""按内容寻址的文件结构缓存：以文件内容的git blob hash为key，复用FileHandler.generate_file_structure的结果"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+from repo_agent.log import logger
+from repo_agent.utils.json_codec import get_json_codec
+
+STRUCTURE_CACHE_VERSION = 1
+
+
+def get_blob_hash(content: bytes) -> str:
+    """计算与`git hash-object`一致的blob hash"""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class StructureCache:
+    """
+    Content-addressed cache of per-file AST structures.
+
+    The structure of a file only depends on its content, so entries are keyed by the git blob
+    hash of the file instead of its path: renamed or copied files are cache hits as well.
+    Entries are kept in least-recently-used order and the oldest ones are evicted on save
+    once there are more than `max_entries`.
+    """
+
+    def __init__(self, cache_path: Path, max_entries: int):
+        """
+        Args:
+            cache_path (Path): The JSON file that persists the cache, stored next to project_hierarchy.json.
+            max_entries (int): The maximum number of file structures kept after saving.
+        """
+        self.cache_path = Path(cache_path)
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, List[dict]] = OrderedDict()
+        self.hit_count = 0
+        self.miss_count = 0
+        self.load()
+
+    def get(self, blob_hash: str) -> Optional[List[dict]]:
+        """返回缓存的结构(拷贝一份，内容相同的多个文件不会共享同一个对象)，并把它标记为最近使用"""
+        file_structure = self.entries.get(blob_hash)
+        if file_structure is None:
+            self.miss_count += 1
+            return None
+        self.hit_count += 1
+        self.entries.move_to_end(blob_hash)
+        return copy.deepcopy(file_structure)
+
+    def put(self, blob_hash: str, file_structure: List[dict]):
+        self.entries[blob_hash] = copy.deepcopy(file_structure)
+        self.entries.move_to_end(blob_hash)
+
+    def load(self):
+        if not self.cache_path.exists():
+            return
+        try:
+            cache = get_json_codec().load_file(self.cache_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load structure cache {self.cache_path}: {e}")
+            return
+        if cache.get("version") != STRUCTURE_CACHE_VERSION:
+            return
+        # 文件里按从旧到新的顺序存储，读回来之后LRU顺序不变
+        for blob_hash, file_structure in cache.get("entries", []):
+            self.entries[blob_hash] = file_structure
+
+    def save(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)  # 淘汰最久没有用到的条目
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self.cache_path.write_bytes(
+                get_json_codec().dumps(
+                    {
+                        "version": STRUCTURE_CACHE_VERSION,
+                        "entries": [list(entry) for entry in self.entries.items()],
+                    },
+                    compact=True,
+                )
+            )
+        except IOError as e:
+            logger.error(f"Failed to save structure cache to {self.cache_path}: {e}")
@@ -0,0 +1,64 @@
+"""基于AST的源码指纹：只改了格式、注释(可选：docstring)的对象指纹不变，不需要重新生成文档"""
+
+import ast
+import hashlib
+from typing import Optional
+
+
+def dedent_code(code_content: str) -> str:
+    """按第一行(def/class所在行)的缩进去掉缩进
+
+    和textwrap.dedent不同，缩进比第一行还少的注释行(比如顶格写的注释)会被丢掉，而不是让整段代码无法去掉缩进；
+    多行字符串中缩进较少的行保持原样。
+    """
+    stripped = code_content.lstrip("\n")
+    indent = len(stripped) - len(stripped.lstrip())
+    if indent == 0:
+        return code_content
+    lines = []
+    for line in code_content.splitlines(keepends=True):
+        if not line[:indent].strip():
+            lines.append(line[indent:])
+        elif not line.lstrip().startswith("#"):
+            lines.append(line)
+    return "".join(lines)
+
+
+def strip_docstrings(tree: ast.AST):
+    """原地去掉模块、类、函数的docstring"""
+    for node in ast.walk(tree):
+        if not isinstance(
+            node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+        ):
+            continue
+        body = node.body
+        if (
+            body
+            and isinstance(body[0], ast.Expr)
+            and isinstance(body[0].value, ast.Constant)
+            and isinstance(body[0].value.value, str)
+        ):
+            # 保留一个pass，只有docstring的函数去掉之后仍然是合法的AST
+            node.body = body[1:] or [ast.Pass()]
+
+
+def get_code_fingerprint(code_content: str, ignore_docstrings: bool = False) -> Optional[str]:
+    """
+    Get a fingerprint of the code that ignores formatting and comments.
+
+    Args:
+        code_content (str): The source code of one object, as stored in the project hierarchy.
+        ignore_docstrings (bool, optional): Also ignore docstrings. Defaults to False.
+
+    Returns:
+        Optional[str]: The fingerprint, or None if the code cannot be parsed on its own.
+    """
+    try:
+        tree = ast.parse(dedent_code(code_content))
+    except (SyntaxError, ValueError):
+        return None
+    if ignore_docstrings:
+        strip_docstrings(tree)
+    # 不包含行号、列号，格式变化不影响结果；注释本来就不在AST里
+    dumped = ast.dump(tree, annotate_fields=False, include_attributes=False)
+    return hashlib.sha1(dumped.encode("utf-8")).hexdigest()
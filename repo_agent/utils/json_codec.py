@@ -0,0 +1,146 @@
+"""可插拔的JSON编解码：安装了orjson或msgspec时使用它们，否则回退到标准库json
+
+对于project_hierarchy里出现的字符串、整数、布尔值和列表，所有codec的输出都和
+`json.dumps(obj, indent=2, ensure_ascii=False)` (或者紧凑模式下不带缩进) 一致，因此切换codec不会让project_hierarchy产生diff。
+浮点数的格式不保证一致，比如orjson输出1e20，而json输出1e+20。
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Dict, List, Optional, TypedDict
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - optional dependency
+    msgspec = None
+
+
+class HierarchyRecord(TypedDict, total=False):
+    """project_hierarchy中每个对象的记录，也就是FileHandler.get_obj_code_info_from_lines的输出加上MetaInfo写回的字段"""
+
+    name: str
+    type: str
+    md_content: List[str]
+    code_start_line: int
+    code_end_line: int
+    params: List[str]
+    have_return: bool
+    code_content: str
+    name_column: int
+    item_status: str
+    code_hash: str
+    who_reference_me: List[str]
+    reference_who: List[str]
+    special_reference_type: List[bool]
+
+
+HierarchyJson = Dict[str, List[HierarchyRecord]]  # 文件路径 -> 文件中的对象列表
+
+
+class JsonCodec:
+    """stdlib json，也是其他codec的基类"""
+
+    name = "json"
+
+    def dumps(self, obj: Any, compact: bool = False) -> bytes:
+        """编码成utf-8字节，compact为True时不缩进、不加空格"""
+        if compact:
+            text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+        else:
+            text = json.dumps(obj, indent=2, ensure_ascii=False)
+        return text.encode("utf-8")
+
+    def loads(self, data: bytes | str) -> Any:
+        return json.loads(data)
+
+    def loads_hierarchy(self, data: bytes | str) -> HierarchyJson:
+        """解码整个project_hierarchy，记录里不在HierarchyRecord中的字段原样保留"""
+        return self.loads(data)
+
+    def load_file(self, path) -> Any:
+        with open(path, "rb") as reader:
+            return self.loads(reader.read())
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def dumps(self, obj: Any, compact: bool = False) -> bytes:
+        try:
+            return orjson.dumps(obj, option=0 if compact else orjson.OPT_INDENT_2)
+        except TypeError:
+            # orjson不支持超过64位的整数等少见情况，回退到标准库
+            return super().dumps(obj, compact)
+
+    def loads(self, data: bytes | str) -> Any:
+        return orjson.loads(data)
+
+
+class MsgspecCodec(JsonCodec):
+    name = "msgspec"
+
+    def __init__(self):
+        self.encoder = msgspec.json.Encoder()
+        # 不按HierarchyRecord做类型化解码：TypedDict会丢掉schema之外的字段，新版本写入的字段经过老版本读写后就没了
+        self.decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj: Any, compact: bool = False) -> bytes:
+        data = self.encoder.encode(obj)
+        if compact:
+            return data
+        return msgspec.json.format(data, indent=2)
+
+    def loads(self, data: bytes | str) -> Any:
+        try:
+            return self.decoder.decode(data)
+        except msgspec.DecodeError as e:
+            # 和json/orjson一样抛出ValueError，调用方不需要区分codec
+            raise ValueError(str(e)) from e
+
+
+_CODEC_FACTORIES: Dict[str, Callable[[], JsonCodec]] = {"json": JsonCodec}
+if orjson is not None:
+    _CODEC_FACTORIES["orjson"] = OrjsonCodec
+if msgspec is not None:
+    _CODEC_FACTORIES["msgspec"] = MsgspecCodec
+
+_codec_instances: Dict[str, JsonCodec] = {}
+
+
+def available_codecs() -> List[str]:
+    return list(_CODEC_FACTORIES.keys())
+
+
+def get_json_codec(name: Optional[str] = None) -> JsonCodec:
+    """
+    Get a JSON codec by name.
+
+    Args:
+        name (str, optional): "orjson", "msgspec" or "json". Defaults to None, which picks orjson,
+            then msgspec, then the stdlib json, whichever is installed first.
+
+    Returns:
+        JsonCodec: The codec instance, shared by all callers.
+
+    Raises:
+        ValueError: If the requested codec is not installed.
+    """
+    if name is None:
+        name = next(
+            codec_name
+            for codec_name in ("orjson", "msgspec", "json")
+            if codec_name in _CODEC_FACTORIES
+        )
+    if name not in _CODEC_FACTORIES:
+        raise ValueError(
+            f"JSON codec {name} is not installed, available codecs: {available_codecs()}"
+        )
+    if name not in _codec_instances:
+        _codec_instances[name] = _CODEC_FACTORIES[name]()
+    return _codec_instances[name]
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Measure the memory used by the DocItem tree of a synthetic project hierarchy.
+
+Usage: python scripts/benchmark_doc_item_memory.py [--objects 100000]
+"""
+from pathlib import Path
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from benchmark_json_codec import make_hierarchy
+
+from repo_agent.settings import SettingsManager
+from repo_agent.utils.json_codec import get_json_codec
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--objects", type=int, default=100000)
+    args = parser.parse_args()
+
+    hierarchy = make_hierarchy(args.objects)
+    with tempfile.TemporaryDirectory() as repo_path:
+        # from_project_hierarchy_json会跳过磁盘上不存在的文件
+        for file_name in hierarchy:
+            file_path = Path(repo_path) / file_name
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            file_path.write_text("pass\n")
+        SettingsManager.initialize_with_params(
+            target_repo=Path(repo_path),
+            markdown_docs_name="markdown_docs",
+            hierarchy_name=".project_doc_record",
+            ignore_list=[],
+            language="English",
+            max_thread_count=1,
+            log_level="WARNING",
+            model="gpt-4o-mini",
+            temperature=0.2,
+            request_timeout=60,
+            openai_base_url="https://api.openai.com/v1",
+        )
+        from repo_agent.doc_meta_info import MetaInfo
+
+        # 和从project_hierarchy.json加载一样，解码出来的记录也算在树占用的内存里
+        data = get_json_codec().dumps(hierarchy, compact=True)
+        object_count = args.objects
+        del hierarchy
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        meta_info = MetaInfo.from_project_hierarchy_json(
+            get_json_codec().loads_hierarchy(data)
+        )
+        elapsed = time.perf_counter() - start
+        gc.collect()
+        tree_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    file_count = len(meta_info.get_all_files())
+    item_count = file_count + object_count
+    print(f"{object_count} objects in {file_count} files, built in {elapsed:.2f}s")
+    print(f"tree memory: {tree_bytes / 1e6:.1f} MB ({tree_bytes / item_count:.0f} bytes per item)")
+    print(f"peak memory: {peak_bytes / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Benchmark the JSON codecs on a synthetic project hierarchy.
+
+Usage: python scripts/benchmark_json_codec.py [--objects 100000] [--repeat 3]
+"""
+from pathlib import Path
+import argparse
+import sys
+import time
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from repo_agent.utils.json_codec import available_codecs, get_json_codec
+
+
+def make_hierarchy(object_count: int, objects_per_file: int = 20) -> dict:
+    """生成一个和project_hierarchy结构相同的层级，每个文件objects_per_file个对象"""
+    hierarchy = {}
+    for index in range(object_count):
+        file_name = f"pkg{index // 2000}/module{index // objects_per_file}.py"
+        name = f"function_{index}"
+        hierarchy.setdefault(file_name, []).append(
+            {
+                "type": "FunctionDef",
+                "name": name,
+                "md_content": [f"**{name}**: The function of {name} is to benchmark.\n" * 4],
+                "code_start_line": index % objects_per_file * 10 + 1,
+                "code_end_line": index % objects_per_file * 10 + 9,
+                "params": ["self", "value"],
+                "have_return": True,
+                "code_content": f"def {name}(self, value):\n    return value + {index}\n",
+                "name_column": 4,
+                "item_status": "doc_up_to_date",
+                "who_reference_me": [f"pkg0/module0.py/function_{index % 7}"],
+                "reference_who": [],
+                "special_reference_type": [False],
+            }
+        )
+    return hierarchy
+
+
+def best_time(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--objects", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    hierarchy = make_hierarchy(args.objects)
+    print(f"{args.objects} objects in {len(hierarchy)} files, codecs: {available_codecs()}")
+    print(f"{'codec':<10}{'mode':<10}{'size MB':>10}{'dumps s':>10}{'loads s':>10}")
+    for name in available_codecs():
+        codec = get_json_codec(name)
+        for compact in (False, True):
+            data = codec.dumps(hierarchy, compact)
+            dumps_time = best_time(lambda: codec.dumps(hierarchy, compact), args.repeat)
+            loads_time = best_time(lambda: codec.loads_hierarchy(data), args.repeat)
+            print(
+                f"{name:<10}{'compact' if compact else 'indent':<10}"
+                f"{len(data) / 1e6:>10.1f}{dumps_time:>10.3f}{loads_time:>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
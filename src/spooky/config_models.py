@@ -28,6 +28,8 @@ class LocalServer:
     provider: str
     base_url: str
     api_key_env: str | None = None
+    model: str | None = None
+    chat_base_url: str | None = None
 
 
 @dataclass
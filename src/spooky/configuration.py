@@ -51,6 +51,8 @@ class ConfigLoader:
                 provider=spec.get("provider", name),
                 base_url=spec["base_url"],
                 api_key_env=spec.get("api_key_env"),
+                model=spec.get("model"),
+                chat_base_url=spec.get("chat_base_url"),
             )
             for name, spec in servers.items()
         }
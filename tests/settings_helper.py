@@ -0,0 +1,28 @@
+import os
+from pathlib import Path
+from unittest import mock
+
+from repo_agent.settings import SettingsManager
+
+
+def init_test_settings(repo_path, **kwargs):
+    """用测试的默认值初始化全局设置，其他参数原样传给initialize_with_params
+
+    没有配置OPENAI_API_KEY的环境里也能运行，测试不会真的请求LLM
+    """
+    params = dict(
+        target_repo=Path(repo_path),
+        markdown_docs_name="markdown_docs",
+        hierarchy_name=".project_doc_record",
+        ignore_list=[],
+        language="English",
+        max_thread_count=1,
+        log_level="INFO",
+        model="gpt-4o-mini",
+        temperature=0.2,
+        request_timeout=60,
+        openai_base_url="https://api.openai.com/v1",
+    )
+    params.update(kwargs)
+    with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+        SettingsManager.initialize_with_params(**params)
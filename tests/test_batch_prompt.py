@@ -0,0 +1,83 @@
+import asyncio
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+try:
+    from repo_agent.chat_engine import ChatEngine, parse_batch_response
+    from repo_agent.doc_meta_info import DocItem, DocItemStatus, DocItemType
+    from repo_agent.runner import Runner
+    from tests.settings_helper import init_test_settings
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    ChatEngine = None
+
+
+@unittest.skipIf(ChatEngine is None, "ChatEngine dependencies missing")
+class TestBatchPrompt(unittest.TestCase):
+    def test_parse_batch_response(self):
+        content = "Sure.\n[[DOC 1]]\n**a**: first\n\n[[DOC 2]]\n**b**: second\n"
+        self.assertEqual(parse_batch_response(content, 2), {0: "**a**: first", 1: "**b**: second"})
+
+    def test_parse_batch_response_drops_ambiguous_documents(self):
+        content = "[[DOC 1]]\nfirst\n[[DOC 1]]\nagain\n[[DOC 2]]\n\n[[DOC 3]]\nthird\n[[DOC 9]]\nextra"
+        self.assertEqual(parse_batch_response(content, 3), {2: "third"})
+        self.assertEqual(parse_batch_response("no markers", 2), {})
+
+    def test_build_batch_prompt(self):
+        repo_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, repo_path)
+        init_test_settings(repo_path, llm_cache_size=0)
+        root = DocItem(item_type=DocItemType._repo, obj_name="full_repo")
+        file_item = DocItem(item_type=DocItemType._file, obj_name="a.py")
+        root.add_child("a.py", file_item)
+        items = []
+        for name in ["get_x", "get_y"]:
+            item = DocItem(
+                item_type=DocItemType._function,
+                obj_name=name,
+                content={"type": "FunctionDef", "name": name, "code_content": f"def {name}():\n    return 1\n", "have_return": True},
+            )
+            file_item.add_child(name, item)
+            items.append(item)
+        items[1].reference_who.append(items[0])
+
+        system_prompt = ChatEngine(project_manager=None).build_batch_prompt(items)[0].content
+        self.assertIn("[[OBJECT 1]] Function get_x, path a.py/get_x, has a return value", system_prompt)
+        self.assertIn("Calls: a.py/get_x", system_prompt)
+        self.assertIn("all 2 objects", system_prompt)
+
+    def test_batch_handler_does_not_raise(self):
+        root = DocItem(item_type=DocItemType._repo, obj_name="full_repo")
+        file_item = DocItem(item_type=DocItemType._file, obj_name="a.py")
+        root.add_child("a.py", file_item)
+        items = []
+        for name in ["get_x", "get_y"]:
+            item = DocItem(item_type=DocItemType._function, obj_name=name)
+            file_item.add_child(name, item)
+            items.append(item)
+
+        runner = Runner.__new__(Runner)
+        runner.setting = SimpleNamespace(project=SimpleNamespace(ignore_list=[]))
+        runner.chat_engine = mock.Mock()
+        runner.chat_engine.generate_docs.return_value = {0: "doc of get_x"}
+        runner.chat_engine.agenerate_docs = mock.AsyncMock(return_value={0: "doc of get_x"})
+        runner.doc_journal = mock.Mock()
+        runner.doc_journal.record.side_effect = OSError("disk full")
+
+        # 异常抛给worker的话，这一批任务不会被标记完成，其他worker会一直等下去
+        for run in [
+            lambda: runner.generate_docs_for_a_batch(items),
+            lambda: asyncio.run(runner.agenerate_docs_for_a_batch(items)),
+        ]:
+            for item in items:
+                item.item_status = DocItemStatus.doc_has_not_been_generated
+                item.md_content = []
+            run()
+            self.assertEqual(items[0].item_status, DocItemStatus.doc_up_to_date)
+            self.assertEqual(items[1].item_status, DocItemStatus.doc_has_not_been_generated)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+try:
+    from repo_agent.checkpoint_journal import (
+        CheckpointJournal,
+        get_journal_path,
+        get_journal_segments,
+        replay_journal,
+    )
+    from repo_agent.doc_meta_info import DocItemStatus, MetaInfo
+    from tests.settings_helper import init_test_settings
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    CheckpointJournal = None
+
+
+def make_hierarchy_json():
+    def obj(name, start, end):
+        return {
+            "type": "FunctionDef",
+            "name": name,
+            "md_content": [],
+            "code_start_line": start,
+            "code_end_line": end,
+            "params": [],
+            "have_return": False,
+            "code_content": f"def {name}():\n    pass\n",
+            "name_column": 4,
+            "item_status": "doc_has_not_been_generated",
+        }
+
+    return {"pkg/a.py": [obj("foo", 1, 2), obj("bar", 4, 5)]}
+
+
+@unittest.skipIf(CheckpointJournal is None, "CheckpointJournal dependencies missing")
+class TestCheckpointJournal(unittest.TestCase):
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.repo_path, "pkg"))
+        with open(os.path.join(self.repo_path, "pkg", "a.py"), "w") as f:
+            f.write("def foo():\n    pass\n\ndef bar():\n    pass\n")
+        init_test_settings(self.repo_path)
+        self.target_dir = os.path.join(self.repo_path, ".project_doc_record")
+        self.meta_info = MetaInfo.from_project_hierarchy_json(make_hierarchy_json())
+
+    def tearDown(self):
+        shutil.rmtree(self.repo_path)
+
+    def generate(self, meta_info, key_path, doc):
+        doc_item = meta_info.target_repo_hierarchical_tree.find(key_path)
+        doc_item.md_content.append(doc)
+        doc_item.item_status = DocItemStatus.doc_up_to_date
+        return doc_item
+
+    def test_replay_restores_documents_after_crash(self):
+        journal = CheckpointJournal(self.meta_info, self.target_dir, compact_every_items=100)
+        journal.record(self.generate(self.meta_info, ["pkg", "a.py", "bar"], "bar doc"))
+        with open(get_journal_path(self.target_dir), "a", encoding="utf-8") as writer:
+            writer.write('{"key_path": ["pkg", "a.p')  # 进程在写最后一行时崩溃
+
+        # 没有合并就"崩溃"了，从旧的快照重新加载后重放journal
+        reloaded = MetaInfo.from_project_hierarchy_json(make_hierarchy_json())
+        self.assertEqual(replay_journal(reloaded, self.target_dir), 1)
+        bar = reloaded.target_repo_hierarchical_tree.find(["pkg", "a.py", "bar"])
+        self.assertEqual(bar.md_content, ["bar doc"])
+        self.assertEqual(bar.item_status, DocItemStatus.doc_up_to_date)
+        foo = reloaded.target_repo_hierarchical_tree.find(["pkg", "a.py", "foo"])
+        self.assertEqual(foo.md_content, [])
+
+    def test_compaction_folds_journal_into_snapshot(self):
+        journal = CheckpointJournal(self.meta_info, self.target_dir, compact_every_items=1).start()
+        journal.record(self.generate(self.meta_info, ["pkg", "a.py", "foo"], "foo doc"))
+        journal.close()
+
+        self.assertEqual(os.path.getsize(get_journal_path(self.target_dir)), 0)
+        with open(os.path.join(self.target_dir, "project_hierarchy.json"), encoding="utf-8") as reader:
+            snapshot = json.load(reader)
+        self.assertEqual(snapshot["pkg/a.py"][0]["md_content"], ["foo doc"])
+
+    def test_record_is_not_blocked_while_snapshot_is_written(self):
+        journal = CheckpointJournal(self.meta_info, self.target_dir, compact_every_items=100)
+        journal.record(self.generate(self.meta_info, ["pkg", "a.py", "foo"], "foo doc"))
+        original_checkpoint = self.meta_info.checkpoint
+
+        def slow_checkpoint(**kwargs):
+            # 写快照期间另一个线程完成了一篇文档
+            bar = self.generate(self.meta_info, ["pkg", "a.py", "bar"], "bar doc")
+            recorder = threading.Thread(target=journal.record, args=(bar,))
+            recorder.start()
+            recorder.join(timeout=5)
+            self.assertFalse(recorder.is_alive())
+            return original_checkpoint(**kwargs)
+
+        with mock.patch.object(self.meta_info, "checkpoint", side_effect=slow_checkpoint):
+            journal.compact()
+        journal.writer.close()
+
+        # 合并过的分段已经删除，写快照期间的记录留在新的journal里等下次合并
+        self.assertEqual(get_journal_segments(self.target_dir), [])
+        self.assertEqual(journal.pending_count, 1)
+        reloaded = MetaInfo.from_project_hierarchy_json(make_hierarchy_json())
+        self.assertEqual(replay_journal(reloaded, self.target_dir), 1)
+        bar = reloaded.target_repo_hierarchical_tree.find(["pkg", "a.py", "bar"])
+        self.assertEqual(bar.md_content, ["bar doc"])
+
+    def test_failed_compaction_keeps_segment_for_replay(self):
+        journal = CheckpointJournal(self.meta_info, self.target_dir, compact_every_items=100)
+        journal.record(self.generate(self.meta_info, ["pkg", "a.py", "foo"], "foo doc"))
+        with mock.patch.object(self.meta_info, "checkpoint", return_value=False):
+            journal.compact()
+        journal.record(self.generate(self.meta_info, ["pkg", "a.py", "bar"], "bar doc"))
+        journal.writer.close()
+
+        self.assertEqual(len(get_journal_segments(self.target_dir)), 1)
+        self.assertEqual(journal.pending_count, 2)
+        self.assertEqual(journal.dirty_file_names, {"pkg/a.py"})
+        reloaded = MetaInfo.from_project_hierarchy_json(make_hierarchy_json())
+        self.assertEqual(replay_journal(reloaded, self.target_dir), 2)
+        foo = reloaded.target_repo_hierarchical_tree.find(["pkg", "a.py", "foo"])
+        self.assertEqual(foo.md_content, ["foo doc"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from repo_agent.utils.code_fingerprint import get_code_fingerprint
+
+ORIGINAL = '''    def area(self, width, height):
+        """Return the area."""
+        return width*height  # 面积
+'''
+
+REFORMATTED = '''    def area(
+        self,
+        width,
+        height,
+    ):
+        """Return the area."""
+
+        return width * height
+'''
+
+
+class TestCodeFingerprint(unittest.TestCase):
+    def test_formatting_and_comments_are_ignored(self):
+        self.assertEqual(get_code_fingerprint(ORIGINAL), get_code_fingerprint(REFORMATTED))
+
+    def test_semantic_changes_are_detected(self):
+        changed = ORIGINAL.replace("width*height", "width*height*2")
+        self.assertNotEqual(get_code_fingerprint(ORIGINAL), get_code_fingerprint(changed))
+
+    def test_docstrings_are_optionally_ignored(self):
+        changed = ORIGINAL.replace("Return the area.", "Compute the rectangle area.")
+        self.assertNotEqual(get_code_fingerprint(ORIGINAL), get_code_fingerprint(changed))
+        self.assertEqual(
+            get_code_fingerprint(ORIGINAL, ignore_docstrings=True),
+            get_code_fingerprint(changed, ignore_docstrings=True),
+        )
+
+    def test_unindented_comment_in_method(self):
+        self.assertEqual(get_code_fingerprint(ORIGINAL), get_code_fingerprint(ORIGINAL + "# TODO\n"))
+
+    def test_unparsable_code(self):
+        self.assertIsNone(get_code_fingerprint("def broken(:\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
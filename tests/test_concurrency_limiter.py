@@ -0,0 +1,170 @@
+import asyncio
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+try:
+    import httpx
+    import openai
+    from llama_index.core.llms import ChatMessage, ChatResponse, MessageRole
+
+    from repo_agent.chat_engine import ChatEngine
+    from repo_agent.multi_task_dispatch import AdaptiveConcurrencyLimiter, get_backoff_delay
+    from tests.settings_helper import init_test_settings
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    AdaptiveConcurrencyLimiter = None
+
+
+@unittest.skipIf(AdaptiveConcurrencyLimiter is None, "limiter dependencies missing")
+class TestAdaptiveConcurrencyLimiter(unittest.TestCase):
+    def test_additive_increase_multiplicative_decrease(self):
+        limiter = AdaptiveConcurrencyLimiter(max_limit=8, cooldown=0)
+        self.assertEqual(int(limiter.limit), 4)
+        for _ in range(40):
+            limiter.acquire()
+            limiter.release(latency=1.0)
+        self.assertEqual(int(limiter.limit), 8)  # 不超过上限
+
+        limiter.acquire()
+        limiter.release(rate_limited=True)
+        self.assertEqual(int(limiter.limit), 4)
+        limiter.acquire()
+        limiter.release(latency=10.0)  # 延迟突增
+        self.assertEqual(int(limiter.limit), 2)
+
+    def test_errors_count_as_failures_without_cutting(self):
+        limiter = AdaptiveConcurrencyLimiter(max_limit=8, cooldown=0)
+        limiter.acquire()
+        limiter.release(error=True)
+        self.assertEqual(int(limiter.limit), 4)
+        self.assertEqual((limiter.success_count, limiter.error_count), (0, 1))
+
+    def test_cuts_once_per_cooldown(self):
+        limiter = AdaptiveConcurrencyLimiter(max_limit=8, cooldown=60)
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(rate_limited=True)
+        self.assertEqual(int(limiter.limit), 2)
+        self.assertEqual(limiter.rate_limited_count, 3)
+
+    def test_in_flight_limit_blocks(self):
+        limiter = AdaptiveConcurrencyLimiter(max_limit=1, adaptive=False)
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def second_request():
+            limiter.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=second_request)
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release(latency=0.1)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+
+    def test_async_waiters_are_woken_by_release(self):
+        limiter = AdaptiveConcurrencyLimiter(max_limit=1, adaptive=False)
+        limiter.acquire()
+
+        async def main():
+            waiting = asyncio.ensure_future(limiter.aacquire())
+            cancelled = asyncio.ensure_future(limiter.aacquire())
+            await asyncio.sleep(0.1)
+            # 两个协程都挂在future上等待，没有轮询
+            self.assertFalse(waiting.done())
+            self.assertEqual(len(limiter.async_waiters), 2)
+            cancelled.cancel()
+            # release在另一个线程里调用，通过call_soon_threadsafe唤醒事件循环
+            await asyncio.get_running_loop().run_in_executor(None, limiter.release)
+            await asyncio.wait_for(waiting, timeout=5)
+            self.assertTrue(cancelled.cancelled())
+            self.assertEqual(limiter.in_flight, 1)
+            self.assertEqual(limiter.async_waiters, [])
+
+        asyncio.run(main())
+
+    def test_token_budget(self):
+        limiter = AdaptiveConcurrencyLimiter(max_limit=4, adaptive=False, tokens_per_minute=600)
+        with limiter.condition:
+            self.assertEqual(limiter.try_acquire(500), 0)
+            # 还剩100个token，每秒恢复10个
+            self.assertAlmostEqual(limiter.try_acquire(200), 10, delta=0.1)
+
+    def test_backoff_delay(self):
+        for attempt in range(8):
+            self.assertLessEqual(get_backoff_delay(attempt), min(60, 2**attempt))
+        self.assertGreaterEqual(get_backoff_delay(0, retry_after=5), 5)
+
+
+class FlakyLLM:
+    """前几次请求返回429(或者指定的状态码)的LLM"""
+
+    def __init__(self, failures, status_code=429):
+        self.failures = failures
+        self.status_code = status_code
+        self.call_count = 0
+
+    def chat(self, messages):
+        self.call_count += 1
+        if self.call_count <= self.failures:
+            request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+            response = httpx.Response(self.status_code, request=request)
+            if self.status_code == 429:
+                raise openai.RateLimitError("rate limited", response=response, body=None)
+            raise openai.BadRequestError("bad request", response=response, body=None)
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content="doc"))
+
+
+@unittest.skipIf(AdaptiveConcurrencyLimiter is None, "limiter dependencies missing")
+class TestChatEngineRetries(unittest.TestCase):
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        init_test_settings(
+            self.repo_path,
+            max_thread_count=4,
+            llm_cache_size=0,
+            llm_max_retries=2,
+            adaptive_concurrency=True,
+        )
+        self.engine = ChatEngine(project_manager=None)
+
+    def tearDown(self):
+        shutil.rmtree(self.repo_path)
+
+    @mock.patch("repo_agent.chat_engine.get_backoff_delay", return_value=0)
+    def test_rate_limits_are_retried(self, _):
+        self.engine.llm = FlakyLLM(failures=2)
+        self.assertEqual(self.engine.complete([]), ("doc", True))
+        self.assertEqual(self.engine.limiter.rate_limited_count, 2)
+        self.assertEqual(self.engine.limiter.in_flight, 0)
+
+    @mock.patch("repo_agent.chat_engine.get_backoff_delay", return_value=0)
+    def test_gives_up_after_max_retries(self, _):
+        self.engine.llm = FlakyLLM(failures=3)
+        with self.assertRaises(openai.RateLimitError):
+            self.engine.complete([])
+        self.assertEqual(self.engine.llm.call_count, 3)
+        self.assertEqual(self.engine.limiter.in_flight, 0)
+
+    def test_bad_requests_are_failures_without_cut(self):
+        self.engine.llm = FlakyLLM(failures=1, status_code=400)
+        limit = self.engine.limiter.limit
+        with self.assertRaises(openai.BadRequestError):
+            self.engine.complete([])
+        self.assertEqual(self.engine.llm.call_count, 1)
+        self.assertEqual((self.engine.limiter.success_count, self.engine.limiter.error_count), (0, 1))
+        self.assertEqual(self.engine.limiter.limit, limit)
+
+    def test_full_response_time_is_not_a_latency_spike(self):
+        # 非流式时的耗时取决于输出长度，不能和最快的请求比较
+        self.engine.llm = FlakyLLM(failures=0)
+        with mock.patch.object(self.engine.limiter, "on_success") as on_success:
+            self.engine.complete([])
+        on_success.assert_called_once_with(None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from repo_agent.doc_meta_info import DocItem, DocItemType, MetaInfo
+    from tests.settings_helper import init_test_settings
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    DocItem = None
+
+
+def add_child(father, name, item_type):
+    child = DocItem(item_type=item_type, obj_name=name)
+    father.add_child(name, child)
+    return child
+
+
+@unittest.skipIf(DocItem is None, "DocItem dependencies missing")
+class TestDocItem(unittest.TestCase):
+    def setUp(self):
+        self.root = DocItem(item_type=DocItemType._repo, obj_name="full_repo")
+        self.file_item = add_child(
+            add_child(self.root, "pkg", DocItemType._dir), "a.py", DocItemType._file
+        )
+        self.class_item = add_child(self.file_item, "A", DocItemType._class)
+        self.method_item = add_child(self.class_item, "run", DocItemType._class_function)
+        self.other_item = add_child(self.file_item, "helper", DocItemType._function)
+
+    def test_tree_path_follows_fathers(self):
+        self.assertEqual(
+            [item.obj_name for item in self.method_item.tree_path],
+            ["full_repo", "pkg", "a.py", "A", "run"],
+        )
+
+    def test_has_ans_relation(self):
+        self.assertIs(DocItem.has_ans_relation(self.method_item, self.class_item), self.class_item)
+        self.assertIs(DocItem.has_ans_relation(self.file_item, self.method_item), self.file_item)
+        self.assertIsNone(DocItem.has_ans_relation(self.method_item, self.other_item))
+
+    def test_full_names_of_duplicates(self):
+        duplicate = DocItem(item_type=DocItemType._class, obj_name="A")
+        self.file_item.add_child("A_0", duplicate)
+        nested = DocItem(item_type=DocItemType._class_function, obj_name="run")
+        duplicate.add_child("run", nested)
+        self.assertEqual(duplicate.get_full_name(), "pkg/a.py/A")
+        self.assertEqual(duplicate.get_full_name(strict=True), "pkg/a.py/A_0(name_duplicate_version)")
+        self.assertEqual(nested.get_full_name(strict=True), "pkg/a.py/A/run")
+        self.assertEqual(nested.get_key_path(), ["pkg", "a.py", "A_0", "run"])
+
+    def test_add_child_invalidates_cached_names(self):
+        self.assertEqual(self.method_item.get_full_name(), "pkg/a.py/A/run")
+        moved_file = add_child(self.root, "b.py", DocItemType._file)
+        del self.file_item.children["A"]
+        moved_file.add_child("A", self.class_item)
+        self.assertEqual(self.method_item.get_full_name(), "b.py/A/run")
+        self.assertEqual(self.method_item.get_file_name(), "b.py")
+
+    def test_slots(self):
+        self.assertFalse(hasattr(self.method_item, "__dict__"))
+
+
+@unittest.skipIf(DocItem is None, "DocItem dependencies missing")
+class TestCodeHash(unittest.TestCase):
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.repo_path, "pkg"))
+        with open(os.path.join(self.repo_path, "pkg", "a.py"), "w") as f:
+            f.write("def foo(x):\n    return x + 1\n")
+        init_test_settings(self.repo_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.repo_path)
+
+    def test_code_hash_is_persisted(self):
+        code_content = "def foo(x):\n    return x + 1\n"
+        records = {
+            "pkg/a.py": [
+                {
+                    "type": "FunctionDef",
+                    "name": "foo",
+                    "md_content": [],
+                    "code_start_line": 1,
+                    "code_end_line": 2,
+                    "params": ["x"],
+                    "have_return": True,
+                    "code_content": code_content,
+                    "name_column": 4,
+                }
+            ]
+        }
+        meta_info = MetaInfo.from_project_hierarchy_json(records)
+        records = meta_info.to_hierarchy_json()
+        foo_record = records["pkg/a.py"][0]
+        self.assertEqual(foo_record["code_hash"], hashlib.sha1(code_content.encode("utf-8")).hexdigest())
+
+        # 旧版本的对象直接使用记录里的hash，不再重新计算
+        foo_record["code_hash"] = "stored"
+        reloaded = MetaInfo.from_project_hierarchy_json(records)
+        self.assertEqual(reloaded.find_item_by_key_path(["pkg", "a.py", "foo"]).get_code_hash(), "stored")
+
+
+def make_obj(name, start, end):
+    return DocItem(item_type=DocItemType._function, obj_name=name, code_start_line=start, code_end_line=end)
+
+
+@unittest.skipIf(DocItem is None, "DocItem dependencies missing")
+class TestNesting(unittest.TestCase):
+    def assert_fathers(self, obj_item_list, expected):
+        fathers = MetaInfo.find_fathers_by_nesting(obj_item_list)
+        self.assertEqual([father.obj_name if father else None for father in fathers], expected)
+        pairwise = MetaInfo.find_fathers_pairwise(obj_item_list)
+        self.assertEqual([id(father) for father in fathers], [id(father) for father in pairwise])
+
+    def test_nested_and_duplicate_objects(self):
+        self.assert_fathers(
+            [
+                make_obj("A", 1, 10),
+                make_obj("run", 2, 5),
+                make_obj("inner", 3, 4),
+                make_obj("B", 12, 20),
+                make_obj("run", 13, 15),
+                make_obj("same", 22, 25),
+                make_obj("same", 22, 25),  # 范围完全相同的对象互相不算包含
+                make_obj("outer", 30, 40),
+                make_obj("twin", 31, 35),
+                make_obj("twin", 31, 35),
+            ],
+            [None, "A", "run", None, "B", None, None, None, "outer", "outer"],
+        )
+
+    def test_first_of_identical_fathers_wins(self):
+        obj_item_list = [make_obj("first", 1, 10), make_obj("second", 1, 10), make_obj("child", 2, 3)]
+        fathers = MetaInfo.find_fathers_by_nesting(obj_item_list)
+        self.assertIs(fathers[2], obj_item_list[0])
+
+    def test_crossing_ranges_fall_back_to_pairwise(self):
+        self.assert_fathers(
+            [make_obj("left", 1, 5), make_obj("right", 3, 8), make_obj("middle", 4, 4)],
+            [None, None, "left"],
+        )
+
+
+@unittest.skipIf(DocItem is None, "DocItem dependencies missing")
+class TestLinenoIndex(unittest.TestCase):
+    def setUp(self):
+        self.file_item = DocItem(item_type=DocItemType._file, obj_name="a.py")
+        self.class_item = make_obj("A", 1, 10)
+        self.method_item = make_obj("run", 2, 5)
+        self.inner_item = make_obj("inner", 3, 4)
+        self.other_item = make_obj("B", 12, 20)
+        self.file_item.add_child("A", self.class_item)
+        self.class_item.add_child("run", self.method_item)
+        self.method_item.add_child("inner", self.inner_item)
+        self.file_item.add_child("B", self.other_item)
+
+    def test_lookup_at_range_boundaries(self):
+        meta_info = MetaInfo(target_repo_hierarchical_tree=self.file_item)
+        expected = {
+            0: self.file_item,
+            1: self.class_item,
+            2: self.method_item,
+            3: self.inner_item,
+            4: self.inner_item,
+            5: self.method_item,
+            6: self.class_item,
+            10: self.class_item,
+            11: self.file_item,
+            12: self.other_item,
+            20: self.other_item,
+            21: self.file_item,
+        }
+        for line, item in expected.items():
+            with self.subTest(line=line):
+                self.assertIs(meta_info.find_obj_with_lineno(self.file_item, line), item)
+        self.assertIsNotNone(self.file_item.lineno_index)
+
+    def test_segments_are_contiguous(self):
+        segment_starts, segment_items = self.file_item.build_lineno_index()
+        self.assertEqual(segment_starts[1:], [1, 2, 3, 5, 6, 11, 12, 21])
+        self.assertEqual(
+            [item.obj_name for item in segment_items],
+            ["a.py", "A", "run", "inner", "run", "A", "a.py", "B", "a.py"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import textwrap
+import unittest
+
+try:
+    from repo_agent.file_handler import FileHandler
+    from tests.settings_helper import init_test_settings
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    FileHandler = None
+
+SOURCE = textwrap.dedent(
+    '''\
+    import functools
+
+
+    @functools.lru_cache()
+    def cached(key, default=None):
+        return key
+
+
+    class Service:
+        @staticmethod
+        @functools.wraps(cached)
+        def build(config):
+            pass
+
+        async def fetch(self, url, *, timeout=10):
+            async def retry(attempt):
+                return await self.fetch(url)
+            return await retry(0)
+    '''
+)
+
+
+@unittest.skipIf(FileHandler is None, "FileHandler dependencies missing")
+class TestFileHandler(unittest.TestCase):
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        with open(os.path.join(self.repo_path, "service.py"), "w", encoding="utf-8") as writer:
+            writer.write(SOURCE)
+        init_test_settings(self.repo_path)
+        self.file_handler = FileHandler(self.repo_path, None)
+
+    def tearDown(self):
+        shutil.rmtree(self.repo_path)
+
+    def test_functions_and_classes(self):
+        self.assertEqual(
+            self.file_handler.get_functions_and_classes(SOURCE),
+            [
+                ("FunctionDef", "cached", 5, 6, ["key", "default"]),
+                ("ClassDef", "Service", 9, 18, []),
+                ("FunctionDef", "build", 12, 13, ["config"]),
+                ("AsyncFunctionDef", "fetch", 15, 18, ["self", "url"]),
+                ("AsyncFunctionDef", "retry", 16, 17, ["attempt"]),
+            ],
+        )
+
+    def test_code_info_of_decorated_and_async_defs(self):
+        lines = SOURCE.splitlines(keepends=True)
+        build = FileHandler.get_obj_code_info_from_lines("FunctionDef", "build", 12, 13, ["config"], lines)
+        # 装饰器不在对象的代码范围内，从def所在的行开始
+        self.assertEqual(build["code_content"], "    def build(config):\n        pass\n")
+        self.assertEqual(build["name_column"], 8)
+        self.assertFalse(build["have_return"])
+
+        fetch = FileHandler.get_obj_code_info_from_lines("AsyncFunctionDef", "fetch", 15, 18, ["self", "url"], lines)
+        self.assertEqual(fetch["code_content"], "".join(lines[14:18]))
+        self.assertEqual(fetch["name_column"], 14)
+        self.assertTrue(fetch["have_return"])
+        self.assertEqual(fetch["md_content"], [])
+
+    def test_file_structure_matches_per_object_reads(self):
+        file_objects = self.file_handler.generate_file_structure("service.py")
+        self.assertEqual([obj["name"] for obj in file_objects], ["cached", "Service", "build", "fetch", "retry"])
+        for obj in file_objects:
+            with self.subTest(name=obj["name"]):
+                self.assertEqual(
+                    obj,
+                    self.file_handler.get_obj_code_info(
+                        obj["type"],
+                        obj["name"],
+                        obj["code_start_line"],
+                        obj["code_end_line"],
+                        obj["params"],
+                        file_path="service.py",
+                    ),
+                )
+
+    def test_process_pool_matches_serial_output(self):
+        file_paths = ["service.py"]
+        for index in range(6):
+            file_path = f"module_{index}.py"
+            with open(os.path.join(self.repo_path, file_path), "w", encoding="utf-8") as writer:
+                writer.write(f"def func_{index}(x):\n    return x + {index}\n")
+            file_paths.append(file_path)
+        with open(os.path.join(self.repo_path, "broken.py"), "w", encoding="utf-8") as writer:
+            writer.write("def broken(:\n")
+        file_paths.insert(3, "broken.py")
+
+        serial = list(self.file_handler.generate_file_structures(file_paths, process_count=1))
+        pooled = list(self.file_handler.generate_file_structures(file_paths, process_count=2))
+        self.assertEqual(pooled, serial)
+        self.assertIsNone(serial[3][0])
+        self.assertIsNotNone(serial[3][1])  # 解析失败的文件返回错误信息，而不是让整个进程池失败
+        self.assertEqual(serial[0], (self.file_handler.generate_file_structure("service.py"), None))
+
+
+if __name__ == "__main__":
+    unittest.main()
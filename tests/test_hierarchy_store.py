@@ -0,0 +1,119 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from repo_agent.hierarchy_store import (
+        MonolithicHierarchyStore,
+        ShardedHierarchyStore,
+        SqliteHierarchyStore,
+        export_hierarchy_json,
+        get_hierarchy_store,
+        migrate_hierarchy,
+    )
+    from repo_agent.settings import HierarchyLayout
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    ShardedHierarchyStore = None
+
+
+def make_hierarchy_json():
+    return {
+        "pkg/a.py": [{"name": "foo", "md_content": ["foo doc"]}],
+        "pkg/sub/b.py": [{"name": "bar", "md_content": []}],
+    }
+
+
+@unittest.skipIf(ShardedHierarchyStore is None, "hierarchy_store dependencies missing")
+class TestHierarchyStore(unittest.TestCase):
+    def setUp(self):
+        self.target_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.target_dir)
+
+    def test_sharded_round_trip_is_lazy(self):
+        store = ShardedHierarchyStore(self.target_dir)
+        store.save(make_hierarchy_json())
+        self.assertTrue(os.path.exists(os.path.join(self.target_dir, "project_hierarchy", "pkg", "sub", "b.py.json")))
+
+        hierarchy = store.load()
+        self.assertEqual(list(hierarchy), ["pkg/a.py", "pkg/sub/b.py"])
+        # 删掉一个shard，只要不访问它，其他文件依然可以读取
+        os.remove(store.get_shard_path("pkg/sub/b.py"))
+        self.assertEqual(hierarchy["pkg/a.py"], [{"name": "foo", "md_content": ["foo doc"]}])
+
+    def test_sharded_save_only_touches_dirty_shards(self):
+        store = ShardedHierarchyStore(self.target_dir)
+        store.save(make_hierarchy_json())
+        os.utime(store.get_shard_path("pkg/a.py"), ns=(0, 0))
+
+        # 全量保存时内容没变的shard不会重写，删掉的文件对应的shard和空目录被清理
+        hierarchy_json = make_hierarchy_json()
+        del hierarchy_json["pkg/sub/b.py"]
+        store.save(hierarchy_json)
+        self.assertEqual(os.stat(store.get_shard_path("pkg/a.py")).st_mtime_ns, 0)
+        self.assertFalse(os.path.exists(os.path.join(self.target_dir, "project_hierarchy", "pkg", "sub")))
+
+        # 部分保存时保留其他文件
+        store.save({"pkg/c.py": []}, partial=True)
+        self.assertEqual(list(store.load()), ["pkg/a.py", "pkg/c.py"])
+
+    def test_migrate_between_layouts(self):
+        MonolithicHierarchyStore(self.target_dir).save(make_hierarchy_json())
+
+        self.assertEqual(migrate_hierarchy(self.target_dir, HierarchyLayout.SHARDED), 2)
+        store = get_hierarchy_store(self.target_dir)
+        self.assertEqual(store.layout, HierarchyLayout.SHARDED)
+        self.assertFalse(os.path.exists(os.path.join(self.target_dir, "project_hierarchy.json")))
+        self.assertEqual(dict(store.load()), make_hierarchy_json())
+
+        migrate_hierarchy(self.target_dir, HierarchyLayout.MONOLITHIC)
+        store = get_hierarchy_store(self.target_dir)
+        self.assertEqual(store.layout, HierarchyLayout.MONOLITHIC)
+        self.assertEqual(store.load(), make_hierarchy_json())
+
+    def test_sqlite_round_trip_and_indexed_queries(self):
+        hierarchy_json = make_hierarchy_json()
+        hierarchy_json["pkg/a.py"][0].update(
+            {"item_status": "doc_up_to_date", "who_reference_me": ["pkg/sub/b.py/bar"], "reference_who": []}
+        )
+        store = SqliteHierarchyStore(self.target_dir)
+        store.save(hierarchy_json)
+        store.save({"pkg/c.py": [{"name": "foo", "md_content": ["v1", "v2"]}]}, partial=True)
+        self.assertEqual(get_hierarchy_store(self.target_dir).layout, HierarchyLayout.SQLITE)
+
+        expected = dict(hierarchy_json, **{"pkg/c.py": [{"name": "foo", "md_content": ["v1", "v2"]}]})
+        # 读回来的对象和字段顺序都和json格式一致
+        self.assertEqual(list(store.load().items()), list(expected.items()))
+        self.assertEqual(
+            [item["file_name"] for item in store.find_items(name="foo")], ["pkg/a.py", "pkg/c.py"]
+        )
+        self.assertEqual(len(store.find_items(item_status="doc_up_to_date")), 1)
+
+        output_path = os.path.join(self.target_dir, "exported.json")
+        self.assertEqual(export_hierarchy_json(self.target_dir, output_path), 3)
+        with open(output_path, encoding="utf-8") as reader:
+            self.assertEqual(json.load(reader), expected)
+        store.close()
+
+    def test_sqlite_readers_do_not_write(self):
+        writer = SqliteHierarchyStore(self.target_dir)
+        writer.save({f"pkg/m{i}.py": [{"name": "foo", "md_content": ["doc"], "who_reference_me": []}] for i in range(5)})
+        writer.connect().execute("PRAGMA user_version=0")
+        writer.close()
+
+        reader = SqliteHierarchyStore(self.target_dir)
+        statements = []
+        reader.connect().set_trace_callback(statements.append)
+        self.assertEqual(len(reader.find_items(name="foo")), 5)
+        # 只读不建表，文档版本和引用关系也不是每个对象查一次
+        self.assertEqual(len(statements), 3)
+        self.assertTrue(all(statement.startswith("SELECT") for statement in statements))
+        self.assertEqual(reader.connect().execute("PRAGMA user_version").fetchone()[0], 0)
+        reader.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import json
+import unittest
+
+try:
+    from repo_agent.utils.json_codec import available_codecs, get_json_codec
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    get_json_codec = None
+
+
+HIERARCHY = {
+    "pkg/a.py": [
+        {
+            "type": "FunctionDef",
+            "name": "foo",
+            "md_content": ["中文文档 😀 \"quoted\"\n"],
+            "code_start_line": 1,
+            "code_end_line": 2,
+            "params": [],
+            "have_return": False,
+            "code_content": "def foo():\n    pass\n",
+            "name_column": 4,
+            "item_status": "doc_up_to_date",
+            "who_reference_me": [],
+            "reference_who": ["pkg/b.py/bar"],
+            "special_reference_type": [False],
+        }
+    ]
+}
+
+
+@unittest.skipIf(get_json_codec is None, "json_codec dependencies missing")
+class TestJsonCodec(unittest.TestCase):
+    def test_all_codecs_match_stdlib_output(self):
+        indented = json.dumps(HIERARCHY, indent=2, ensure_ascii=False).encode("utf-8")
+        compact = json.dumps(HIERARCHY, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        for name in available_codecs():
+            with self.subTest(codec=name):
+                codec = get_json_codec(name)
+                self.assertEqual(codec.dumps(HIERARCHY), indented)
+                self.assertEqual(codec.dumps(HIERARCHY, compact=True), compact)
+                self.assertEqual(codec.loads_hierarchy(indented), HIERARCHY)
+
+    def test_hierarchy_keeps_unknown_keys(self):
+        record = dict(HIERARCHY["pkg/a.py"][0], code_hash="0" * 40, added_by_newer_version=1)
+        data = json.dumps({"pkg/a.py": [record]}).encode("utf-8")
+        for name in available_codecs():
+            with self.subTest(codec=name):
+                self.assertEqual(get_json_codec(name).loads_hierarchy(data)["pkg/a.py"][0], record)
+
+    @unittest.skipIf(get_json_codec is None or "msgspec" not in available_codecs(), "msgspec is not installed")
+    def test_msgspec_hierarchy_keeps_unknown_keys(self):
+        data = b'{"pkg/a.py": [{"name": "foo", "code_hash": "abc", "added_by_newer_version": [1]}]}'
+        record = get_json_codec("msgspec").loads_hierarchy(data)["pkg/a.py"][0]
+        self.assertEqual(record["code_hash"], "abc")
+        self.assertEqual(record["added_by_newer_version"], [1])
+
+    def test_truncated_input_raises_value_error(self):
+        for name in available_codecs():
+            with self.subTest(codec=name):
+                with self.assertRaises(ValueError):
+                    get_json_codec(name).loads(b'{"key_path": ["pkg", "a.p')
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            get_json_codec("not-a-codec")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+try:
+    import httpx
+    import openai
+    from llama_index.core.llms import ChatMessage, ChatResponse, MessageRole
+
+    from repo_agent.chat_engine import ChatEngine
+    from repo_agent.llm_pool import LlmEndpoint, LlmEndpointPool
+    from repo_agent.settings import LlmRouting
+    from spooky.llm import LocalModelError
+    from tests.settings_helper import init_test_settings
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    LlmEndpointPool = None
+
+
+class FakeHealthClient:
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+
+    def ping(self):
+        if not self.healthy:
+            raise LocalModelError("down")
+        return {"provider": "fake"}
+
+
+class FakeLLM:
+    def __init__(self, name, down=False, model="gpt-4o-mini"):
+        self.name = name
+        self.down = down
+        self.model = model
+        self.call_count = 0
+
+    def chat(self, messages):
+        self.call_count += 1
+        if self.down:
+            raise openai.APIConnectionError(request=httpx.Request("POST", "http://down/v1/chat/completions"))
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=f"doc from {self.name}"))
+
+
+@unittest.skipIf(LlmEndpointPool is None, "LLM pool dependencies missing")
+class TestLlmEndpointPool(unittest.TestCase):
+    def make_pool(self, routing=LlmRouting.LEAST_OUTSTANDING):
+        self.health = {name: FakeHealthClient() for name in ["a", "b"]}
+        return LlmEndpointPool(
+            [LlmEndpoint(name, FakeLLM(name), self.health[name]) for name in ["a", "b"]],
+            routing=routing,
+        )
+
+    def test_least_outstanding(self):
+        pool = self.make_pool()
+        first, second = pool.acquire(), pool.acquire()
+        self.assertEqual({first.name, second.name}, {"a", "b"})
+        pool.release(first, latency=1.0)
+        self.assertIs(pool.acquire(), first)
+
+    def test_latency_weighted(self):
+        pool = self.make_pool(LlmRouting.LATENCY_WEIGHTED)
+        a, b = pool.endpoints
+        a.latency, b.latency = 4.0, 1.0
+        chosen = [pool.acquire().name for _ in range(4)]
+        # b: 1, 2, 3, 4; a: 4 —— 前三个请求都给更快的b
+        self.assertEqual(chosen[:3], ["b", "b", "b"])
+
+    def test_failover_and_recovery(self):
+        pool = self.make_pool()
+        a, b = pool.endpoints
+        pool.release(pool.acquire(), failed=True)  # a挂了
+        self.assertFalse(a.healthy)
+        self.assertEqual([pool.acquire().name for _ in range(2)], ["b", "b"])
+
+        pool.check_health()
+        self.assertTrue(a.healthy)
+        self.health["b"].healthy = False
+        pool.check_health()
+        self.assertFalse(b.healthy)
+        self.assertEqual(pool.acquire().name, "a")
+
+    def test_last_healthy_endpoint_stays(self):
+        pool = self.make_pool()
+        pool.endpoints[1].healthy = False
+        pool.release(pool.acquire(), failed=True)
+        self.assertTrue(pool.endpoints[0].healthy)
+
+    def test_from_models_config(self):
+        config_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_dir)
+        config_path = Path(config_dir) / "models.yaml"
+        config_path.write_text(
+            "local_servers:\n"
+            "  ollama:\n    provider: ollama\n    base_url: http://ollama:11434\n    model: qwen3:0.6b\n"
+            "  vllm:\n    provider: openai-compatible\n    base_url: http://gpu:8000\n"
+            "    chat_base_url: http://gpu:8000/openai/v1\n",
+            encoding="utf-8",
+        )
+        built = []
+        pool = LlmEndpointPool.from_models_config(
+            config_path, ["ollama", "vllm"], lambda *args: built.append(args) or FakeLLM("x")
+        )
+        self.assertEqual([endpoint.name for endpoint in pool.endpoints], ["ollama", "vllm"])
+        self.assertEqual(
+            built,
+            [("http://ollama:11434/v1", None, "qwen3:0.6b"), ("http://gpu:8000/openai/v1", None, None)],
+        )
+        with self.assertRaises(ValueError):
+            LlmEndpointPool.from_models_config(config_path, ["missing"], lambda *args: None)
+
+
+@unittest.skipIf(LlmEndpointPool is None, "LLM pool dependencies missing")
+class TestChatEngineFailover(unittest.TestCase):
+    def test_requests_fail_over_to_healthy_endpoint(self):
+        repo_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, repo_path)
+        init_test_settings(repo_path, llm_cache_size=0)
+        engine = ChatEngine(project_manager=None)
+        down, up = FakeLLM("down", down=True), FakeLLM("up")
+        engine.llm_pool = LlmEndpointPool([LlmEndpoint("down", down), LlmEndpoint("up", up)])
+
+        self.assertEqual(engine.complete([]), ("doc from up", True))
+        self.assertEqual(down.call_count, 1)
+        self.assertFalse(engine.llm_pool.endpoints[0].healthy)
+        self.assertEqual(engine.complete([]), ("doc from up", True))
+        self.assertEqual(down.call_count, 1)
+
+    def test_cache_key_covers_the_models_of_all_endpoints(self):
+        repo_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, repo_path)
+        init_test_settings(repo_path, llm_cache_size=0)
+        messages = [ChatMessage(role=MessageRole.USER, content="document get_x")]
+        single_model_key = ChatEngine(project_manager=None).get_cache_key(messages)
+
+        init_test_settings(repo_path, llm_cache_size=0, llm_servers=["ollama", "llmserver_rs"])
+        pool = LlmEndpointPool(
+            [
+                LlmEndpoint("ollama", FakeLLM("ollama", model="qwen3:0.6b")),
+                LlmEndpoint("llmserver_rs", FakeLLM("llmserver_rs", model="tinyllama")),
+            ]
+        )
+        with mock.patch.object(LlmEndpointPool, "from_models_config", return_value=pool):
+            engine = ChatEngine(project_manager=None)
+        self.addCleanup(pool.close)
+
+        self.assertEqual(engine.models, ["qwen3:0.6b", "tinyllama"])
+        self.assertNotEqual(engine.get_cache_key(messages), single_model_key)
+
+
+if __name__ == "__main__":
+    unittest.main()
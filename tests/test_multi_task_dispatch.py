@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import unittest
+
+try:
+    from repo_agent.multi_task_dispatch import TaskManager, async_worker, worker
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    TaskManager = None
+    async_worker = None
+    worker = None
+
+
+@unittest.skipIf(TaskManager is None, "multi_task_dispatch dependencies missing")
+class TestTaskManager(unittest.TestCase):
+    def setUp(self):
+        assert TaskManager is not None  # for type checkers
+        self.task_manager = TaskManager()
+
+    def test_only_tasks_without_dependencies_are_ready(self):
+        i1 = self.task_manager.add_task([], extra="a")
+        self.task_manager.add_task([i1], extra="b")
+
+        task, task_id = self.task_manager.get_next_task(0)
+        self.assertEqual(task_id, i1)
+        # 依赖未完成时，非阻塞获取不到任务
+        self.assertEqual(self.task_manager.get_next_task(0), (None, -1))
+
+    def test_mark_completed_releases_dependents(self):
+        i1 = self.task_manager.add_task([], extra="a")
+        i2 = self.task_manager.add_task([], extra="b")
+        i3 = self.task_manager.add_task([i1, i2], extra="c")
+
+        self.task_manager.get_next_task(0)
+        self.task_manager.get_next_task(0)
+        self.task_manager.mark_completed(i1)
+        self.assertEqual(self.task_manager.get_next_task(0), (None, -1))
+        self.task_manager.mark_completed(i2)
+
+        task, task_id = self.task_manager.get_next_task(0)
+        self.assertEqual(task_id, i3)
+        self.task_manager.mark_completed(i3)
+        self.assertTrue(self.task_manager.all_success)
+
+    def test_progress(self):
+        i1 = self.task_manager.add_task([], extra="a")
+        self.task_manager.add_task([i1], extra="b")
+        self.assertEqual(self.task_manager.get_progress(), "completed(0/2)")
+        self.task_manager.get_next_task(0)
+        self.task_manager.mark_completed(i1)
+        self.assertTrue(self.task_manager.get_progress().startswith("completed(1/2), "))
+
+    def test_workers_respect_dependency_order(self):
+        assert worker is not None  # for type checkers
+        finished = []
+        finished_lock = threading.Lock()
+        i1 = self.task_manager.add_task([], extra=1)
+        i2 = self.task_manager.add_task([i1], extra=2)
+        i3 = self.task_manager.add_task([i1], extra=3)
+        self.task_manager.add_task([i2, i3], extra=4)
+
+        def handler(extra):
+            with finished_lock:
+                finished.append(extra)
+
+        threads = [
+            threading.Thread(target=worker, args=(self.task_manager, pid, handler))
+            for pid in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+
+        self.assertTrue(self.task_manager.all_success)
+        self.assertEqual(finished[0], 1)
+        self.assertEqual(finished[-1], 4)
+        self.assertEqual(sorted(finished), [1, 2, 3, 4])
+
+    def test_async_worker_bounds_concurrency(self):
+        assert async_worker is not None  # for type checkers
+        in_flight = 0
+        max_in_flight = 0
+        finished = []
+        root = self.task_manager.add_task([], extra="root")
+        for index in range(8):
+            self.task_manager.add_task([root], extra=index)
+
+        async def handler(extra):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            finished.append(extra)
+
+        asyncio.run(async_worker(self.task_manager, handler, max_concurrency=3))
+
+        self.assertTrue(self.task_manager.all_success)
+        self.assertEqual(finished[0], "root")
+        self.assertEqual(len(finished), 9)
+        self.assertLessEqual(max_in_flight, 3)
+
+    def test_workers_batch_ready_tasks_with_the_same_key(self):
+        assert worker is not None  # for type checkers
+        batches = []
+        root = self.task_manager.add_task([], extra=("a.py", "root"))
+        for name in ["x", "y", "z"]:
+            self.task_manager.add_task([root], extra=("a.py", name))
+        self.task_manager.add_task([root], extra=("b.py", "w"))
+        self.task_manager.add_task([root], extra=(None, "big"))
+        self.task_manager.enable_batching(lambda extra: extra[0])
+
+        def handler(extra):
+            batches.append([extra[1]])
+
+        def batch_handler(extras):
+            batches.append([extra[1] for extra in extras])
+
+        worker(self.task_manager, 0, handler, batch_handler=batch_handler, max_batch_size=2)
+
+        self.assertTrue(self.task_manager.all_success)
+        self.assertEqual(batches, [["root"], ["x", "y"], ["z"], ["w"], ["big"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
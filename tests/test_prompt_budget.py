@@ -0,0 +1,71 @@
+import shutil
+import tempfile
+import unittest
+
+try:
+    from repo_agent.chat_engine import ChatEngine
+    from repo_agent.doc_meta_info import DocItem, DocItemType
+    from repo_agent.prompt_budget import TokenCounter, get_tree_distance
+    from tests.settings_helper import init_test_settings
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    ChatEngine = None
+
+
+def add_function(father, name, code_content):
+    child = DocItem(
+        item_type=DocItemType._function,
+        obj_name=name,
+        content={"type": "FunctionDef", "name": name, "code_content": code_content, "have_return": True},
+        md_content=[f"The document of {name}."],
+    )
+    father.add_child(name, child)
+    return child
+
+
+@unittest.skipIf(ChatEngine is None, "ChatEngine dependencies missing")
+class TestPromptBudget(unittest.TestCase):
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        root = DocItem(item_type=DocItemType._repo, obj_name="full_repo")
+        near_file = DocItem(item_type=DocItemType._file, obj_name="hub.py")
+        far_file = DocItem(item_type=DocItemType._file, obj_name="callers.py")
+        root.add_child("hub.py", near_file)
+        root.add_child("callers.py", far_file)
+        self.hub = add_function(near_file, "hub", "def hub():\n    return 1\n")
+        self.near_caller = add_function(near_file, "near", "def near():\n    return hub()\n")
+        self.hub.who_reference_me.append(self.near_caller)
+        for i in range(50):
+            caller = add_function(far_file, f"far_{i}", f"def far_{i}():\n" + "    x = hub()\n" * 20)
+            self.hub.who_reference_me.append(caller)
+
+    def tearDown(self):
+        shutil.rmtree(self.repo_path)
+
+    def make_engine(self, max_prompt_tokens):
+        init_test_settings(self.repo_path, llm_cache_size=0, max_prompt_tokens=max_prompt_tokens)
+        return ChatEngine(project_manager=None)
+
+    def test_tree_distance(self):
+        self.assertEqual(get_tree_distance(self.hub, self.near_caller), 2)
+        self.assertEqual(get_tree_distance(self.hub, self.hub.who_reference_me[1]), 4)
+
+    def test_prompt_unchanged_within_budget(self):
+        unlimited = self.make_engine(0).build_prompt(self.hub)
+        engine = self.make_engine(1_000_000)
+        self.assertEqual(engine.build_prompt(self.hub), unlimited)
+        self.assertEqual(engine.prompt_stats.trimmed_prompt_count, 0)
+
+    def test_references_trimmed_to_budget(self):
+        engine = self.make_engine(2000)
+        messages = engine.build_prompt(self.hub)
+        counter = TokenCounter("gpt-4o-mini")
+        self.assertLessEqual(sum(counter.count(m.content) for m in messages), 2000)
+        system_prompt = messages[0].content
+        self.assertIn("def near():", system_prompt)  # 最近的调用者保留了源码
+        self.assertIn("more objects are omitted for length", system_prompt)
+        self.assertEqual(engine.prompt_stats.trimmed_prompt_count, 1)
+        self.assertGreater(engine.prompt_stats.full_tokens, engine.prompt_stats.sent_tokens)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from repo_agent.reference_index import ReferenceIndex
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    ReferenceIndex = None
+
+
+@unittest.skipIf(ReferenceIndex is None, "ReferenceIndex dependencies missing")
+class TestReferenceIndex(unittest.TestCase):
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        with open(os.path.join(self.repo_path, "lib.py"), "w") as f:
+            f.write("def helper():\n    return 1\n\n\ndef unused():\n    pass\n")
+        with open(os.path.join(self.repo_path, "app.py"), "w") as f:
+            f.write("from lib import helper\n\n\ndef main():\n    return helper()\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.repo_path)
+
+    def test_find_all_referencer(self):
+        assert ReferenceIndex is not None  # for type checkers
+        index = ReferenceIndex(self.repo_path).build(["lib.py", "app.py"])
+
+        referencers = index.find_all_referencer("helper", "lib.py", 1, 4)
+        self.assertEqual(referencers, [("app.py", 1, 16), ("app.py", 5, 11)])
+        # 只在文件内查找时，其他文件的引用被过滤掉
+        self.assertEqual(
+            index.find_all_referencer("helper", "lib.py", 1, 4, in_file_only=True), []
+        )
+        self.assertEqual(index.find_all_referencer("unused", "lib.py", 5, 4), [])
+        # 没有被索引的定义位置返回None，由调用方回退到jedi
+        self.assertIsNone(index.find_all_referencer("helper", "lib.py", 2, 0))
+
+    def test_process_pool_matches_serial(self):
+        assert ReferenceIndex is not None  # for type checkers
+        file_paths = ["lib.py", "app.py"]
+        serial = ReferenceIndex(self.repo_path).build(file_paths)
+        parallel = ReferenceIndex(self.repo_path).build(file_paths, process_count=2)
+
+        self.assertEqual(serial.definitions, parallel.definitions)
+        self.assertEqual(serial.references, parallel.references)
+
+    def test_cache_reresolves_dependents_of_changed_files(self):
+        assert ReferenceIndex is not None  # for type checkers
+        cache_path = os.path.join(self.repo_path, ".project_doc_record", "reference_cache.json")
+        file_paths = ["lib.py", "app.py"]
+        ReferenceIndex(self.repo_path, cache_path=cache_path).build(file_paths)
+        self.assertTrue(os.path.exists(cache_path))
+
+        # lib.py的定义行号变了，app.py虽然没改，但依赖lib.py，也必须重新解析
+        with open(os.path.join(self.repo_path, "lib.py"), "w") as f:
+            f.write("import os\n\n\ndef helper():\n    return 1\n")
+        index = ReferenceIndex(self.repo_path, cache_path=cache_path).build(file_paths)
+
+        self.assertEqual(
+            index.find_all_referencer("helper", "lib.py", 4, 4),
+            [("app.py", 1, 16), ("app.py", 5, 11)],
+        )
+        self.assertIsNone(index.find_all_referencer("helper", "lib.py", 1, 4))
+
+    def test_cache_reresolves_names_that_became_targets(self):
+        assert ReferenceIndex is not None  # for type checkers
+        cache_path = os.path.join(self.repo_path, ".project_doc_record", "reference_cache.json")
+        with open(os.path.join(self.repo_path, "app.py"), "w") as f:
+            f.write("import lib\n\n\ndef main():\n    return lib.newfunc()\n")
+        file_paths = ["lib.py", "app.py"]
+        ReferenceIndex(
+            self.repo_path, target_names={"helper", "unused", "main"}, cache_path=cache_path
+        ).build(file_paths)
+
+        # newfunc后来才加到lib.py，app.py没有改，缓存时跳过了newfunc，也没有记录对lib.py的依赖
+        with open(os.path.join(self.repo_path, "lib.py"), "a") as f:
+            f.write("\n\ndef newfunc():\n    pass\n")
+        index = ReferenceIndex(
+            self.repo_path,
+            target_names={"helper", "unused", "main", "newfunc"},
+            cache_path=cache_path,
+        ).build(file_paths)
+
+        self.assertEqual(
+            index.find_all_referencer("newfunc", "lib.py", 9, 4), [("app.py", 5, 15)]
+        )
+
+    def test_cache_reresolves_importers_of_changed_modules(self):
+        assert ReferenceIndex is not None  # for type checkers
+        cache_path = os.path.join(self.repo_path, ".project_doc_record", "reference_cache.json")
+        with open(os.path.join(self.repo_path, "other.py"), "w") as f:
+            f.write("def run():\n    pass\n")
+        with open(os.path.join(self.repo_path, "app.py"), "w") as f:
+            f.write("import lib\n\n\ndef main():\n    return lib.run()\n")
+        file_paths = ["lib.py", "other.py", "app.py"]
+        target_names = {"helper", "unused", "run", "main"}
+        ReferenceIndex(self.repo_path, target_names=target_names, cache_path=cache_path).build(file_paths)
+
+        # app.py没有改，lib.run()在缓存时解析不到任何文件，只能靠对lib.py的import依赖发现变化
+        with open(os.path.join(self.repo_path, "lib.py"), "a") as f:
+            f.write("\n\ndef run():\n    pass\n")
+        index = ReferenceIndex(
+            self.repo_path, target_names=target_names, cache_path=cache_path
+        ).build(file_paths)
+
+        self.assertEqual(index.find_all_referencer("run", "lib.py", 9, 4), [("app.py", 5, 15)])
+
+
+if __name__ == "__main__":
+    unittest.main()
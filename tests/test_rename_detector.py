@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import git
+
+    from repo_agent.doc_meta_info import DocItemStatus, MetaInfo
+    from repo_agent.rename_detector import normalize_code
+    from tests.settings_helper import init_test_settings
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    MetaInfo = None
+
+
+@unittest.skipIf(MetaInfo is None, "rename detection dependencies missing")
+class TestRenameDetection(unittest.TestCase):
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        self.repo = git.Repo.init(self.repo_path)
+        self.write("pkg/a.py", "def foo(x):\n    return x + 1\n\n\ndef bar():\n    return 2\n")
+        self.repo.index.add(["pkg/a.py"])
+        self.repo.index.commit("init")
+        init_test_settings(self.repo_path)
+        self.older_meta = MetaInfo.init_meta_info({}, [])
+        self.older_meta.document_version = self.repo.head.commit.hexsha
+        for item in self.older_meta.get_item_index().values():
+            item.md_content = [f"doc of {item.obj_name}"]
+            item.item_status = DocItemStatus.doc_up_to_date
+
+    def tearDown(self):
+        shutil.rmtree(self.repo_path)
+
+    def write(self, file_name, content):
+        os.makedirs(os.path.dirname(os.path.join(self.repo_path, file_name)), exist_ok=True)
+        with open(os.path.join(self.repo_path, file_name), "w") as f:
+            f.write(content)
+
+    def merge(self):
+        new_meta = MetaInfo.init_meta_info({}, [])
+        new_meta.load_doc_from_older_meta(self.older_meta)
+        return new_meta
+
+    def test_git_rename_keeps_documents(self):
+        self.repo.index.move(["pkg/a.py", "pkg/b.py"])
+        new_meta = self.merge()
+        foo = new_meta.find_item_by_key_path(["pkg", "b.py", "foo"])
+        self.assertEqual(foo.md_content, ["doc of foo"])
+        self.assertEqual(foo.item_status, DocItemStatus.doc_up_to_date)
+        self.assertEqual(new_meta.deleted_items_from_older_meta, [["pkg/a.py", "_file"]])
+
+    def test_git_rename_keeps_referenced_documents(self):
+        self.write("pkg/a.py", "def foo(x):\n    return x + 1\n\n\ndef bar():\n    return foo(2)\n")
+        self.repo.index.add(["pkg/a.py"])
+        self.repo.index.commit("bar calls foo")
+        older_meta = MetaInfo.init_meta_info({}, [])
+        older_meta.parse_reference()
+        for item in older_meta.get_item_index().values():
+            item.md_content = [f"doc of {item.obj_name}"]
+            item.item_status = DocItemStatus.doc_up_to_date
+        # 和真实的运行一样，旧版本从保存的记录中加载，引用者只有名字
+        self.older_meta = MetaInfo.from_project_hierarchy_json(
+            older_meta.to_hierarchy_json(flash_reference_relation=True)
+        )
+        self.older_meta.document_version = self.repo.head.commit.hexsha
+
+        self.repo.index.move(["pkg/a.py", "pkg/b.py"])
+        new_meta = self.merge()
+        # foo的引用者pkg/a.py/bar变成了pkg/b.py/bar，但还是同一个对象
+        for name in ["foo", "bar"]:
+            item = new_meta.find_item_by_key_path(["pkg", "b.py", name])
+            self.assertEqual(item.md_content, [f"doc of {name}"])
+            self.assertEqual(item.item_status, DocItemStatus.doc_up_to_date)
+
+    def test_renamed_and_moved_functions(self):
+        os.remove(os.path.join(self.repo_path, "pkg", "a.py"))
+        self.write("pkg/c.py", "def increment(x):\n    return x + 1\n")
+        self.write("pkg/d.py", "class Holder:\n    def bar(self):\n        return 2\n")
+        new_meta = self.merge()
+
+        increment = new_meta.find_item_by_key_path(["pkg", "c.py", "increment"])
+        self.assertEqual(increment.md_content, ["doc of foo"])
+        self.assertEqual(increment.item_status, DocItemStatus.code_changed)
+        bar = new_meta.find_item_by_key_path(["pkg", "d.py", "Holder", "bar"])
+        self.assertEqual(bar.md_content, ["doc of bar"])
+        self.assertEqual(bar.item_status, DocItemStatus.code_changed)  # 多了self参数
+        holder = new_meta.find_item_by_key_path(["pkg", "d.py", "Holder"])
+        self.assertEqual(holder.item_status, DocItemStatus.doc_has_not_been_generated)
+
+    def test_ambiguous_matches_are_not_carried_over(self):
+        os.remove(os.path.join(self.repo_path, "pkg", "a.py"))
+        self.write("pkg/c.py", "def one():\n    return 2\n\n\ndef two():\n    return 2\n")
+        self.write("pkg/d.py", "def one():\n    return 2\n\n\ndef bar():\n    return 2\n")
+        new_meta = self.merge()
+
+        # 三个对象的代码都和bar相同，只有同名的那个能确定是bar
+        self.assertEqual(new_meta.find_item_by_key_path(["pkg", "d.py", "bar"]).md_content, ["doc of bar"])
+        for key_path in [["pkg", "c.py", "one"], ["pkg", "c.py", "two"], ["pkg", "d.py", "one"]]:
+            self.assertEqual(new_meta.find_item_by_key_path(key_path).md_content, [])
+
+    def test_normalize_code(self):
+        self.assertEqual(
+            normalize_code("    def foo():\n\n        return foo\n", "foo"),
+            normalize_code("def bar():\n    return bar\n", "bar"),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
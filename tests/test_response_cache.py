@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from llama_index.core.llms import ChatMessage, MessageRole
+
+    from repo_agent.response_cache import ResponseCache, make_cache_key
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    ResponseCache = None
+
+
+@unittest.skipIf(ResponseCache is None, "ResponseCache dependencies missing")
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.cache_dir, ".project_doc_record", "llm_cache.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_cache_key_depends_on_prompt_and_sampling(self):
+        messages = [
+            ChatMessage(role=MessageRole.SYSTEM, content="system"),
+            ChatMessage(role=MessageRole.USER, content="user"),
+        ]
+        key = make_cache_key("gpt-4o-mini", 0.2, messages)
+        self.assertEqual(key, make_cache_key("gpt-4o-mini", 0.2, list(messages)))
+        self.assertNotEqual(key, make_cache_key("gpt-4o", 0.2, messages))
+        self.assertNotEqual(key, make_cache_key("gpt-4o-mini", 0.7, messages))
+        self.assertNotEqual(key, make_cache_key("gpt-4o-mini", 0.2, messages[:1]))
+
+    def test_persists_and_evicts_least_recently_used(self):
+        cache = ResponseCache(self.cache_path, max_entries=2)
+        cache.put("a", "doc a")
+        cache.put("b", "doc b")
+        self.assertEqual(cache.get("a"), "doc a")  # a 变成最近使用的
+        cache.put("c", "doc c")
+        cache.close()
+
+        reloaded = ResponseCache(self.cache_path, max_entries=2)
+        self.assertIsNone(reloaded.get("b"))
+        self.assertEqual(reloaded.get("a"), "doc a")
+        self.assertEqual(reloaded.get("c"), "doc c")
+        self.assertEqual((reloaded.hit_count, reloaded.miss_count), (2, 1))
+        reloaded.close()
+
+    def test_bypass_only_writes(self):
+        cache = ResponseCache(self.cache_path, max_entries=10, bypass=True)
+        cache.put("a", "doc a")
+        self.assertIsNone(cache.get("a"))
+        cache.close()
+        self.assertEqual(ResponseCache(self.cache_path, max_entries=10).get("a"), "doc a")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import asyncio
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+try:
+    from llama_index.core.llms import ChatMessage, ChatResponse, MessageRole
+
+    from repo_agent.chat_engine import ChatEngine
+    from tests.settings_helper import init_test_settings
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    ChatEngine = None
+
+
+class FakeStreamingLLM:
+    """按token逐个返回固定响应的LLM"""
+
+    def __init__(self, tokens, finish_reason="stop"):
+        self.tokens = tokens
+        self.finish_reason = finish_reason
+        self.closed = False
+        self.sent_count = 0
+
+    def responses(self):
+        content = ""
+        for index, token in enumerate(self.tokens):
+            content += token
+            self.sent_count += 1
+            finish_reason = self.finish_reason if index == len(self.tokens) - 1 else None
+            yield ChatResponse(
+                message=ChatMessage(role=MessageRole.ASSISTANT, content=content),
+                delta=token,
+                raw=SimpleNamespace(choices=[SimpleNamespace(finish_reason=finish_reason)]),
+            )
+
+    def stream_chat(self, messages):
+        def gen():
+            try:
+                yield from self.responses()
+            finally:
+                self.closed = True
+
+        return gen()
+
+    async def astream_chat(self, messages):
+        async def gen():
+            try:
+                for response in self.responses():
+                    yield response
+            finally:
+                self.closed = True
+
+        return gen()
+
+
+@unittest.skipIf(ChatEngine is None, "ChatEngine dependencies missing")
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.repo_path)
+
+    def make_engine(self, max_completion_tokens=0):
+        init_test_settings(
+            self.repo_path,
+            llm_cache_size=0,
+            stream=True,
+            max_completion_tokens=max_completion_tokens,
+        )
+        return ChatEngine(project_manager=None)
+
+    def test_stream_records_metrics(self):
+        engine = self.make_engine()
+        engine.llm = FakeStreamingLLM(["**foo**", ": ", "does", " things"])
+        self.assertEqual(engine.complete([]), ("**foo**: does things", True))
+        self.assertEqual(engine.stream_stats.request_count, 1)
+        self.assertEqual(engine.stream_stats.token_count, 4)
+        self.assertEqual(len(engine.stream_stats.first_token_latencies), 1)
+
+    def test_runaway_generation_is_cut_off(self):
+        engine = self.make_engine(max_completion_tokens=3)
+        engine.llm = FakeStreamingLLM(["again "] * 100)
+        content, finished = engine.complete([])
+        self.assertEqual(content, "again " * 3)
+        self.assertFalse(finished)
+        self.assertTrue(engine.llm.closed)
+        self.assertEqual(engine.llm.sent_count, 3)
+        self.assertEqual(engine.stream_stats.truncated_count, 1)
+
+    def test_backend_cut_off_is_detected(self):
+        engine = self.make_engine(max_completion_tokens=100)
+        engine.llm = FakeStreamingLLM(["**foo**", ": ", "does"], finish_reason="length")
+        self.assertEqual(engine.complete([]), ("**foo**: does", False))
+        self.assertEqual(engine.stream_stats.truncated_count, 1)
+
+    def test_async_stream(self):
+        engine = self.make_engine(max_completion_tokens=2)
+        engine.llm = FakeStreamingLLM(["a", "b", "c"])
+        self.assertEqual(asyncio.run(engine.acomplete([])), ("ab", False))
+        self.assertTrue(engine.llm.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
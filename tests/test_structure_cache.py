@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from repo_agent.structure_cache import StructureCache, get_blob_hash
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    StructureCache = None
+    get_blob_hash = None
+
+
+@unittest.skipIf(StructureCache is None, "StructureCache dependencies missing")
+class TestStructureCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.cache_dir, ".project_doc_record", "structure_cache.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_blob_hash_matches_git(self):
+        assert get_blob_hash is not None  # for type checkers
+        # git hash-object 对空文件的结果
+        self.assertEqual(get_blob_hash(b""), "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391")
+
+    def test_persists_and_evicts_least_recently_used(self):
+        assert StructureCache is not None  # for type checkers
+        cache = StructureCache(self.cache_path, max_entries=2)
+        cache.put("a", [{"name": "a"}])
+        cache.put("b", [{"name": "b"}])
+        self.assertEqual(cache.get("a"), [{"name": "a"}])  # a 变成最近使用的
+        cache.put("c", [{"name": "c"}])
+        cache.save()
+
+        reloaded = StructureCache(self.cache_path, max_entries=2)
+        self.assertIsNone(reloaded.get("b"))
+        self.assertEqual(reloaded.get("a"), [{"name": "a"}])
+        self.assertEqual(reloaded.get("c"), [{"name": "c"}])
+        self.assertEqual((reloaded.hit_count, reloaded.miss_count), (2, 1))
+
+    def test_get_returns_a_copy(self):
+        assert StructureCache is not None  # for type checkers
+        cache = StructureCache(self.cache_path, max_entries=2)
+        cache.put("a", [{"name": "a", "md_content": []}])
+        cache.get("a")[0]["md_content"].append("doc")
+        self.assertEqual(cache.get("a"), [{"name": "a", "md_content": []}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+from unittest import mock
+
+try:
+    from repo_agent.doc_meta_info import DocItem, DocItemType, MetaInfo
+except ModuleNotFoundError:  # pragma: no cover - optional dependencies might be missing
+    MetaInfo = None
+
+
+def is_function(item):
+    return item.item_type == DocItemType._function
+
+
+@unittest.skipIf(MetaInfo is None, "MetaInfo dependencies missing")
+class TestTopology(unittest.TestCase):
+    def setUp(self):
+        self.root = DocItem(item_type=DocItemType._repo, obj_name="full_repo")
+        self.file_item = DocItem(item_type=DocItemType._file, obj_name="a.py")
+        self.root.add_child("a.py", self.file_item)
+        self.meta_info = MetaInfo(target_repo_hierarchical_tree=self.root)
+
+    def add_function(self, name, father=None):
+        item = DocItem(item_type=DocItemType._function, obj_name=name)
+        (father or self.file_item).add_child(name, item)
+        return item
+
+    def add_reference(self, referencer, referenced, special=False):
+        referencer.reference_who.append(referenced)
+        referencer.special_reference_type.append(special)
+        referenced.who_reference_me.append(referencer)
+
+    def build_task_manager(self):
+        self.root.check_depth()
+        with mock.patch.object(MetaInfo, "parse_reference"):
+            return self.meta_info.get_topology(is_function)
+
+    def task_order(self, task_manager):
+        return [task_manager.task_dict[task_id].extra_info.obj_name for task_id in sorted(task_manager.task_dict)]
+
+    def test_dag_follows_references_and_children(self):
+        outer = self.add_function("outer")
+        inner = self.add_function("inner", father=outer)
+        base = self.add_function("base")
+        middle = self.add_function("middle")
+        self.add_reference(middle, base)
+        self.add_reference(inner, middle)
+
+        task_manager = self.build_task_manager()
+        order = self.task_order(task_manager)
+        self.assertEqual(sorted(order), ["base", "inner", "middle", "outer"])
+        for referencer, referenced in [("middle", "base"), ("inner", "middle"), ("outer", "inner")]:
+            self.assertLess(order.index(referenced), order.index(referencer))
+        # 每个任务依赖它引用的对象和它的子对象
+        outer_task = task_manager.task_dict[outer.multithread_task_id]
+        self.assertEqual([task.task_id for task in outer_task.dependencies], [inner.multithread_task_id])
+        middle_task = task_manager.task_dict[middle.multithread_task_id]
+        self.assertEqual([task.task_id for task in middle_task.dependencies], [base.multithread_task_id])
+
+    def test_cycle_is_broken_at_special_reference(self):
+        caller = self.add_function("caller")
+        callee = self.add_function("callee")
+        self.add_reference(caller, callee)
+        self.add_reference(callee, caller, special=True)
+
+        task_manager = self.build_task_manager()
+        # 只有special引用没有处理的callee先生成，caller依赖callee
+        self.assertEqual(self.task_order(task_manager), ["callee", "caller"])
+        caller_task = task_manager.task_dict[caller.multithread_task_id]
+        self.assertEqual([task.task_id for task in caller_task.dependencies], [callee.multithread_task_id])
+
+    def test_cycles_are_reported(self):
+        first = self.add_function("first")
+        second = self.add_function("second")
+        third = self.add_function("third")
+        alone = self.add_function("alone")
+        self.add_reference(first, second)
+        self.add_reference(second, third)
+        self.add_reference(third, first)
+        self.add_reference(alone, first)
+
+        doc_items = [first, second, third, alone]
+        position = {id(item): pos for pos, item in enumerate(doc_items)}
+        cycles = MetaInfo.report_reference_cycles(doc_items, position, is_function)
+        self.assertEqual(len(cycles), 1)
+        self.assertEqual(sorted(item.obj_name for item in cycles[0]), ["first", "second", "third"])
+
+        # 成环时所有对象仍然各生成一个任务
+        task_manager = self.build_task_manager()
+        self.assertEqual(sorted(self.task_order(task_manager)), ["alone", "first", "second", "third"])
+        self.assertEqual(self.task_order(task_manager)[-1], "alone")
+
+
+if __name__ == "__main__":
+    unittest.main()